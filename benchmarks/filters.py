@@ -0,0 +1,372 @@
+"""Word filter benchmark
+
+The filter runs on every message of every server, through Mod's
+check_filter listener. This generates filter rules and message corpora
+and measures them for every combination of filter size, message length,
+script mix and hit rate asked for:
+
+  - compile time and memory of a compiled filter (tracemalloc)
+  - messages per second, p50 and p99 latency of a message
+
+By default the engines in ENGINES are timed directly. With --check-filter
+red.py is booted with the Mod cog against the stub gateway (see
+stub_gateway.py) and Mod.check_filter itself is timed, cache lookups,
+permission checks and the deletion (recorded, not sent) included. Every
+filter gets a server of its own and a server without rules is timed too.
+
+The rules mix plain words, w: whole words, prefixes, n: normalized rules
+and a few regexes. Hits are written the way each rule catches them (n:
+hits have a zero width space inside). Messages can also contain a rule
+by chance, the hit column is the rate actually measured.
+
+Usage:
+    python benchmarks/filters.py --terms 10,1000,50000 --lengths 50,500
+    python benchmarks/filters.py --check-filter --terms 10,10000
+    python benchmarks/filters.py --json results.json
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import os
+import random
+import re
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import stub_gateway
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Name: (module, class) of a matcher built from the rules, with a
+# search(content) method. New matchers are added here to be compared with
+# the current one. Imported when used, so --check-filter gets the cogs of
+# its scratch directory
+ENGINES = {"matcher": ("cogs.utils.filtering", "FilterMatcher")}
+
+LATIN = "abcdefghijklmnopqrstuvwxyz"
+ACCENTED = LATIN + "àáâäçèéêëìíîïñòóôöùúûüß"
+CYRILLIC = "абвгдежзийклмнопрстуфхцчшщыэюя"
+CJK = "".join(chr(c) for c in range(0x4e00, 0x4e00 + 400))
+EMOJI = "".join(chr(c) for c in range(0x1f600, 0x1f640))
+PUNCTUATION = ",.!?"
+# Script: ((alphabet, weight), ...), a word is written in one alphabet
+SCRIPTS = {
+    "ascii": ((LATIN, 1),),
+    "latin": ((ACCENTED, 1),),
+    "mixed": ((LATIN, 5), (ACCENTED, 2), (CYRILLIC, 2), (CJK, 1))
+}
+# Rule kind: share of the rules
+RULE_MIX = (("substring", 0.6), ("word", 0.2), ("prefix", 0.1),
+            ("normalized", 0.1))
+ZERO_WIDTH_SPACE = "\u200b"
+
+
+def pick_alphabet(script, rng):
+    alphabets = SCRIPTS[script]
+    roll = rng.random() * sum(w for _, w in alphabets)
+    for alphabet, weight in alphabets:
+        roll -= weight
+        if roll < 0:
+            break
+    return alphabet
+
+
+def make_word(script, rng, low, high):
+    alphabet = pick_alphabet(script, rng)
+    if alphabet is CJK:
+        low, high = max(1, low // 3), max(1, high // 3)
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(low, high)))
+
+
+def make_rules(script, count, regexes, rng):
+    """count rules as (stored rule, text that breaks it)"""
+    terms = set()
+    while len(terms) < count:
+        terms.add(make_word(script, rng, 6, 10))
+    terms = sorted(terms)
+    rng.shuffle(terms)
+    rules = []
+    for term in terms[:min(regexes, count)]:
+        rules.append(("re:{}\\d+".format(re.escape(term)), term + "42"))
+    for term in terms[len(rules):]:
+        roll = rng.random()
+        for kind, share in RULE_MIX:
+            roll -= share
+            if roll < 0:
+                break
+        if kind == "word":
+            rules.append(("w:" + term, term))
+        elif kind == "prefix":
+            rules.append((term + "*", term + "ing"))
+        elif kind == "normalized":
+            middle = len(term) // 2
+            rules.append(("n:" + term, term[:middle].upper() +
+                          ZERO_WIDTH_SPACE + term[middle:]))
+        else:
+            rules.append((term, "xx" + term))
+    return rules
+
+
+def make_message(script, length, hit, rng):
+    words = []
+    size = 0
+    while size < length:
+        word = make_word(script, rng, 1, 9)
+        if rng.random() < 0.1:
+            word += rng.choice(PUNCTUATION)
+        elif rng.random() < 0.02 and script == "mixed":
+            word = rng.choice(EMOJI)
+        words.append(word)
+        size += len(word) + 1
+    if hit is not None:
+        words.insert(rng.randrange(len(words) + 1), hit)
+    return " ".join(words)
+
+
+def make_corpus(rules, script, length, hit_rate, count, rng):
+    return [make_message(script, length,
+                         rng.choice(rules)[1] if rng.random() < hit_rate
+                         else None, rng)
+            for _ in range(count)]
+
+
+def compile_stats(build, rules):
+    """(compiled filter, seconds, bytes)"""
+    started = time.perf_counter()
+    build(rules)
+    elapsed = time.perf_counter() - started
+    # Built again traced, tracing slows allocations down
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    compiled = build(rules)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return compiled, elapsed, size
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def result(engine, script, terms, length, hit_rate, latencies, hits,
+           compile_time, memory):
+    latencies.sort()
+    total = sum(latencies)
+    return {"engine": engine, "script": script, "terms": terms,
+            "length": length, "hit_rate": hit_rate,
+            "measured_hit_rate": hits / len(latencies),
+            "messages_per_second": len(latencies) / total if total else 0.0,
+            "p50_us": percentile(latencies, 50) * 1e6,
+            "p99_us": percentile(latencies, 99) * 1e6,
+            "compile_ms": compile_time * 1000,
+            "memory_kib": memory / 1024}
+
+
+HEADER = ("{:<13} {:<6} {:>6} {:>6} {:>6} {:>11} {:>9} {:>9} {:>11} "
+          "{:>10}".format("engine", "script", "terms", "length", "hit%",
+                          "msg/s", "p50 us", "p99 us", "compile ms",
+                          "memory KiB"))
+
+
+def print_result(r):
+    print("{engine:<13} {script:<6} {terms:>6} {length:>6} {hit:>6.1f} "
+          "{messages_per_second:>11.0f} {p50_us:>9.1f} {p99_us:>9.1f} "
+          "{compile_ms:>11.1f} {memory_kib:>10.1f}".format(
+              hit=r["measured_hit_rate"] * 100, **r))
+
+
+def configurations(args):
+    for script in args.scripts:
+        for terms in args.terms:
+            for length in args.lengths:
+                for hit_rate in args.hit_rates:
+                    yield script, terms, length, hit_rate
+
+
+def run_engines(args):
+    sys.path.insert(0, ROOT)
+    rng = random.Random(args.seed)
+    results = []
+    print(HEADER)
+    rules_cache = {}
+    for name in args.engines:
+        module, attribute = ENGINES[name]
+        build = getattr(importlib.import_module(module), attribute)
+        compiled = {}
+        for script, terms, length, hit_rate in configurations(args):
+            key = (script, terms)
+            if key not in rules_cache:
+                rules_cache[key] = make_rules(script, terms, args.regexes,
+                                              rng)
+            rules = rules_cache[key]
+            if key not in compiled:
+                compiled[key] = compile_stats(build, [r for r, _ in rules])
+            matcher, compile_time, memory = compiled[key]
+            corpus = make_corpus(rules, script, length, hit_rate,
+                                 args.messages, rng)
+            latencies = []
+            hits = 0
+            clock = time.perf_counter
+            search = matcher.search
+            for content in corpus:
+                started = clock()
+                found = search(content)
+                latencies.append(clock() - started)
+                hits += found is not None
+            r = result(name, script, terms, length, hit_rate, latencies,
+                       hits, compile_time, memory)
+            print_result(r)
+            results.append(r)
+    return results
+
+
+def check_filter_session(args, plans, results):
+    """Returns the coroutine stub_gateway runs once the bot is ready.
+    plans maps (script, terms) to (server id, rules)"""
+
+    @asyncio.coroutine
+    def session(bot):
+        recorder = stub_gateway.Recorder()
+        recorder.install(bot)
+        mod = bot.get_cog("Mod")
+        rng = random.Random(args.seed)
+        snowflake = stub_gateway.SnowflakeFactory(
+            stub_gateway._SNOWFLAKE_BASE * 3)
+        print(HEADER)
+        compiled = {}
+        for script, terms, length, hit_rate in configurations(args):
+            server_id, rules = plans[script, terms]
+            server = bot.get_server(server_id)
+            if server_id not in compiled:
+                compiled[server_id] = compile_stats(
+                    lambda r: mod._compile_filter(server_id), None)
+            _, compile_time, memory = compiled[server_id]
+            channels = [c for c in server.channels
+                        if str(c.type) == "text"]
+            # The filter skips the bot, mods, admins and the owner
+            authors = [m for m in server.members
+                       if m.id != stub_gateway.BOT_ID and
+                       not bot.privileges.is_mod(m, server)]
+            corpus = make_corpus(rules, script, length,
+                                 hit_rate if rules else 0, args.messages,
+                                 rng)
+            messages = []
+            for content in corpus:
+                author = rng.choice(authors)
+                messages.append(stub_gateway.make_message(
+                    bot, stub_gateway.message_payload(
+                        snowflake, rng.choice(channels).id,
+                        stub_gateway.user_payload(author.id, author.name),
+                        content)))
+            deleted = recorder.calls["delete_message"]
+            latencies = []
+            clock = time.perf_counter
+            # check_filter prints every deletion
+            with open(os.devnull, "w") as devnull, \
+                    contextlib.redirect_stdout(devnull):
+                for message in messages:
+                    started = clock()
+                    yield from mod.check_filter(message)
+                    latencies.append(clock() - started)
+            hits = recorder.calls["delete_message"] - deleted
+            r = result("check_filter", script, terms, length, hit_rate,
+                       latencies, hits, compile_time, memory)
+            print_result(r)
+            results.append(r)
+    return session
+
+
+def run_check_filter(args):
+    rng = random.Random(args.seed)
+    keys = [(s, t) for s in args.scripts for t in args.terms]
+    # The last server has no rules
+    if 0 not in args.terms:
+        args.terms.append(0)
+        keys += [(s, 0) for s in args.scripts]
+    payload = stub_gateway.ready_payload(len(keys), args.members, 2, 0,
+                                         seed=args.seed)
+    plans = {}
+    filters = {}
+    for key, guild in zip(keys, payload["guilds"]):
+        script, terms = key
+        rules = make_rules(script, terms, args.regexes, rng)
+        plans[key] = (guild["id"], rules)
+        if rules:
+            filters[guild["id"]] = [r for r, _ in rules]
+    results = []
+    workdir = tempfile.mkdtemp(prefix="red-filters-")
+    cwd = os.getcwd()
+    try:
+        stub_gateway.prepare_workdir(workdir, ["mod"],
+                                     {"data/mod/filter.json": filters})
+        os.chdir(workdir)
+        sys.path.insert(0, workdir)
+        stub_gateway.install_on_import(
+            payload, session=check_filter_session(args, plans, results))
+        sys.argv = ["red.py", "--no-prompt", "--profile-startup"]
+        runpy.run_path(os.path.join(ROOT, "red.py"), run_name="__main__")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def int_list(text):
+    return [int(v) for v in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--terms", type=int_list, default=[10, 1000, 50000],
+                        help="comma separated filter sizes")
+    parser.add_argument("--lengths", type=int_list, default=[40, 400, 2000],
+                        help="comma separated message lengths")
+    parser.add_argument("--scripts", type=lambda t: t.split(","),
+                        default=["ascii", "mixed"],
+                        help="comma separated, among " + ", ".join(SCRIPTS))
+    parser.add_argument("--hit-rates", default=[0, 0.05],
+                        type=lambda t: [float(v) for v in t.split(",")],
+                        help="comma separated shares of messages breaking "
+                             "a rule")
+    parser.add_argument("--messages", type=int, default=2000,
+                        help="messages per combination")
+    parser.add_argument("--regexes", type=int, default=5,
+                        help="regex rules in every filter")
+    parser.add_argument("--engines", type=lambda t: t.split(","),
+                        default=list(ENGINES),
+                        help="comma separated, among " + ", ".join(ENGINES))
+    parser.add_argument("--check-filter", action="store_true",
+                        help="time Mod.check_filter in a booted red.py "
+                             "instead of the engines")
+    parser.add_argument("--members", type=int, default=50,
+                        help="members per server with --check-filter")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--seed", type=int, default=31)
+    args = parser.parse_args()
+    for script in args.scripts:
+        if script not in SCRIPTS:
+            parser.error("unknown script: " + script)
+    for engine in args.engines:
+        if engine not in ENGINES:
+            parser.error("unknown engine: " + engine)
+
+    if args.check_filter:
+        results = run_check_filter(args)
+    else:
+        results = run_engines(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
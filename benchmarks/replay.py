@@ -0,0 +1,303 @@
+"""Message replay load generator for red.py
+
+Boots red.py with its cogs against the local stub gateway (see
+stub_gateway.py), inside a scratch directory, then feeds it a stream of
+messages at a target rate the same way the gateway would: every message
+goes through red.py's on_message and every cog's on_message listener.
+Outgoing REST calls are recorded instead of sent.
+
+The corpus mixes commands, plain chatter, alias and custom command hits
+and messages containing filtered words; it can also be read from a file
+(one message per line). At the end throughput, latency percentiles and
+peak memory are reported. A message's latency runs from its delivery to
+the moment its listeners and, if it was queued, its command have all
+finished.
+
+Usage:
+    python benchmarks/replay.py --messages 20000 --rate 500 --servers 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import runpy
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+import stub_gateway
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = ("ping", "choose tea coffee water", "roll 6", "flip", "rps rock",
+            "8 will this scale?", "lmgtfy red discord bot", "userinfo",
+            "serverinfo", "help", "bank register", "bank balance",
+            "payday", "leaderboard", "payouts", "slot 10")
+ALIASES = {"hi": "ping", "dice": "roll 20", "coin": "flip",
+           "rich": "leaderboard"}
+CUSTOM_COMMANDS = {"rules": "Be excellent to each other.",
+                   "faq": "Check the pins before asking.",
+                   "invite": "Ask a mod for an invite."}
+FILTERED = ("badword", "spoiler", "scamlink")
+WORDS = ("the", "bot", "is", "pretty", "fast", "today", "anyone", "playing",
+         "tonight", "lol", "what", "did", "you", "think", "of", "that",
+         "new", "patch", "music", "queue", "server", "hello", "again")
+
+
+class Tracker:
+    """Measures how long each message takes to be fully handled
+
+    A message is done when every piece of work started for it (the
+    listeners, a queued command) has finished."""
+
+    def __init__(self):
+        self.started = {}
+        self.outstanding = Counter()
+        self.latencies = []
+        self.errors = 0
+        self.last_done = None
+
+    def begin(self, message):
+        self.started.setdefault(message.id, time.perf_counter())
+        self.outstanding[message.id] += 1
+
+    def end(self, message):
+        self.outstanding[message.id] -= 1
+        if self.outstanding[message.id] > 0:
+            return
+        del self.outstanding[message.id]
+        self.last_done = time.perf_counter()
+        self.latencies.append(self.last_done - self.started.pop(message.id))
+
+
+def seed_data(payload):
+    """Cog data files giving every server aliases, custom commands and a
+    word filter"""
+    server_ids = [g["id"] for g in payload["guilds"]]
+    return {
+        "data/alias/aliases.json": {sid: ALIASES for sid in server_ids},
+        "data/customcom/commands.json": {sid: CUSTOM_COMMANDS
+                                         for sid in server_ids},
+        "data/mod/filter.json": {sid: list(FILTERED) for sid in server_ids}
+    }
+
+
+def chatter(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 14)))
+
+
+def generate_corpus(args, rng):
+    kinds = ("command", "chatter", "alias", "customcom", "filtered")
+    weights = (args.commands, args.chatter, args.aliases, args.customcoms,
+               args.filtered)
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            lines = [l.rstrip("\n") for l in f if l.strip()]
+        return [lines[i % len(lines)] for i in range(args.messages)]
+    total = sum(weights)
+    corpus = []
+    for _ in range(args.messages):
+        roll = rng.random() * total
+        for kind, weight in zip(kinds, weights):
+            roll -= weight
+            if roll < 0:
+                break
+        if kind == "command":
+            corpus.append("!" + rng.choice(COMMANDS))
+        elif kind == "alias":
+            corpus.append("!" + rng.choice(list(ALIASES)))
+        elif kind == "customcom":
+            corpus.append("!" + rng.choice(list(CUSTOM_COMMANDS)))
+        elif kind == "filtered":
+            words = chatter(rng).split()
+            words.insert(rng.randrange(len(words) + 1), rng.choice(FILTERED))
+            corpus.append(" ".join(words))
+        else:
+            corpus.append(chatter(rng))
+    return corpus
+
+
+def build_messages(payload, corpus, rng):
+    """Message payloads spread over the servers' text channels and
+    members, the bot excluded"""
+    snowflake = stub_gateway.SnowflakeFactory(
+        stub_gateway._SNOWFLAKE_BASE * 3)
+    targets = []
+    for guild in payload["guilds"]:
+        channels = [c["id"] for c in guild["channels"] if c["type"] == 0]
+        authors = [m["user"] for m in guild["members"]
+                   if m["user"]["id"] != stub_gateway.BOT_ID]
+        targets.append((channels, authors))
+    messages = []
+    for content in corpus:
+        channels, authors = rng.choice(targets)
+        messages.append(stub_gateway.message_payload(
+            snowflake, rng.choice(channels), rng.choice(authors), content))
+    return messages
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def report(args, bot, recorder, tracker, elapsed, peak):
+    latencies = sorted(tracker.latencies)
+    print("------")
+    print("messages:    {} in {:.2f}s ({:.0f} msg/s, target {})".format(
+        len(latencies), elapsed, len(latencies) / elapsed if elapsed else 0,
+        args.rate or "unbounded"))
+    if latencies:
+        print("latency:     mean {:.2f}ms  p50 {:.2f}ms  p90 {:.2f}ms  "
+              "p99 {:.2f}ms  max {:.2f}ms".format(
+                  statistics.mean(latencies) * 1000,
+                  percentile(latencies, 50) * 1000,
+                  percentile(latencies, 90) * 1000,
+                  percentile(latencies, 99) * 1000,
+                  latencies[-1] * 1000))
+    print("commands:    {} queued, {} dropped, {} rate limited, "
+          "max queue depth {}".format(
+              bot.executor.submitted, bot.executor.dropped,
+              bot.rate_limiter.limited, bot.executor.max_depth))
+    print("listener errors: {}".format(tracker.errors))
+    calls = ", ".join("{} {}".format(n, c) for n, c in
+                      recorder.calls.most_common())
+    print("REST calls:  {}".format(calls or "none"))
+    print("peak traced memory during replay: {:.1f} MiB".format(
+        peak / 2**20))
+    if resource is not None:
+        # ru_maxrss is in KiB on Linux
+        print("max RSS: {:.1f} MiB".format(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def make_session(args, messages):
+    """Returns the coroutine stub_gateway runs once the bot is ready"""
+
+    @asyncio.coroutine
+    def session(bot):
+        recorder = stub_gateway.Recorder()
+        recorder.install(bot)
+        if args.no_ratelimit:
+            bot.rate_limiter.enabled = False
+        tracker = Tracker()
+        handlers = ([bot.on_message] +
+                    list(bot.extra_events.get("on_message", [])))
+
+        # Commands run on the executor after on_message has returned:
+        # keep their message open until the command itself is done
+        executor = bot.executor
+        submit, run = executor.submit, executor._run
+
+        def tracked_submit(message, **kwargs):
+            queued = submit(message, **kwargs)
+            if queued:
+                tracker.begin(message)
+            return queued
+
+        @asyncio.coroutine
+        def tracked_run(message):
+            try:
+                yield from run(message)
+            finally:
+                tracker.end(message)
+
+        executor.submit = tracked_submit
+        executor._run = tracked_run
+
+        @asyncio.coroutine
+        def deliver(data):
+            message = stub_gateway.make_message(bot, data)
+            tracker.begin(message)
+            results = yield from asyncio.gather(
+                *(handler(message) for handler in handlers),
+                return_exceptions=True)
+            tracker.errors += sum(isinstance(r, Exception) for r in results)
+            tracker.end(message)
+
+        tracemalloc.start()
+        loop = asyncio.get_event_loop()
+        deliveries = []
+        started = time.perf_counter()
+        for i, data in enumerate(messages):
+            if args.rate:
+                delay = started + i / args.rate - time.perf_counter()
+                if delay > 0:
+                    yield from asyncio.sleep(delay)
+            else:
+                yield from asyncio.sleep(0)
+            deliveries.append(loop.create_task(deliver(data)))
+        if deliveries:
+            yield from asyncio.wait(deliveries)
+        yield from executor.drain(args.timeout)
+        elapsed = (tracker.last_done or time.perf_counter()) - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if tracker.outstanding:
+            print("{} messages still unfinished after {}s".format(
+                len(tracker.outstanding), args.timeout))
+        report(args, bot, recorder, tracker, elapsed, peak)
+    return session
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=500,
+                        help="messages per second, 0 for as fast as possible")
+    parser.add_argument("--servers", type=int, default=10)
+    parser.add_argument("--members", type=int, default=100,
+                        help="members per server")
+    parser.add_argument("--channels", type=int, default=10,
+                        help="text channels per server")
+    parser.add_argument("--cogs", default="general,alias,customcom,mod,economy",
+                        help="comma separated cogs to load, or 'all'")
+    parser.add_argument("--corpus",
+                        help="file with one message per line to replay "
+                             "instead of the generated mix")
+    group = parser.add_argument_group("generated mix (relative weights)")
+    group.add_argument("--commands", type=float, default=20)
+    group.add_argument("--chatter", type=float, default=60)
+    group.add_argument("--aliases", type=float, default=5)
+    group.add_argument("--customcoms", type=float, default=5)
+    group.add_argument("--filtered", type=float, default=10)
+    parser.add_argument("--no-ratelimit", action="store_true",
+                        help="disable command rate limiting")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="seconds to wait for queued commands at the end")
+    parser.add_argument("--seed", type=int, default=31)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    payload = stub_gateway.ready_payload(args.servers, args.members,
+                                         args.channels, 0, seed=args.seed)
+    messages = build_messages(payload, generate_corpus(args, rng), rng)
+    workdir = tempfile.mkdtemp(prefix="red-replay-")
+    cwd = os.getcwd()
+    try:
+        stub_gateway.prepare_workdir(workdir, args.cogs.split(","),
+                                     seed_data(payload))
+        os.chdir(workdir)
+        sys.path.insert(0, workdir)
+        stub_gateway.install_on_import(payload,
+                                       session=make_session(args, messages))
+        sys.argv = ["red.py", "--no-prompt", "--profile-startup"]
+        runpy.run_path(os.path.join(ROOT, "red.py"), run_name="__main__")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Cold-start benchmark for red.py
+
+Every run boots red.py in a fresh interpreter, inside a scratch directory,
+against the local stub gateway (see stub_gateway.py) with
+--profile-startup enabled, then collects the startup profile it writes.
+The per-phase numbers of all runs are summarised at the end so startup
+regressions show up as numbers instead of impressions.
+
+Usage:
+    python benchmarks/startup.py --runs 5 --servers 50 --members 2000
+"""
+import argparse
+import json
+import os
+import runpy
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import stub_gateway
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(args):
+    sys.path.insert(0, ROOT)
+    payload = stub_gateway.ready_payload(args.servers, args.members,
+                                         args.channels, args.voice)
+    stub_gateway.install_on_import(payload)
+    sys.argv = ["red.py", "--no-prompt", "--profile-startup"]
+    runpy.run_path(os.path.join(ROOT, "red.py"), run_name="__main__")
+
+
+def run_once(args):
+    workdir = tempfile.mkdtemp(prefix="red-startup-")
+    try:
+        stub_gateway.prepare_workdir(workdir, args.cogs.split(","))
+        cmd = [sys.executable, os.path.abspath(__file__), "--child",
+               "--servers", str(args.servers), "--members",
+               str(args.members), "--channels", str(args.channels),
+               "--voice", str(args.voice)]
+        out = subprocess.DEVNULL if not args.verbose else None
+        subprocess.run(cmd, cwd=workdir, stdout=out, check=True)
+        with open(os.path.join(workdir, "data", "red",
+                               "startup_profile.json")) as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def summarise(reports):
+    phases = {}
+    for report in reports:
+        phases.setdefault("total", []).append(report["total"])
+        phases.setdefault("imports", []).append(report["import_total"])
+        for phase in report["phases"]:
+            phases.setdefault(phase["name"], []).append(phase["seconds"])
+    print("{:<16} {:>10} {:>10} {:>10}".format("phase", "min", "median",
+                                               "max"))
+    for name, values in phases.items():
+        print("{:<16} {:>9.3f}s {:>9.3f}s {:>9.3f}s".format(
+            name, min(values), statistics.median(values), max(values)))
+    peaks = [r["memory_peak"] for r in reports if "memory_peak" in r]
+    if peaks:
+        print("peak traced memory: {:.1f} MiB (median)".format(
+            statistics.median(peaks) / 2**20))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--servers", type=int, default=10)
+    parser.add_argument("--members", type=int, default=100,
+                        help="members per server")
+    parser.add_argument("--channels", type=int, default=10,
+                        help="text channels per server")
+    parser.add_argument("--voice", type=int, default=2,
+                        help="voice channels per server")
+    parser.add_argument("--cogs", default="all",
+                        help="comma separated cogs to load, or 'all'")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--child", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+    reports = []
+    for i in range(args.runs):
+        report = run_once(args)
+        print("run {}: {:.3f}s".format(i + 1, report["total"]))
+        reports.append(report)
+    summarise(reports)
+
+
+if __name__ == "__main__":
+    main()
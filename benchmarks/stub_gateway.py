@@ -0,0 +1,321 @@
+"""Local stand-in for Discord's gateway and REST API
+
+Replaces the network facing coroutines of discord.Client (login, connect,
+application_info) so that red.py can boot against synthetic READY data
+without ever leaving the machine. The objects handed to the bot are real
+discord.py models built from gateway-shaped payloads, so everything that
+runs on top of them (checks, settings, cogs) behaves like it does live.
+Outgoing REST calls (send_message, delete_message...) can be swapped for
+a Recorder that keeps them in memory instead.
+"""
+import asyncio
+import datetime
+import importlib.abc
+import importlib.util
+import json
+import os
+import random
+import shutil
+import sys
+from collections import Counter, deque
+
+BOT_ID = "170000000000000001"
+OWNER_ID = "170000000000000002"
+
+_SNOWFLAKE_BASE = 180000000000000000
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_TOKEN = "M" * 59
+ADMIN_ROLE = "Transistor"
+MOD_ROLE = "Process"
+
+
+class SnowflakeFactory:
+    def __init__(self, start=_SNOWFLAKE_BASE):
+        self.current = start
+
+    def __call__(self):
+        self.current += 1
+        return str(self.current)
+
+
+def user_payload(uid, name, bot=False):
+    return {"id": uid, "username": name, "discriminator": "0001",
+            "avatar": None, "bot": bot}
+
+
+def guild_payload(snowflake, members=100, text_channels=10,
+                  voice_channels=2, online_ratio=0.3, rng=random):
+    """Builds a GUILD_CREATE style payload with the bot user and the
+    owner among the members"""
+    sid = snowflake()
+    now = datetime.datetime.utcnow().isoformat()
+    roles = [{"id": sid, "name": "@everyone", "permissions": 104324161,
+              "position": 0, "color": 0, "hoist": False, "managed": False,
+              "mentionable": False}]
+    for name, permissions in ((ADMIN_ROLE, 0), (MOD_ROLE, 0), ("Red", 8)):
+        roles.append({"id": snowflake(), "name": name,
+                      "permissions": permissions, "position": len(roles),
+                      "color": 0, "hoist": False, "managed": False,
+                      "mentionable": False})
+    admin_id, mod_id, bot_role_id = (r["id"] for r in roles[1:])
+    channels = []
+    for i in range(text_channels):
+        channels.append({"id": snowflake(), "name": "text-{}".format(i),
+                         "type": 0, "position": i, "topic": None,
+                         "permission_overwrites": []})
+    for i in range(voice_channels):
+        channels.append({"id": snowflake(), "name": "voice-{}".format(i),
+                         "type": 2, "position": i, "bitrate": 64000,
+                         "user_limit": 0, "permission_overwrites": []})
+    member_list = [{"user": user_payload(BOT_ID, "Red", bot=True),
+                    "roles": [bot_role_id], "joined_at": now, "deaf": False,
+                    "mute": False},
+                   {"user": user_payload(OWNER_ID, "Owner"),
+                    "roles": [], "joined_at": now, "deaf": False,
+                    "mute": False}]
+    presences = []
+    for i in range(members):
+        uid = snowflake()
+        # Roughly one admin and a few mods per hundred members
+        roll = rng.random()
+        member_roles = ([admin_id] if roll < 0.01 else
+                        [mod_id] if roll < 0.05 else [])
+        member_list.append({"user": user_payload(uid, "user{}".format(i)),
+                            "roles": member_roles, "joined_at": now,
+                            "deaf": False, "mute": False})
+        if rng.random() < online_ratio:
+            presences.append({"user": {"id": uid},
+                              "status": rng.choice(("online", "idle")),
+                              "game": None})
+    return {"id": sid, "name": "server-{}".format(sid[-6:]),
+            "region": "us-east", "afk_timeout": 300, "afk_channel_id": None,
+            "icon": None, "owner_id": OWNER_ID, "unavailable": False,
+            "member_count": len(member_list), "large": False,
+            "mfa_level": 0, "verification_level": 0, "splash": None,
+            "default_message_notifications": 0, "features": [],
+            "emojis": [], "roles": roles, "channels": channels,
+            "members": member_list, "presences": presences,
+            "voice_states": [], "joined_at": now}
+
+
+def ready_payload(servers=10, members=100, text_channels=10,
+                  voice_channels=2, seed=26):
+    rng = random.Random(seed)
+    snowflake = SnowflakeFactory()
+    return {"user": user_payload(BOT_ID, "Red", bot=True),
+            "guilds": [guild_payload(snowflake, members, text_channels,
+                                     voice_channels, rng=rng)
+                       for _ in range(servers)]}
+
+
+def message_payload(snowflake, channel_id, author, content):
+    """Builds a MESSAGE_CREATE style payload. author is a user payload"""
+    return {"id": snowflake(), "channel_id": channel_id, "author": author,
+            "content": content,
+            "timestamp": datetime.datetime.utcnow().isoformat(),
+            "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [],
+            "attachments": [], "embeds": [], "reactions": [],
+            "pinned": False, "type": 0}
+
+
+def make_message(client, payload):
+    """Turns a message payload into a discord.Message the same way the
+    gateway handler does"""
+    import discord
+    channel = client.get_channel(payload["channel_id"])
+    state = client.connection
+    if hasattr(state, "_create_message"):
+        return state._create_message(channel=channel, **payload)
+    return discord.Message(channel=channel, **payload)
+
+
+class Recorder:
+    """Stands in for the REST endpoints the cogs call
+
+    Every call is counted and the last `keep` outgoing messages are kept.
+    Calls that return a message on Discord's side get a real
+    discord.Message authored by the bot."""
+
+    ENDPOINTS = ("send_typing", "delete_message", "delete_messages",
+                 "add_reaction", "remove_reaction", "pin_message",
+                 "unpin_message", "kick", "ban", "unban", "add_roles",
+                 "remove_roles", "replace_roles", "change_nickname",
+                 "server_voice_state", "move_member")
+
+    def __init__(self, keep=1000):
+        self.calls = Counter()
+        self.sent = deque(maxlen=keep)
+        self._snowflake = SnowflakeFactory(_SNOWFLAKE_BASE * 2)
+        self._client = None
+
+    def install(self, client):
+        self._client = client
+        client.send_message = self.send_message
+        client.send_file = self.send_file
+        client.edit_message = self.edit_message
+        for name in self.ENDPOINTS:
+            setattr(client, name, self._endpoint(name))
+
+    def _endpoint(self, name):
+        @asyncio.coroutine
+        def endpoint(*args, **kwargs):
+            self.calls[name] += 1
+        return endpoint
+
+    def _reply(self, destination, content):
+        import discord
+        client = self._client
+        payload = message_payload(self._snowflake, destination.id,
+                                  user_payload(client.user.id,
+                                               client.user.name, bot=True),
+                                  content)
+        # Users and members are whispered to: discord.py leaves the
+        # channel unresolved until the private channel exists
+        if getattr(destination, "is_private", None) is None:
+            return discord.Message(channel=None, **payload)
+        return discord.Message(channel=destination, **payload)
+
+    @asyncio.coroutine
+    def send_message(self, destination, content=None, *, tts=False,
+                     embed=None):
+        self.calls["send_message"] += 1
+        content = str(content) if content is not None else None
+        self.sent.append((destination.id, content))
+        return self._reply(destination, content)
+
+    @asyncio.coroutine
+    def send_file(self, destination, fp, *, filename=None, content=None,
+                  tts=False):
+        self.calls["send_file"] += 1
+        self.sent.append((destination.id, content))
+        return self._reply(destination, content)
+
+    @asyncio.coroutine
+    def edit_message(self, message, new_content=None, *, embed=None):
+        self.calls["edit_message"] += 1
+        message.content = new_content
+        return message
+
+
+def prepare_workdir(path, cogs, data=None):
+    """Lays out a scratch copy of the bot in path
+
+    cogs is the list of cogs to enable (or ["all"]). data maps paths
+    relative to path to objects that are dumped there as json, for
+    seeding cog data files."""
+    shutil.copytree(os.path.join(ROOT, "cogs"), os.path.join(path, "cogs"),
+                    ignore=shutil.ignore_patterns("__pycache__"))
+    settings = {"EMAIL": FAKE_TOKEN, "PASSWORD": "",
+                "OWNER": OWNER_ID, "PREFIXES": ["!"],
+                "default": {"ADMIN_ROLE": ADMIN_ROLE,
+                            "MOD_ROLE": MOD_ROLE},
+                "LOGIN_TYPE": "token"}
+    available = [os.path.splitext(c)[0] for c in
+                 os.listdir(os.path.join(path, "cogs")) if c.endswith(".py")]
+    registry = {"cogs." + c: c in cogs or "all" in cogs for c in available}
+    files = {"data/red/settings.json": settings,
+             "data/red/cogs.json": registry}
+    files.update(data or {})
+    for name, content in files.items():
+        filename = os.path.join(path, *name.split("/"))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            json.dump(content, f)
+
+
+class _AppInfo:
+    def __init__(self):
+        import discord
+        self.id = BOT_ID
+        self.name = "Red"
+        self.owner = discord.User(**user_payload(OWNER_ID, "Owner"))
+
+
+def load_ready(client, payload):
+    """Feeds a READY payload into the client's connection state"""
+    import discord
+    state = client.connection
+    state.user = discord.User(**payload["user"])
+    for guild in payload["guilds"]:
+        if hasattr(state, "_add_server_from_data"):
+            state._add_server_from_data(guild)
+        else:
+            server = discord.Server(**guild)
+            server.me = server.get_member(state.user.id)
+            state._add_server(server)
+
+
+class _PatchOnImport(importlib.abc.MetaPathFinder):
+    """Applies install() right after discord.client is executed so that
+    discord.py's import still counts towards red.py's startup profile"""
+
+    def __init__(self, payload, ready_timeout, session):
+        self.payload = payload
+        self.ready_timeout = ready_timeout
+        self.session = session
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname != "discord.client":
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(fullname)
+        exec_module = spec.loader.exec_module
+        payload, timeout = self.payload, self.ready_timeout
+        session = self.session
+
+        def patched_exec(module):
+            exec_module(module)
+            install(payload, timeout, client=module.Client, session=session)
+        spec.loader.exec_module = patched_exec
+        return spec
+
+
+def install_on_import(payload, ready_timeout=120, session=None):
+    sys.meta_path.insert(0, _PatchOnImport(payload, ready_timeout, session))
+
+
+def install(payload, ready_timeout=120, client=None, session=None):
+    """Patches discord.Client so that login/connect never hit the network
+
+    connect() loads the payload, dispatches on_ready and waits for red.py's
+    startup profiler to report that on_ready has finished (or not at all
+    if profiling is off). If given, session(client) is then awaited in
+    place of the gateway's read loop. connect() returns afterwards, which
+    makes main() return and the process exit cleanly."""
+
+    @asyncio.coroutine
+    def login(self, *args, **kwargs):
+        self._is_logged_in.set()
+
+    @asyncio.coroutine
+    def connect(self):
+        finished = asyncio.Event(loop=self.loop)
+        profiler = getattr(sys.modules["__main__"], "startup_profiler", None)
+        if profiler is not None and profiler.enabled:
+            profiler.add_finish_callback(finished.set)
+        else:
+            finished.set()
+        load_ready(self, payload)
+        self.dispatch("ready")
+        yield from asyncio.wait_for(finished.wait(), ready_timeout,
+                                    loop=self.loop)
+        if session is not None:
+            yield from session(self)
+
+    @asyncio.coroutine
+    def application_info(self):
+        return _AppInfo()
+
+    @asyncio.coroutine
+    def logout(self):
+        self._is_logged_in.clear()
+
+    if client is None:
+        import discord
+        client = discord.Client
+    client.login = login
+    client.connect = connect
+    client.application_info = application_info
+    client.logout = logout
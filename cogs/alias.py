@@ -1,7 +1,7 @@
 from discord.ext import commands
 from .utils.chat_formatting import *
 from .utils.dataIO import fileIO
-from .utils import checks
+from .utils import checks, coordinator
 from __main__ import user_allowed, send_cmd_help
 import os
 from copy import deepcopy
@@ -35,7 +35,7 @@ class Alias:
             await self.bot.say('I can\'t safely add an alias that starts with '
                                'an existing command or alias. Sry <3')
             return
-        prefix = self.get_prefix(to_execute)
+        prefix = self.get_prefix(to_execute, server.id)
         if prefix is not None:
             to_execute = to_execute[len(prefix):]
         if server.id not in self.aliases:
@@ -56,9 +56,10 @@ class Alias:
             server_aliases = self.aliases[server.id]
             if command in server_aliases:
                 help_cmd = server_aliases[command].split(" ")[0]
-                new_content = self.bot.command_prefix[0]
-                new_content += "help "
-                new_content += help_cmd[len(self.get_prefix(help_cmd)):]
+                prefix = self.get_prefix(help_cmd, server.id)
+                if prefix is not None:
+                    help_cmd = help_cmd[len(prefix):]
+                new_content = ctx.prefix + "help " + help_cmd
                 message = ctx.message
                 message.content = new_content
                 await self.bot.process_commands(message)
@@ -116,7 +117,7 @@ class Alias:
 
         msg = message.content
         server = message.server
-        prefix = self.get_prefix(msg)
+        prefix = self.get_prefix(msg, server.id)
 
         if prefix and server.id in self.aliases:
             alias = self.first_word(msg[len(prefix):]).lower()
@@ -146,7 +147,7 @@ class Alias:
                 if aliasname != self.first_word(aliasname):
                     to_delete.append(aliasname)
                     continue
-                prefix = self.get_prefix(alias)
+                prefix = self.get_prefix(alias, sid)
                 if prefix is not None:
                     self.aliases[sid][aliasname] = alias[len(prefix):]
             for alias in to_delete:  # Fixes caps and bad prefixes
@@ -158,11 +159,12 @@ class Alias:
     def first_word(self, msg):
         return msg.split(" ")[0]
 
-    def get_prefix(self, msg):
-        for p in self.bot.command_prefix:
-            if msg.startswith(p):
-                return p
-        return None
+    def reload(self, path, data):
+        """Another shard changed the aliases"""
+        self.aliases = data
+
+    def get_prefix(self, msg, server_id=None):
+        return self.bot.command_prefix.match(msg, server_id)
 
 
 def check_folder():
@@ -185,5 +187,6 @@ def setup(bot):
     check_file()
     n = Alias(bot)
     n.remove_old()
+    coordinator.watch("data/alias/aliases.json", n.reload)
     bot.add_listener(n.check_aliases, "on_message")
     bot.add_cog(n)
@@ -4,8 +4,8 @@ import threading
 import os
 from random import shuffle, choice
 from cogs.utils.dataIO import fileIO
-from cogs.utils import checks
-from __main__ import send_cmd_help, settings
+from cogs.utils import checks, metrics
+from __main__ import send_cmd_help
 import re
 import logging
 import collections
@@ -176,6 +176,8 @@ class Downloader(threading.Thread):
     def __init__(self, url, max_duration=None, download=False,
                  cache_path="data/audio/cache", *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # Never keeps the process alive, shutdown waits for it a bit
+        self.daemon = True
         self.url = url
         self.max_duration = max_duration
         self.done = threading.Event()
@@ -236,6 +238,7 @@ class Audio:
         self.bot = bot
         self.queue = {}  # add deque's, repeat
         self.downloaders = {}  # sid: object
+        self.stop_times = {}  # server: when it stopped playing, or None
         self.settings = fileIO("data/audio/settings.json", 'load')
         self.server_specific_setting_keys = ["VOLUME", "VOTE_ENABLED",
                                              "VOTE_THRESHOLD"]
@@ -244,6 +247,7 @@ class Audio:
         self._old_game = False
 
         self.skip_votes = {}
+        metrics.registry.add_collector("audio", self._collect_metrics)
 
     async def _add_song_status(self, song):
         if self._old_game is False:
@@ -1702,17 +1706,11 @@ class Audio:
         if not self.get_server_settings(server)["VOTE_ENABLED"]:
             return True
 
-        admin_role = settings.get_server_admin(server)
-        mod_role = settings.get_server_mod(server)
-
-        is_owner = member.id == settings.owner
-        is_admin = discord.utils.get(member.roles, name=admin_role) is not None
-        is_mod = discord.utils.get(member.roles, name=mod_role) is not None
+        if self.bot.privileges.is_mod(member, server):
+            return True
 
         nonbots = sum(not m.bot for m in member.voice_channel.voice_members)
-        alone = nonbots <= 1
-
-        return is_owner or is_admin or is_mod or alone
+        return nonbots <= 1
 
     @commands.command(pass_context=True, no_pm=True)
     async def sing(self, ctx):
@@ -1785,18 +1783,11 @@ class Audio:
         return True
 
     async def cache_manager(self):
-        while self == self.bot.get_cog("Audio"):
-            if self._cache_too_large():
-                # Our cache is too big, dumping
-                log.debug("cache too large ({} > {}), dumping".format(
-                    self._cache_size(), self._cache_max()))
-                self._dump_cache()
-            await asyncio.sleep(5)  # No need to run this every half second
-
-    async def cache_scheduler(self):
-        await asyncio.sleep(30)  # Extra careful
-
-        self.bot.loop.create_task(self.cache_manager())
+        if self._cache_too_large():
+            # Our cache is too big, dumping
+            log.debug("cache too large ({} > {}), dumping".format(
+                self._cache_size(), self._cache_max()))
+            self._dump_cache()
 
     def currently_downloading(self, server):
         if server.id in self.downloaders:
@@ -1805,35 +1796,33 @@ class Audio:
         return False
 
     async def disconnect_timer(self):
-        stop_times = {}
-        while self == self.bot.get_cog('Audio'):
-            for vc in self.bot.voice_clients:
-                server = vc.server
-                if not hasattr(vc, 'audio_player') and \
+        stop_times = self.stop_times
+        for vc in self.bot.voice_clients:
+            server = vc.server
+            if not hasattr(vc, 'audio_player') and \
+                    (server not in stop_times or
+                     stop_times[server] is None):
+                log.debug("putting sid {} in stop loop, no player".format(
+                    server.id))
+                stop_times[server] = int(time.time())
+
+            if hasattr(vc, 'audio_player'):
+                if vc.audio_player.is_done() and \
                         (server not in stop_times or
                          stop_times[server] is None):
-                    log.debug("putting sid {} in stop loop, no player".format(
+                    log.debug("putting sid {} in stop loop".format(
                         server.id))
                     stop_times[server] = int(time.time())
-
-                if hasattr(vc, 'audio_player'):
-                    if vc.audio_player.is_done() and \
-                            (server not in stop_times or
-                             stop_times[server] is None):
-                        log.debug("putting sid {} in stop loop".format(
-                            server.id))
-                        stop_times[server] = int(time.time())
-                    elif vc.audio_player.is_playing():
-                        stop_times[server] = None
-
-            for server in stop_times:
-                if stop_times[server] and \
-                        int(time.time()) - stop_times[server] > 300:
-                    # 5 min not playing to d/c
-                    log.debug("dcing from sid {} after 300s".format(server.id))
-                    await self._disconnect_voice_client(server)
+                elif vc.audio_player.is_playing():
                     stop_times[server] = None
-            await asyncio.sleep(5)
+
+        for server in list(stop_times):
+            if stop_times[server] and \
+                    int(time.time()) - stop_times[server] > 300:
+                # 5 min not playing to d/c
+                log.debug("dcing from sid {} after 300s".format(server.id))
+                await self._disconnect_voice_client(server)
+                stop_times[server] = None
 
     def get_server_settings(self, server):
         try:
@@ -1929,33 +1918,61 @@ class Audio:
                 await self._download_next(server, curr_dl, next_dl)
 
     async def queue_scheduler(self):
-        while self == self.bot.get_cog('Audio'):
-            tasks = []
-            queue = copy.deepcopy(self.queue)
-            for sid in queue:
-                if len(queue[sid]["QUEUE"]) == 0 and \
-                        len(queue[sid]["TEMP_QUEUE"]) == 0:
-                    continue
-                # log.debug("scheduler found a non-empty queue"
-                #           " for sid: {}".format(sid))
-                tasks.append(
-                    self.bot.loop.create_task(self.queue_manager(sid)))
-            completed = [t.done() for t in tasks]
-            while not all(completed):
-                completed = [t.done() for t in tasks]
-                await asyncio.sleep(0.5)
-            await asyncio.sleep(1)
-
-    async def reload_monitor(self):
-        while self == self.bot.get_cog('Audio'):
-            await asyncio.sleep(0.5)
-
+        tasks = []
+        queue = copy.deepcopy(self.queue)
+        for sid in queue:
+            if len(queue[sid]["QUEUE"]) == 0 and \
+                    len(queue[sid]["TEMP_QUEUE"]) == 0:
+                continue
+            # log.debug("scheduler found a non-empty queue"
+            #           " for sid: {}".format(sid))
+            tasks.append(
+                self.bot.create_task(self.queue_manager(sid), cog=self))
+        if tasks:
+            await asyncio.wait(tasks)
+
+    def _stop_players(self):
         for vc in self.bot.voice_clients:
             try:
                 vc.audio_player.stop()
             except:
                 pass
 
+    def _collect_metrics(self):
+        players = [vc.audio_player for vc in self.bot.voice_clients
+                   if hasattr(vc, 'audio_player')]
+        yield ("red_audio_voice_clients", "gauge",
+               "Voice channels the bot is connected to",
+               [({}, len(self.bot.voice_clients))])
+        yield ("red_audio_players_playing", "gauge",
+               "Audio players currently playing",
+               [({}, sum(p.is_playing() for p in players))])
+        yield ("red_audio_downloads", "gauge", "Song downloads running",
+               [({}, sum(d.is_alive() for d in self.downloaders.values()))])
+
+    def __unload(self):
+        # Synchronous, the reloaded cog registers its collector right after
+        metrics.registry.unregister("audio")
+
+    async def on_unload(self):
+        self._stop_players()
+
+    async def on_shutdown(self):
+        self._stop_players()
+        # Lets in-flight downloads finish instead of leaving them half
+        # written in the cache, up to a point
+        downloads = [d for d in self.downloaders.values() if d.is_alive()]
+        deadline = time.monotonic() + 4
+        for download in downloads:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            await self.bot.loop.run_in_executor(None, download.join, timeout)
+        unfinished = sum(d.is_alive() for d in downloads)
+        if unfinished:
+            log.warning("{} downloads didn't finish before shutdown"
+                        "".format(unfinished))
+
     def save_settings(self):
         fileIO('data/audio/settings.json', 'save', self.settings)
 
@@ -2055,7 +2072,7 @@ def setup(bot):
     n = Audio(bot)  # Praise 26
     bot.add_cog(n)
     bot.add_listener(n.voice_state_update, 'on_voice_state_update')
-    bot.loop.create_task(n.queue_scheduler())
-    bot.loop.create_task(n.disconnect_timer())
-    bot.loop.create_task(n.reload_monitor())
-    bot.loop.create_task(n.cache_scheduler())
+    bot.scheduler.every(1, n.queue_scheduler, cog=n)
+    bot.scheduler.every(5, n.disconnect_timer, cog=n)
+    # Extra careful with the cache at startup
+    bot.scheduler.every(5, n.cache_manager, cog=n, delay=30)
@@ -1,7 +1,7 @@
 import discord
 from discord.ext import commands
 from .utils.dataIO import fileIO
-from .utils import checks
+from .utils import checks, coordinator
 from __main__ import user_allowed, send_cmd_help
 import os
 import re
@@ -113,7 +113,7 @@ class CustomCommands:
 
         msg = message.content
         server = message.server
-        prefix = self.get_prefix(msg)
+        prefix = self.get_prefix(msg, server.id)
 
         if prefix and server.id in self.c_commands.keys():
             cmdlist = self.c_commands[server.id]
@@ -127,11 +127,12 @@ class CustomCommands:
                 cmd = self.format_cc(cmd, message)
                 await self.bot.send_message(message.channel, cmd)
 
-    def get_prefix(self, msg):
-        for p in self.bot.command_prefix:
-            if msg.startswith(p):
-                return p
-        return False
+    def reload(self, path, data):
+        """Another shard changed the custom commands"""
+        self.c_commands = data
+
+    def get_prefix(self, msg, server_id=None):
+        return self.bot.command_prefix.match(msg, server_id) or False
 
     def format_cc(self, command, message):
         results = re.findall("\{([^}]+)\}", command)
@@ -180,5 +181,6 @@ def setup(bot):
     check_folders()
     check_files()
     n = CustomCommands(bot)
+    coordinator.watch("data/customcom/commands.json", n.reload)
     bot.add_listener(n.checkCC, "on_message")
     bot.add_cog(n)
@@ -5,7 +5,7 @@ from collections import namedtuple, defaultdict
 from datetime import datetime
 from random import randint
 from copy import deepcopy
-from .utils import checks
+from .utils import checks, logs, coordinator
 from __main__ import send_cmd_help
 import os
 import time
@@ -179,6 +179,10 @@ class Bank:
     def _save_bank(self):
         dataIO.save_json("data/economy/bank.json", self.accounts)
 
+    def reload(self, path, data):
+        """Another shard changed the bank"""
+        self.accounts = data
+
     def _get_account(self, user):
         server = user.server
         try:
@@ -335,11 +339,16 @@ class Economy:
         Defaults to top 10"""
         if top < 1:
             top = 10
-        bank_sorted = sorted(self.bank.get_all_accounts(),
-         key=lambda x: x.balance, reverse=True)
+        # Each shard only sees the accounts of its own servers
+        accounts = [acc for shard in await coordinator.gather("bank_top",
+                                                              top=top)
+                    for acc in shard]
+        accounts.sort(key=lambda x: x["balance"], reverse=True)
         unique_accounts = []
-        for acc in bank_sorted:
-            if not self.already_in_list(unique_accounts, acc):
+        seen = set()
+        for acc in accounts:
+            if acc["id"] not in seen:
+                seen.add(acc["id"])
                 unique_accounts.append(acc)
         if len(unique_accounts) < top:
             top = len(unique_accounts)
@@ -348,8 +357,8 @@ class Economy:
         place = 1
         for acc in topten:
             highscore += str(place).ljust(len(str(top))+1)
-            highscore += ("{} |{}| ".format(acc.name, acc.server.name)).ljust(23-len(str(acc.balance)))
-            highscore += str(acc.balance) + "\n"
+            highscore += ("{} |{}| ".format(acc["name"], acc["server"])).ljust(23-len(str(acc["balance"])))
+            highscore += str(acc["balance"]) + "\n"
             place += 1
         if highscore:
             if len(highscore) < 1985:
@@ -359,6 +368,19 @@ class Economy:
         else:
             await self.bot.say("There are no accounts in the bank.")
 
+    def top_accounts(self, top=10):
+        """Richest accounts of the servers this shard is in, one per user"""
+        bank_sorted = sorted(self.bank.get_all_accounts(),
+         key=lambda x: x.balance, reverse=True)
+        unique_accounts = []
+        for acc in bank_sorted:
+            if len(unique_accounts) >= top:
+                break
+            if not self.already_in_list(unique_accounts, acc):
+                unique_accounts.append(acc)
+        return [{"id": acc.id, "name": acc.name, "server": acc.server.name,
+                 "balance": acc.balance} for acc in unique_accounts]
+
     def already_in_list(self, accounts, user):
         for acc in accounts:
             if user.id == acc.id:
@@ -538,7 +560,9 @@ def setup(bot):
     logger = logging.getLogger("red.economy")
     if logger.level == 0: # Prevents the logger from being loaded again in case of module reload
         logger.setLevel(logging.INFO)
-        handler = logging.FileHandler(filename='data/economy/economy.log', encoding='utf-8', mode='a')
-        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s', datefmt="[%d/%m/%Y %H:%M]"))
-        logger.addHandler(handler)
-    bot.add_cog(Economy(bot))
+        handler = logs.file_handler('data/economy/economy.log', logging.Formatter('%(asctime)s %(message)s', datefmt="[%d/%m/%Y %H:%M]"))
+        logs.add_queued_handlers(logger, handler)
+    n = Economy(bot)
+    coordinator.watch("data/economy/bank.json", n.bank.reload)
+    coordinator.register("bank_top", n.top_accounts)
+    bot.add_cog(n)
@@ -5,7 +5,6 @@ from random import randint
 from random import choice as randchoice
 import datetime
 import time
-import aiohttp
 import asyncio
 
 settings = {"POLL_DURATION" : 60}
@@ -193,10 +192,11 @@ class General:
     async def serverinfo(self, ctx):
         """Shows server's informations"""
         server = ctx.message.server
-        online = str(len([m.status for m in server.members if str(m.status) == "online" or str(m.status) == "idle"]))
-        total_users = str(len(server.members))
-        text_channels = len([x for x in server.channels if str(x.type) == "text"])
-        voice_channels = len(server.channels) - text_channels
+        stats = self.bot.stats.server(server)
+        online = stats.online
+        total_users = stats.members
+        text_channels = stats.text_channels
+        voice_channels = stats.voice_channels
 
         data = "```python\n"
         data += "Name: {}\n".format(server.name)
@@ -238,8 +238,7 @@ class General:
         search_terms = "+".join(search_terms)
         url = "http://api.urbandictionary.com/v0/define?term=" + search_terms
         try:
-            async with aiohttp.get(url) as r:
-                result = await r.json()
+            result = await self.bot.http_service.get_json(url)
             if result["list"]:
                 definition = result['list'][pos]['definition']
                 example = result['list'][pos]['example']
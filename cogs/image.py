@@ -1,7 +1,6 @@
 import discord
 from discord.ext import commands
 from random import randint
-import aiohttp
 import random
 
 class Image:
@@ -57,8 +56,7 @@ class Image:
                 try:
                     msg = "+".join(text)
                     search = "http://api.giphy.com/v1/gifs/search?q=" + msg + "&api_key=dc6zaTOxFJmzC"
-                    async with aiohttp.get(search) as r:
-                        result = await r.json()
+                    result = await self.bot.http_service.get_json(search)
                     if result["data"] != []:
                         url = result["data"][0]["url"]
                         await self.bot.say(url)
@@ -82,13 +80,12 @@ class Image:
                 try:
                     msg = "+".join(text)
                     search = "http://api.giphy.com/v1/gifs/random?&api_key=dc6zaTOxFJmzC&tag=" + msg
-                    async with aiohttp.get(search) as r:
-                        result = await r.json()
-                        if result["data"] != []:
-                            url = result["data"]["url"]
-                            await self.bot.say(url)
-                        else:
-                            await self.bot.say("Your search terms gave no results.")
+                    result = await self.bot.http_service.get_json(search)
+                    if result["data"] != []:
+                        url = result["data"]["url"]
+                        await self.bot.say(url)
+                    else:
+                        await self.bot.say("Your search terms gave no results.")
                 except:
                     await self.bot.say("Error.")
             else:
@@ -1,13 +1,44 @@
 import discord
 from discord.ext import commands
 from .utils.dataIO import fileIO, dataIO
-from .utils import checks
+from .utils import checks, logs, coordinator
+from .utils.filtering import FilterMatcher, InvalidRule, canonical_rule
+from .utils.history import HistoryLog
+from .utils.cleanup import Cleanup
+from .utils.massaction import MassAction
+from .utils import antispam
+from .utils.auditlog import AuditLog
+from .utils.http import HTTPError
+from .utils.idlist import IdStore
 from __main__ import send_cmd_help, settings
-from collections import deque
-from cogs.utils.chat_formatting import escape_mass_mentions
+from cogs.utils.chat_formatting import escape_mass_mentions, pagify, box
 import os
+import io
 import logging
 import asyncio
+import datetime
+import math
+import re
+import time
+from collections import OrderedDict
+
+# Asks before acting on more users than this at once
+MASS_CONFIRM = 10
+MENTION_ID = re.compile(r"^<@!?(\d+)>$")
+
+# Messages looked at before giving up on finding more to delete
+CLEANUP_SCAN_LIMIT = 50000
+
+# Ids added at once by imports, between them the bot gets to run
+IMPORT_CHUNK = 5000
+USER_ID = re.compile(rb"\d{15,21}")
+
+# Filters with more rules than this are compiled in the executor
+SYNC_FILTER_RULES = 200
+
+MODLOG_PAGE = 15
+DURATION = re.compile(r"^(\d+(?:\.\d+)?)([smhdw])$")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
 
 
 class Mod:
@@ -15,12 +46,24 @@ class Mod:
 
     def __init__(self, bot):
         self.bot = bot
-        self.whitelist_list = dataIO.load_json("data/mod/whitelist.json")
-        self.blacklist_list = dataIO.load_json("data/mod/blacklist.json")
-        self.ignore_list = dataIO.load_json("data/mod/ignorelist.json")
+        self.id_lists = {
+            "whitelist.json": IdStore("data/mod/whitelist.json"),
+            "blacklist.json": IdStore("data/mod/blacklist.json"),
+            "ignorelist.json": IdStore("data/mod/ignorelist.json",
+                                       keys=("SERVERS", "CHANNELS"))}
+        self.whitelist_list = self.id_lists["whitelist.json"].ids
+        self.blacklist_list = self.id_lists["blacklist.json"].ids
+        self.ignore_list = self.id_lists["ignorelist.json"]
         self.filter = dataIO.load_json("data/mod/filter.json")
-        self.past_names = dataIO.load_json("data/mod/past_names.json")
-        self.past_nicknames = dataIO.load_json("data/mod/past_nicknames.json")
+        self.antispam = dataIO.load_json("data/mod/antispam.json")
+        self.spam = antispam.SpamDetector()
+        self._filters = {}  # server id: compiled filter
+        self._compiling = {}  # server id: rules being compiled
+        self._cleanups = {}  # channel id: running Cleanup
+        self._mass_actions = {}  # server id: running MassAction
+        self.name_history = HistoryLog(history_path(bot))
+        migrate_name_history(self.name_history)
+        self.audit_log = AuditLog("data/mod/audit.db")
 
     @commands.group(pass_context=True, no_pm=True)
     @checks.serverowner_or_permissions(administrator=True)
@@ -61,6 +104,8 @@ class Mod:
             await self.bot.kick(user)
             logger.info("{}({}) kicked {}({})".format(
                 author.name, author.id, user.name, user.id))
+            self.audit_log.record("kick", author, user, ctx.message.server,
+                                  ctx.message.channel)
             await self.bot.say("Done. That felt good.")
         except discord.errors.Forbidden:
             await self.bot.say("I'm not allowed to do that.")
@@ -81,6 +126,8 @@ class Mod:
             await self.bot.ban(user, days)
             logger.info("{}({}) banned {}({}), deleting {} days worth of messages".format(
                 author.name, author.id, user.name, user.id, str(days)))
+            self.audit_log.record("ban", author, user, ctx.message.server,
+                                  ctx.message.channel)
             await self.bot.say("Done. It was about time.")
         except discord.errors.Forbidden:
             await self.bot.say("I'm not allowed to do that.")
@@ -107,6 +154,8 @@ class Mod:
                 logger.info("{}({}) softbanned {}({}), deleting 1 day worth "
                     "of messages".format(author.name, author.id, user.name,
                      user.id))
+                self.audit_log.record("softban", author, user, server,
+                                      channel)
                 await self.bot.unban(server, user)
                 await self.bot.say("Done. Enough chaos.")
             except discord.errors.Forbidden:
@@ -117,6 +166,225 @@ class Mod:
         else:
             await self.bot.say("I'm not allowed to do that.")
 
+    @commands.command(no_pm=True, pass_context=True)
+    @checks.admin_or_permissions(ban_members=True)
+    async def massban(self, ctx, *targets: str):
+        """Bans many users at once
+
+        Targets are user ids (they don't need to be in the server),
+        mentions or joined:N for everyone who joined in the last N minutes.
+        days:N also deletes their last N days of messages (0-7, default 0).
+        Examples:
+        massban 96130341705637888 @\u200bspammer
+        massban joined:10 days:1"""
+        server = ctx.message.server
+        days = 0
+        for target in targets:
+            if target.lower().startswith("days:"):
+                try:
+                    days = int(target[5:])
+                except ValueError:
+                    days = -1
+        if days < 0 or days > 7:
+            await self.bot.say("Invalid days. Must be between 0 and 7.")
+            return
+        targets = [t for t in targets if not t.lower().startswith("days:")]
+
+        async def ban(target):
+            if isinstance(target, discord.Member):
+                await self.bot.ban(target, days)
+            else:
+                await self.bot.http.ban(target, server.id, days)
+
+        await self._mass_action(ctx, targets, ban, "ban", "ban", "banned",
+                                allow_ids=True)
+
+    @commands.command(no_pm=True, pass_context=True)
+    @checks.admin_or_permissions(kick_members=True)
+    async def masskick(self, ctx, *targets: str):
+        """Kicks many users at once
+
+        Targets are user ids, mentions or joined:N for everyone who joined
+        in the last N minutes.
+        Example:
+        masskick joined:10"""
+        await self._mass_action(ctx, targets, self.bot.kick, "kick", "kick",
+                                "kicked")
+
+    @commands.command(no_pm=True, pass_context=True)
+    @checks.admin_or_permissions(manage_roles=True)
+    async def massrole(self, ctx, role: discord.Role, *targets: str):
+        """Gives a role to many users at once
+
+        Targets are user ids, mentions or joined:N for everyone who joined
+        in the last N minutes.
+        Example:
+        massrole Muted joined:10"""
+        server = ctx.message.server
+        author = ctx.message.author
+        if role.position >= server.me.top_role.position:
+            await self.bot.say("That role is higher than mine, I can't "
+                               "give it.")
+            return
+        if author.id != settings.owner and author != server.owner and \
+                role.position >= author.top_role.position:
+            await self.bot.say("That role is higher than yours, you can't "
+                               "give it.")
+            return
+
+        async def add_role(member):
+            if role not in member.roles:
+                await self.bot.add_roles(member, role)
+
+        await self._mass_action(ctx, targets, add_role, "role",
+                                "give {} to".format(role.name),
+                                "gave {} to".format(role.name))
+
+    @commands.command(name="masscancel", no_pm=True, pass_context=True)
+    @checks.admin_or_permissions(ban_members=True)
+    async def mass_cancel(self, ctx):
+        """Stops the mass action running in this server"""
+        job = self._mass_actions.get(ctx.message.server.id)
+        if job is None:
+            await self.bot.say("There's no mass action running.")
+            return
+        job.cancel()
+
+    def _resolve_targets(self, ctx, targets, allow_ids=False):
+        """Returns the members (and ids of users outside the server if
+        allow_ids) targets refer to, and what was skipped with why"""
+        server = ctx.message.server
+        author = ctx.message.author
+        found = {}
+        skipped = []
+        for target in targets:
+            if target.lower().startswith("joined:"):
+                try:
+                    minutes = float(target[7:])
+                except ValueError:
+                    minutes = -1
+                if not 0 <= minutes < math.inf:
+                    skipped.append((target, "not a number of minutes"))
+                    continue
+                try:
+                    since = datetime.datetime.utcnow() - \
+                        datetime.timedelta(minutes=minutes)
+                except OverflowError:
+                    # Longer ago than dates go, that's everyone
+                    since = datetime.datetime.min
+                for member in server.members:
+                    if member.joined_at and member.joined_at >= since:
+                        found[member.id] = member
+                continue
+            match = MENTION_ID.match(target)
+            user_id = match.group(1) if match else target
+            if not user_id.isdigit():
+                skipped.append((target, "not a user id or mention"))
+                continue
+            member = server.get_member(user_id)
+            if member is not None:
+                found[member.id] = member
+            elif allow_ids:
+                found[user_id] = user_id
+            else:
+                skipped.append((target, "not in the server"))
+
+        is_owner = author.id == settings.owner or author == server.owner
+        eligible = []
+        for target in found.values():
+            if not isinstance(target, discord.Member):
+                eligible.append(target)
+                continue
+            if target in (author, server.me, server.owner) or \
+                    target.id == settings.owner:
+                reason = "can't act on them"
+            elif self.bot.privileges.is_mod(target, server):
+                reason = "mod or admin"
+            elif target.top_role.position >= server.me.top_role.position:
+                reason = "role higher than mine"
+            elif not is_owner and \
+                    target.top_role.position >= author.top_role.position:
+                reason = "role higher than yours"
+            else:
+                eligible.append(target)
+                continue
+            skipped.append((describe(target), reason))
+        return eligible, skipped
+
+    async def _mass_action(self, ctx, targets, action, name, verb, past,
+                           allow_ids=False):
+        server = ctx.message.server
+        channel = ctx.message.channel
+        author = ctx.message.author
+        if not targets:
+            await send_cmd_help(ctx)
+            return
+        if server.id in self._mass_actions:
+            await self.bot.say("A mass action is already running in this "
+                               "server. `{}masscancel` stops it."
+                               "".format(ctx.prefix))
+            return
+        eligible, skipped = self._resolve_targets(ctx, targets, allow_ids)
+        if not eligible:
+            await self.bot.say("Nobody to {}.".format(verb))
+            await self._say_skipped(skipped)
+            return
+        if len(eligible) > MASS_CONFIRM:
+            await self.bot.say("This will {} {} users. Type yes to confirm."
+                               "".format(verb, len(eligible)))
+            answer = await self.bot.wait_for_message(author=author,
+                                                     channel=channel,
+                                                     timeout=30)
+            if answer is None or answer.content.lower().strip() != "yes":
+                await self.bot.say("Cancelled.")
+                return
+
+        def log_batch(batch):
+            logger.info("{}({}) {} {} users: {}".format(
+                author.name, author.id, past, len(batch),
+                ", ".join(describe(t) for t in batch)))
+            for target in batch:
+                self.audit_log.record(name, author, target, server, channel)
+
+        status = None
+
+        async def progress(job):
+            nonlocal status
+            msg = ("{}/{} done, {} failed. `{}masscancel` stops it.".format(
+                job.done, len(job.targets), len(job.failed), ctx.prefix))
+            if status is None:
+                status = await self.bot.send_message(channel, msg)
+            else:
+                await self.bot.edit_message(status, msg)
+
+        job = MassAction(action, eligible, progress=progress,
+                         on_batch=log_batch)
+        self._mass_actions[server.id] = job
+        try:
+            succeeded, failed = await job.run()
+        finally:
+            del self._mass_actions[server.id]
+        msg = "{} {} users in {:.0f}s".format(past.capitalize(),
+                                              len(succeeded), job.elapsed)
+        if job.cancelled:
+            msg += ", cancelled before the other {}".format(
+                len(eligible) - job.done)
+        msg += "."
+        if failed:
+            msg += "\nFailed:\n" + "\n".join(
+                "{}: {}".format(describe(t), reason) for t, reason in failed)
+        for page in pagify(escape_mass_mentions(msg), ["\n"]):
+            await self.bot.say(page)
+        await self._say_skipped(skipped)
+
+    async def _say_skipped(self, skipped):
+        if not skipped:
+            return
+        msg = "Skipped:\n" + "\n".join("{}: {}".format(t, reason)
+                                        for t, reason in skipped)
+        for page in pagify(escape_mass_mentions(msg), ["\n"]):
+            await self.bot.say(page)
+
     @commands.command(no_pm=True, pass_context=True)
     @checks.admin_or_permissions(manage_nicknames=True)
     async def rename(self, ctx, user : discord.Member, *, nickname=""):
@@ -140,7 +408,9 @@ class Mod:
 
         cleanup messages [number]
         cleanup user [name/mention] [number]
-        cleanup text \"Text here\" [number]"""
+        cleanup text \"Text here\" [number]
+        cleanup after [message id]
+        cleanup cancel"""
         if ctx.invoked_subcommand is None:
             await send_cmd_help(ctx)
 
@@ -156,51 +426,10 @@ class Mod:
             number = 1
         author = ctx.message.author
         message = ctx.message
-        channel = ctx.message.channel
         logger.info("{}({}) deleted {} messages containing '{}' in channel {}".format(author.name,
             author.id, str(number), text, message.channel.name))
-        if self.bot.user.bot and self.discordpy_updated():
-            def to_delete(m):
-                if m == ctx.message or text in m.content:
-                    return True
-                else:
-                    return False
-            try:
-                await self.bot.purge_from(channel, limit=number+1, check=to_delete)
-            except discord.errors.Forbidden:
-                await self.bot.say("I need permissions to manage messages "
-                                   "in this channel.")
-        else:
-            await self.legacy_cleanup_text_messages(ctx, text, number)
-
-
-    async def legacy_cleanup_text_messages(self, ctx, text, number):
-        message = ctx.message
-        cmdmsg = ctx.message
-        if self.bot.user.bot:
-            print("Your discord.py is outdated, defaulting to slow deletion.")
-        try:
-            if number > 0 and number < 10000:
-                while True:
-                    new = False
-                    async for x in self.bot.logs_from(message.channel, limit=100, before=message):
-                        if number == 0:
-                            await self._delete_message(cmdmsg)
-                            await asyncio.sleep(0.25)
-                            return
-                        if text in x.content:
-                            await self._delete_message(x)
-                            await asyncio.sleep(0.25)
-                            number -= 1
-                        new = True
-                        message = x
-                    if not new or number == 0:
-                        await self._delete_message(cmdmsg)
-                        await asyncio.sleep(0.25)
-                        break
-        except discord.errors.Forbidden:
-            await self.bot.send_message(message.channel, "I need permissions"
-                 " to manage messages in this channel.")
+        await self._cleanup(ctx, check=lambda m: text in m.content,
+                            limit=number, scan_limit=CLEANUP_SCAN_LIMIT)
 
     @cleanup.command(pass_context=True, no_pm=True)
     async def user(self, ctx, user: discord.Member, number: int):
@@ -212,23 +441,12 @@ class Mod:
         if number < 1:
             number = 1
         author = ctx.message.author
-        channel = ctx.message.channel
         message = ctx.message
         logger.info("{}({}) deleted {} messages made by {}({}) in channel {}".format(author.name,
             author.id, str(number), user.name, user.id, message.channel.name))
-        if self.bot.user.bot and self.discordpy_updated():
-            def is_user(m):
-                if m == ctx.message or m.author == user:
-                    return True
-                else:
-                    return False
-            try:
-                await self.bot.purge_from(channel, limit=number+1, check=is_user)
-            except discord.errors.Forbidden:
-                await self.bot.say("I need permissions to manage messages "
-                                   "in this channel.")
-        else:
-            await self.legacy_cleanup_user_messages(ctx, user, number)
+        await self._cleanup(ctx, check=lambda m: m.author.id == user.id,
+                            limit=number, scan_limit=CLEANUP_SCAN_LIMIT,
+                            target=user)
 
     @cleanup.command(pass_context=True, no_pm=True)
     async def after(self, ctx, message_id : int):
@@ -239,6 +457,7 @@ class Mod:
         and copy its id.
         """
         channel = ctx.message.channel
+        author = ctx.message.author
         try:
             message = await self.bot.get_message(channel, str(message_id))
         except discord.errors.NotFound:
@@ -253,42 +472,10 @@ class Mod:
         except discord.errors.HTTPException:
             await self.bot.say("Couldn't retrieve the message.")
             return
-
-        try:
-            await self.bot.purge_from(channel, limit=2500, after=message)
-        except discord.errors.Forbidden:
-                await self.bot.say("I need permissions to manage messages "
-                                   "in this channel.")
-
-    async def legacy_cleanup_user_messages(self, ctx, user, number):
-        author = ctx.message.author
-        message = ctx.message
-        cmdmsg = ctx.message
-        if self.bot.user.bot:
-            print("Your discord.py is outdated, defaulting to slow deletion.")
-        try:
-            if number > 0 and number < 10000:
-                while True:
-                    new = False
-                    async for x in self.bot.logs_from(message.channel, limit=100, before=message):
-                        if number == 0:
-                            await self._delete_message(cmdmsg)
-                            await asyncio.sleep(0.25)
-                            return
-                        if x.author.id == user.id:
-                            await self._delete_message(x)
-                            await asyncio.sleep(0.25)
-                            number -= 1
-                        new = True
-                        message = x
-                    if not new or number == 0:
-                        await self._delete_message(cmdmsg)
-                        await asyncio.sleep(0.25)
-                        break
-        except discord.errors.Forbidden:
-            await self.bot.send_message(ctx.channel, "I need permissions "
-                            "to manage messages in this channel.")
-
+        logger.info("{}({}) deleted the messages after {} in channel {}"
+                    "".format(author.name, author.id, message.id,
+                              channel.name))
+        await self._cleanup(ctx, after=message)
 
     @cleanup.command(pass_context=True, no_pm=True)
     async def messages(self, ctx, number: int):
@@ -302,26 +489,55 @@ class Mod:
         channel = ctx.message.channel
         logger.info("{}({}) deleted {} messages in channel {}".format(author.name,
             author.id, str(number), channel.name))
-        if self.bot.user.bot and self.discordpy_updated():
-            try:
-                await self.bot.purge_from(channel, limit=number+1)
-            except discord.errors.Forbidden:
-                await self.bot.say("I need permissions to manage messages in this channel.")
-        else:
-            await self.legacy_cleanup_messages(ctx, number)
+        await self._cleanup(ctx, limit=number)
+
+    @cleanup.command(name="cancel", pass_context=True, no_pm=True)
+    async def cleanup_cancel(self, ctx):
+        """Stops the cleanup running in this channel"""
+        job = self._cleanups.get(ctx.message.channel.id)
+        if job is None:
+            await self.bot.say("There's no cleanup running in this channel.")
+            return
+        job.cancel()
 
-    async def legacy_cleanup_messages(self, ctx, number):
-        author = ctx.message.author
+    async def _cleanup(self, ctx, target=None, **kwargs):
         channel = ctx.message.channel
-        if self.bot.user.bot:
-                print("Your discord.py is outdated, defaulting to slow deletion.")
+        if channel.id in self._cleanups:
+            await self.bot.say("A cleanup is already running in this "
+                               "channel. `{}cleanup cancel` stops it."
+                               "".format(ctx.prefix))
+            return
+        status = None
+
+        async def progress(job):
+            nonlocal status
+            msg = ("Deleting messages... {} deleted, {} checked so far. "
+                   "`{}cleanup cancel` stops it.".format(
+                       job.deleted, job.scanned, ctx.prefix))
+            if status is None:
+                status = await self.bot.send_message(channel, msg)
+            else:
+                await self.bot.edit_message(status, msg)
+
+        job = Cleanup(self.bot, channel, before=ctx.message,
+                      include=(ctx.message,), progress=progress, **kwargs)
+        self._cleanups[channel.id] = job
         try:
-            if number > 0 and number < 10000:
-                async for x in self.bot.logs_from(channel, limit=number + 1):
-                    await self._delete_message(x)
-                    await asyncio.sleep(0.25)
+            await job.run()
         except discord.errors.Forbidden:
-            await self.bot.send_message(channel, "I need permissions to manage messages in this channel.")
+            await self.bot.say("I need permissions to manage messages "
+                               "in this channel.")
+            return
+        finally:
+            del self._cleanups[channel.id]
+            self.audit_log.record("cleanup", ctx.message.author, target,
+                                  channel.server, channel, count=job.deleted)
+        # Small cleanups finish before saying anything, like they used to
+        if status is not None:
+            msg = "{} {} messages in {:.0f}s.".format(
+                "Cancelled after deleting" if job.cancelled else "Deleted",
+                job.deleted, job.elapsed)
+            await self.bot.edit_message(status, msg)
 
     @commands.group(pass_context=True)
     @checks.is_owner()
@@ -333,9 +549,7 @@ class Mod:
     @blacklist.command(name="add")
     async def _blacklist_add(self, user: discord.Member):
         """Adds user to bot's blacklist"""
-        if user.id not in self.blacklist_list:
-            self.blacklist_list.append(user.id)
-            fileIO("data/mod/blacklist.json", "save", self.blacklist_list)
+        if self.blacklist_user(user):
             await self.bot.say("User has been added to blacklist.")
         else:
             await self.bot.say("User is already blacklisted.")
@@ -345,11 +559,27 @@ class Mod:
         """Removes user to bot's blacklist"""
         if user.id in self.blacklist_list:
             self.blacklist_list.remove(user.id)
-            fileIO("data/mod/blacklist.json", "save", self.blacklist_list)
             await self.bot.say("User has been removed from blacklist.")
         else:
             await self.bot.say("User is not in blacklist.")
 
+    @blacklist.command(name="import", pass_context=True)
+    async def _blacklist_import(self, ctx, url: str=None):
+        """Adds the user ids of a file to the blacklist
+
+        Attach the file to the command or give its url.
+        Anything that isn't a user id is ignored."""
+        await self._import_ids(ctx, "blacklist.json", url)
+
+    @blacklist.command(name="export", pass_context=True)
+    async def _blacklist_export(self, ctx):
+        """Sends you the blacklist as a file"""
+        await self._export_ids(ctx, "blacklist.json")
+
+    def blacklist_user(self, user):
+        """Adds user to the blacklist, False if it already was"""
+        return self.blacklist_list.add(user.id)
+
     @commands.group(pass_context=True)
     @checks.is_owner()
     async def whitelist(self, ctx):
@@ -365,8 +595,7 @@ class Mod:
                 msg = "\nAll users not in whitelist will be ignored (owner, admins and mods excluded)"
             else:
                 msg = ""
-            self.whitelist_list.append(user.id)
-            fileIO("data/mod/whitelist.json", "save", self.whitelist_list)
+            self.whitelist_list.add(user.id)
             await self.bot.say("User has been added to whitelist." + msg)
         else:
             await self.bot.say("User is already whitelisted.")
@@ -376,11 +605,59 @@ class Mod:
         """Removes user to bot's whitelist"""
         if user.id in self.whitelist_list:
             self.whitelist_list.remove(user.id)
-            fileIO("data/mod/whitelist.json", "save", self.whitelist_list)
             await self.bot.say("User has been removed from whitelist.")
         else:
             await self.bot.say("User is not in whitelist.")
 
+    @whitelist.command(name="import", pass_context=True)
+    async def _whitelist_import(self, ctx, url: str=None):
+        """Adds the user ids of a file to the whitelist
+
+        Attach the file to the command or give its url.
+        Anything that isn't a user id is ignored."""
+        await self._import_ids(ctx, "whitelist.json", url)
+
+    @whitelist.command(name="export", pass_context=True)
+    async def _whitelist_export(self, ctx):
+        """Sends you the whitelist as a file"""
+        await self._export_ids(ctx, "whitelist.json")
+
+    async def _import_ids(self, ctx, name, url):
+        if url is None:
+            if not ctx.message.attachments:
+                await send_cmd_help(ctx)
+                return
+            url = ctx.message.attachments[0]["url"]
+        try:
+            response = await self.bot.http_service.get(url)
+        except (HTTPError, ValueError):
+            response = None
+        if response is None or response.status != 200:
+            await self.bot.say("I couldn't download that file.")
+            return
+        loop = self.bot.loop
+        ids = await loop.run_in_executor(None, parse_ids, response.body)
+        if not ids:
+            await self.bot.say("There are no user ids in that file.")
+            return
+        store = self.id_lists[name]
+        added = 0
+        for i in range(0, len(ids), IMPORT_CHUNK):
+            added += store.ids.update(ids[i:i + IMPORT_CHUNK])
+            await asyncio.sleep(0)
+        await store.compact_in_executor(loop)
+        await self.bot.say("Added {} of the {} user ids, the others were "
+                           "already in.".format(added, len(ids)))
+
+    async def _export_ids(self, ctx, name):
+        ids = list(self.id_lists[name].ids)
+        if not ids:
+            await self.bot.say("The list is empty.")
+            return
+        data = await self.bot.loop.run_in_executor(None, export_ids, ids)
+        await self.bot.send_file(ctx.message.author, io.BytesIO(data),
+                                 filename=name.replace(".json", ".txt"))
+
     @commands.group(pass_context=True, no_pm=True)
     @checks.admin_or_permissions(manage_channels=True)
     async def ignore(self, ctx):
@@ -397,15 +674,13 @@ class Mod:
         current_ch = ctx.message.channel
         if not channel:
             if current_ch.id not in self.ignore_list["CHANNELS"]:
-                self.ignore_list["CHANNELS"].append(current_ch.id)
-                fileIO("data/mod/ignorelist.json", "save", self.ignore_list)
+                self.ignore_list["CHANNELS"].add(current_ch.id)
                 await self.bot.say("Channel added to ignore list.")
             else:
                 await self.bot.say("Channel already in ignore list.")
         else:
             if channel.id not in self.ignore_list["CHANNELS"]:
-                self.ignore_list["CHANNELS"].append(channel.id)
-                fileIO("data/mod/ignorelist.json", "save", self.ignore_list)
+                self.ignore_list["CHANNELS"].add(channel.id)
                 await self.bot.say("Channel added to ignore list.")
             else:
                 await self.bot.say("Channel already in ignore list.")
@@ -415,8 +690,7 @@ class Mod:
         """Ignores current server"""
         server = ctx.message.server
         if server.id not in self.ignore_list["SERVERS"]:
-            self.ignore_list["SERVERS"].append(server.id)
-            fileIO("data/mod/ignorelist.json", "save", self.ignore_list)
+            self.ignore_list["SERVERS"].add(server.id)
             await self.bot.say("This server has been added to the ignore list.")
         else:
             await self.bot.say("This server is already being ignored.")
@@ -438,14 +712,12 @@ class Mod:
         if not channel:
             if current_ch.id in self.ignore_list["CHANNELS"]:
                 self.ignore_list["CHANNELS"].remove(current_ch.id)
-                fileIO("data/mod/ignorelist.json", "save", self.ignore_list)
                 await self.bot.say("This channel has been removed from the ignore list.")
             else:
                 await self.bot.say("This channel is not in the ignore list.")
         else:
             if channel.id in self.ignore_list["CHANNELS"]:
                 self.ignore_list["CHANNELS"].remove(channel.id)
-                fileIO("data/mod/ignorelist.json", "save", self.ignore_list)
                 await self.bot.say("Channel removed from ignore list.")
             else:
                 await self.bot.say("That channel is not in the ignore list.")
@@ -456,7 +728,6 @@ class Mod:
         server = ctx.message.server
         if server.id in self.ignore_list["SERVERS"]:
             self.ignore_list["SERVERS"].remove(server.id)
-            fileIO("data/mod/ignorelist.json", "save", self.ignore_list)
             await self.bot.say("This server has been removed from the ignore list.")
         else:
             await self.bot.say("This server is not in the ignore list.")
@@ -479,37 +750,67 @@ class Mod:
             await send_cmd_help(ctx)
             server = ctx.message.server
             author = ctx.message.author
-            msg = ""
+            msg = "Words filtered in this server: "
             if server.id in self.filter.keys():
                 if self.filter[server.id] != []:
                     word_list = self.filter[server.id]
+                    invalid = []
                     for w in word_list:
                         msg += '"' + w + '" '
-                    await self.bot.send_message(author, "Words filtered in this server: " + msg)
+                        try:
+                            canonical_rule(w)
+                        except InvalidRule:
+                            invalid.append('"' + w + '"')
+                    if invalid:
+                        msg += ("\n\nThese aren't valid rules anymore and "
+                                "are matched as plain text anywhere: " +
+                                " ".join(invalid))
+                    for page in pagify(msg, delims=[" ", "\n"]):
+                        await self.bot.send_message(author, page)
 
     @_filter.command(name="add", pass_context=True)
     async def filter_add(self, ctx, *words: str):
         """Adds words to the filter
 
         Use double quotes to add sentences
+        Words match anywhere, even inside other words. Rules can do more:
+        w:word - only the whole word
+        word* - words starting with it
+        *word - words ending with it
+        n:word - also catches accents, hidden characters and
+                 look-alikes like 1d10t (n:w:word, n:word*... work too)
+        re:regex - a regular expression, simple ones only
         Examples:
         filter add word1 word2 word3
-        filter add \"This is a sentence\""""
+        filter add \"This is a sentence\"
+        filter add w:ass n:idiot \"re:free nitro\""""
         if words == ():
             await send_cmd_help(ctx)
             return
         server = ctx.message.server
         added = 0
+        errors = []
         if server.id not in self.filter.keys():
             self.filter[server.id] = []
         for w in words:
-            if w.lower() not in self.filter[server.id] and w != "":
-                self.filter[server.id].append(w.lower())
+            if w.strip() == "":
+                continue
+            try:
+                rule = canonical_rule(w)
+            except InvalidRule as e:
+                errors.append("{}: {}".format(w, e))
+                continue
+            if rule not in self.filter[server.id]:
+                self.filter[server.id].append(rule)
                 added += 1
+        if errors:
+            await self.bot.say("Not added:\n" +
+                               escape_mass_mentions("\n".join(errors)))
         if added:
+            self._compile_filter(server.id)
             fileIO("data/mod/filter.json", "save", self.filter)
             await self.bot.say("Words added to filter.")
-        else:
+        elif not errors:
             await self.bot.say("Words already in the filter.")
 
     @_filter.command(name="remove", pass_context=True)
@@ -529,15 +830,202 @@ class Mod:
             await self.bot.say("There are no filtered words in this server.")
             return
         for w in words:
-            if w.lower() in self.filter[server.id]:
-                self.filter[server.id].remove(w.lower())
+            try:
+                rule = canonical_rule(w)
+            except InvalidRule:
+                rule = w.lower()
+            if rule in self.filter[server.id]:
+                self.filter[server.id].remove(rule)
                 removed += 1
         if removed:
+            self._compile_filter(server.id)
             fileIO("data/mod/filter.json", "save", self.filter)
             await self.bot.say("Words removed from filter.")
         else:
             await self.bot.say("Those words weren't in the filter.")
 
+    @commands.group(name="antispam", pass_context=True, no_pm=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def _antispam(self, ctx):
+        """Flood and raid protection
+
+        Using this command with no subcommands will show the server's
+        anti-spam settings."""
+        if ctx.invoked_subcommand is None:
+            await send_cmd_help(ctx)
+            config = self.antispam_config(ctx.message.server)
+            msg = ("Enabled: {ENABLED}\n"
+                   "Flood: {MESSAGES} messages in {SECONDS}s\n"
+                   "Duplicates: {DUPLICATES} in {DUPLICATE_SECONDS}s\n"
+                   "Raid: {CHANNEL_MESSAGES} messages in a channel in "
+                   "{CHANNEL_SECONDS}s halves the flood limit for "
+                   "{RAID_SECONDS}s\n"
+                   "Action: {ACTION}".format(**config))
+            await self.bot.say(box(msg))
+
+    @_antispam.command(name="toggle", pass_context=True)
+    async def antispam_toggle(self, ctx):
+        """Turns anti-spam on and off"""
+        server = ctx.message.server
+        config = self.antispam_config(server)
+        config["ENABLED"] = not config["ENABLED"]
+        self._save_antispam(server)
+        if config["ENABLED"]:
+            await self.bot.say("Anti-spam is now on.")
+        else:
+            await self.bot.say("Anti-spam is now off.")
+
+    @_antispam.command(name="flood", pass_context=True)
+    async def antispam_flood(self, ctx, messages: int, seconds: int):
+        """Sets how many messages a user can send in some seconds"""
+        if messages < 2 or seconds < 1:
+            await self.bot.say("At least 2 messages and 1 second.")
+            return
+        server = ctx.message.server
+        config = self.antispam_config(server)
+        config["MESSAGES"], config["SECONDS"] = messages, seconds
+        self._save_antispam(server)
+        await self.bot.say("Users sending {} messages within {}s are now "
+                           "flooding.".format(messages, seconds))
+
+    @_antispam.command(name="duplicates", pass_context=True)
+    async def antispam_duplicates(self, ctx, count: int, seconds: int):
+        """Sets how many times a user can repeat a message in some
+        seconds"""
+        if count < 2 or seconds < 1:
+            await self.bot.say("At least 2 messages and 1 second.")
+            return
+        server = ctx.message.server
+        config = self.antispam_config(server)
+        config["DUPLICATES"], config["DUPLICATE_SECONDS"] = count, seconds
+        self._save_antispam(server)
+        await self.bot.say("Users sending the same message {} times within "
+                           "{}s are now spamming.".format(count, seconds))
+
+    @_antispam.command(name="raid", pass_context=True)
+    async def antispam_raid(self, ctx, messages: int, seconds: int,
+                            duration: int=120):
+        """Sets how many messages in a channel within some seconds start
+        raid mode
+
+        During raid mode, which lasts duration seconds, the flood limit of
+        every user of the server is halved."""
+        if messages < 2 or seconds < 1 or duration < 1:
+            await self.bot.say("At least 2 messages, 1 second and a 1 "
+                               "second duration.")
+            return
+        server = ctx.message.server
+        config = self.antispam_config(server)
+        config["CHANNEL_MESSAGES"], config["CHANNEL_SECONDS"] = \
+            messages, seconds
+        config["RAID_SECONDS"] = duration
+        self._save_antispam(server)
+        await self.bot.say("Raid mode now starts after {} messages in a "
+                           "channel within {}s.".format(messages, seconds))
+
+    @_antispam.command(name="action", pass_context=True)
+    async def antispam_action(self, ctx, action: str):
+        """Sets what happens to spammers
+
+        delete - their spam is deleted
+        mute - also muted in the channel they spammed
+        blacklist - also blacklisted from using the bot (owner only)"""
+        action = action.lower()
+        if action not in antispam.ACTIONS:
+            await self.bot.say("The action must be one of: {}.".format(
+                ", ".join(antispam.ACTIONS)))
+            return
+        if action == "blacklist" and not checks.is_owner_check(ctx):
+            await self.bot.say("Only the owner can blacklist spammers.")
+            return
+        server = ctx.message.server
+        config = self.antispam_config(server)
+        config["ACTION"] = action
+        self._save_antispam(server)
+        await self.bot.say("Spammers will now get: {}.".format(action))
+
+    def antispam_config(self, server):
+        config = self.antispam.get(server.id)
+        if config is None:
+            config = self.antispam[server.id] = dict(antispam.DEFAULT_CONFIG)
+        else:
+            # Settings added since it was saved
+            for key, value in antispam.DEFAULT_CONFIG.items():
+                config.setdefault(key, value)
+        return config
+
+    def _save_antispam(self, server):
+        # Windows sized for the old settings would give wrong answers
+        self.spam.reset(server.id)
+        fileIO("data/mod/antispam.json", "save", self.antispam)
+
+    @commands.command(pass_context=True, no_pm=True)
+    @checks.mod_or_permissions(kick_members=True)
+    async def modlog(self, ctx, *filters: str):
+        """Searches the moderation actions of this server
+
+        Filters:
+        @user or id - actions on that user
+        mod:@user - actions taken by that moderator
+        action:ban - that action only (kick, ban, softban, role,
+                     cleanup, mute, blacklist)
+        since:7d, until:12h - time range, in s, m, h, d or w ago or
+                              as a date like 2017-01-31
+        page:2 - older results
+        Examples:
+        modlog @\u200bspammer
+        modlog mod:@\u200bTwentysix action:ban since:30d"""
+        query = {}
+        page = 1
+        now = time.time()
+        for f in filters:
+            key, _, value = f.rpartition(":")
+            key = key.lower()
+            try:
+                if key == "mod":
+                    query["moderator"] = parse_user_id(value)
+                elif key == "action":
+                    query["action"] = value.lower()
+                elif key in ("since", "until"):
+                    query[key] = parse_time(value, now)
+                elif key == "page":
+                    page = max(int(value), 1)
+                elif not key:
+                    query["target"] = parse_user_id(value)
+                else:
+                    raise ValueError
+            except ValueError:
+                await self.bot.say("I don't understand `{}`.".format(
+                    escape_mass_mentions(f)))
+                return
+        server = ctx.message.server
+        actions = await self.audit_log.query_in_executor(
+            self.bot.loop, server=server, limit=MODLOG_PAGE + 1,
+            offset=(page - 1) * MODLOG_PAGE, **query)
+        if not actions:
+            await self.bot.say("No actions found.")
+            return
+        lines = []
+        for action in actions[:MODLOG_PAGE]:
+            line = "[{}] {}".format(datetime.datetime.utcfromtimestamp(
+                action.timestamp).strftime("%Y-%m-%d %H:%M"), action.action)
+            if action.target is not None:
+                line += " {}".format(describe_user(action.target,
+                                                   action.target_name))
+            if action.count != 1 or action.action == "cleanup":
+                line += " ({} messages)".format(action.count)
+            line += " by {}".format(describe_user(action.moderator,
+                                                  action.moderator_name))
+            channel = server.get_channel(action.channel or "")
+            if channel is not None:
+                line += " in #{}".format(channel.name)
+            lines.append(line)
+        msg = "\n".join(lines)
+        if len(actions) > MODLOG_PAGE:
+            msg += "\n\nMore with page:{}".format(page + 1)
+        for chunk in pagify(msg, ["\n"], shorten_by=16):
+            await self.bot.say(box(chunk))
+
     @commands.group(no_pm=True, pass_context=True)
     @checks.admin_or_permissions(manage_roles=True)
     async def editrole(self, ctx):
@@ -595,12 +1083,12 @@ class Mod:
     async def names(self, user : discord.Member):
         """Show previous names/nicknames of a user"""
         server = user.server
-        names = self.past_names[user.id] if user.id in self.past_names else None
-        try:
-            nicks = self.past_nicknames[server.id][user.id]
-            nicks = [escape_mass_mentions(nick) for nick in nicks]
-        except:
-            nicks = None
+        # Other shards may have seen name changes of the user too, and the
+        # nicknames migrated from past_nicknames.json are all on one shard
+        names = await self._gather_names(user_id=user.id)
+        nicks = await self._gather_names(user_id=user.id,
+                                         server_id=server.id)
+        nicks = [escape_mass_mentions(nick) for nick in nicks]
         msg = ""
         if names:
             names = [escape_mass_mentions(name) for name in names]
@@ -617,13 +1105,6 @@ class Mod:
             await self.bot.say("That user doesn't have any recorded name or "
                                "nickname change.")
 
-    def discordpy_updated(self):
-        try:
-            assert self.bot.purge_from
-        except:
-            return False
-        return True
-
     async def _delete_message(self, message):
         try:
             await self.bot.delete_message(message)
@@ -632,67 +1113,255 @@ class Mod:
         except:
             raise
 
+    def reload_data(self, path, data):
+        """Another shard changed one of the shared lists"""
+        name = os.path.basename(path)
+        if name in self.id_lists:
+            self.id_lists[name].reload(data)
+            return
+        attributes = {"filter.json": "filter",
+                      "antispam.json": "antispam"}
+        attribute = attributes[name]
+        old = getattr(self, attribute)
+        setattr(self, attribute, data)
+        if attribute == "filter":
+            for server_id in set(old) | set(data):
+                if old.get(server_id) == data.get(server_id):
+                    continue
+                if server_id in self._filters or \
+                        server_id in self._compiling:
+                    self._compile_filter(server_id)
+        elif attribute == "antispam":
+            self.spam.reset()
+
+    def _compile_filter(self, server_id):
+        """Compiles the rules of the server. Big filters are compiled in
+        the executor, the previous matcher (if any) is used until then"""
+        rules = tuple(self.filter.get(server_id, ()))
+        if len(rules) <= SYNC_FILTER_RULES:
+            self._compiling.pop(server_id, None)
+            self._use_filter(server_id,
+                             FilterMatcher(rules) if rules else None)
+        elif self._compiling.get(server_id) != rules:
+            self._compiling[server_id] = rules
+            self.bot.create_task(self._compile_in_executor(server_id, rules),
+                                 cog=self)
+
+    async def _compile_in_executor(self, server_id, rules):
+        try:
+            matcher = await self.bot.loop.run_in_executor(
+                None, FilterMatcher, rules)
+        finally:
+            # The rules may have changed meanwhile, another compile is
+            # going then
+            current = self._compiling.get(server_id) == rules
+            if current:
+                del self._compiling[server_id]
+        if current:
+            self._use_filter(server_id, matcher)
+
+    def _use_filter(self, server_id, matcher):
+        if matcher is not None and matcher.invalid:
+            logger.warning("Filter of server {} has invalid rules, matched as "
+                           "plain text: {}".format(
+                               server_id, ", ".join(matcher.invalid)))
+        self._filters[server_id] = matcher
+
     def immune_from_filter(self, message):
-        user = message.author
-        server = message.server
-        admin_role = settings.get_server_admin(server)
-        mod_role = settings.get_server_mod(server)
-
-        if user.id == settings.owner:
-            return True
-        elif discord.utils.get(user.roles, name=admin_role):
-            return True
-        elif discord.utils.get(user.roles, name=mod_role):
-            return True
-        else:
-            return False
+        return self.bot.privileges.is_mod(message.author, message.server)
 
     async def check_filter(self, message):
         if message.channel.is_private:
             return
         server = message.server
-        can_delete = message.channel.permissions_for(server.me).manage_messages
+        # Servers without rules stop at this lookup, before any
+        # permission work
+        try:
+            matcher = self._filters[server.id]
+        except KeyError:
+            if server.id in self._compiling:
+                return
+            self._compile_filter(server.id)
+            matcher = self._filters.get(server.id)
+        if matcher is None:
+            return
 
+        # Owner, admins and mods are immune to the filter. Both are
+        # cached by bot.privileges until roles, members or channels change
         if (message.author.id == self.bot.user.id or
-        self.immune_from_filter(message) or not can_delete): # Owner, admins and mods are immune to the filter
+                self.immune_from_filter(message)):
+            return
+        if not self.bot.privileges.permissions(
+                message.channel, server.me).manage_messages:
             return
 
-        if server.id in self.filter.keys():
-            for w in self.filter[server.id]:
-                if w in message.content.lower():
-                    # Something else in discord.py is throwing a 404 error
-                    # after deletion
-                    try:
-                        await self._delete_message(message)
-                    except:
-                        pass
-                    print("Message deleted. Filtered: " + w)
+        rule = matcher.search(message.content)
+        if rule is not None:
+            # Something else in discord.py is throwing a 404 error
+            # after deletion
+            try:
+                await self._delete_message(message)
+            except:
+                pass
+            print("Message deleted. Filtered: " + rule.source)
+
+    async def check_spam(self, message):
+        if message.channel.is_private or \
+                message.author.id == self.bot.user.id:
+            return
+        config = self.antispam.get(message.server.id)
+        if config is None or not config.get("ENABLED"):
+            return
+        if self.immune_from_filter(message):
+            return
+        reason = self.spam.check(message, self.antispam_config(message.server))
+        if reason is not None:
+            await self._punish_spam(message, reason, config["ACTION"])
+
+    async def _punish_spam(self, message, reason, action):
+        server, channel, author = \
+            message.server, message.channel, message.author
+        try:
+            await self._delete_message(message)
+            if action == "mute":
+                overwrite = channel.overwrites_for(author)
+                overwrite.send_messages = False
+                await self.bot.edit_channel_permissions(channel, author,
+                                                        overwrite)
+            elif action == "blacklist":
+                self.blacklist_user(author)
+        except discord.errors.Forbidden:
+            return
+        if action == "delete":
+            return
+        # Acted on, the next punishment needs a new round of spam
+        self.spam.forget(server.id, author.id)
+        self.audit_log.record(action, server.me, author, server, channel)
+        logger.info("Anti-spam: {}({}) {} in #{} ({}) of {}({}), {}".format(
+            author.name, author.id, "muted" if action == "mute" else
+            "blacklisted", channel.name, channel.id, server.name, server.id,
+            reason))
+
+    async def _gather_names(self, **args):
+        """The last 20 different names of every shard, oldest first"""
+        # Sorted on the time only, the migrated entries all have 0 and
+        # keep their order
+        entries = sorted((e for shard in await coordinator.gather(
+            "past_names", **args) for e in shard), key=lambda e: e[0])
+        names = []
+        for _, name in entries:
+            if name not in names:
+                names.append(name)
+        return names[-20:]
+
+    def past_names(self, user_id, server_id=None):
+        """(time, name) entries of user_id seen by this shard, the
+        nicknames in server_id if given"""
+        if server_id is None:
+            return self.name_history.get(name_key(user_id))
+        return self.name_history.get(nick_key(server_id, user_id))
 
     async def check_names(self, before, after):
         if before.name != after.name:
-            if before.id not in self.past_names.keys():
-                self.past_names[before.id] = [after.name]
-            else:
-                if after.name not in self.past_names[before.id]:
-                    names = deque(self.past_names[before.id], maxlen=20)
-                    names.append(after.name)
-                    self.past_names[before.id] = list(names)
-            dataIO.save_json("data/mod/past_names.json", self.past_names)
+            key = name_key(before.id)
+            if not self.name_history.contains(key, after.name):
+                self.name_history.append(key, after.name)
 
         if before.nick != after.nick and after.nick is not None:
-            server = before.server
-            if not server.id in self.past_nicknames:
-                self.past_nicknames[server.id] = {}
-            if before.id in self.past_nicknames[server.id]:
-                nicks = deque(self.past_nicknames[server.id][before.id],
-                              maxlen=20)
-            else:
-                nicks = []
-            if after.nick not in nicks:
-                nicks.append(after.nick)
-                self.past_nicknames[server.id][before.id] = list(nicks)
-                dataIO.save_json("data/mod/past_nicknames.json",
-                                 self.past_nicknames)
+            key = nick_key(before.server.id, before.id)
+            if not self.name_history.contains(key, after.nick):
+                self.name_history.append(key, after.nick)
+
+    async def flush_logs(self):
+        await self.name_history.flush_in_executor(self.bot.loop)
+        await self.audit_log.flush_in_executor(self.bot.loop)
+
+    def __unload(self):
+        # Synchronous, the reloaded cog reads the file right after
+        coordinator.unregister("past_names")
+        self.name_history.flush()
+        self.audit_log.close()
+
+    async def on_shutdown(self):
+        await self.name_history.flush_in_executor(self.bot.loop)
+        await self.audit_log.flush_in_executor(self.bot.loop)
+
+
+def describe(target):
+    if isinstance(target, discord.Member):
+        return "{}({})".format(target.name, target.id)
+    return target
+
+
+def describe_user(user_id, name):
+    if name is None:
+        return user_id
+    return "{}({})".format(name, user_id)
+
+
+def parse_user_id(text):
+    """The id in a mention or id, raises ValueError"""
+    match = MENTION_ID.match(text)
+    text = match.group(1) if match else text
+    if not text.isdigit():
+        raise ValueError(text)
+    return text
+
+
+def parse_time(text, now):
+    """A timestamp from a duration ago (30m, 7d...) or a date,
+    raises ValueError"""
+    match = DURATION.match(text.lower())
+    if match:
+        return now - float(match.group(1)) * \
+            DURATION_UNITS[match.group(2)]
+    date = datetime.datetime.strptime(text, "%Y-%m-%d")
+    return (date - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+def parse_ids(data):
+    """The user ids in the bytes of a file, in order, without duplicates"""
+    ids = (match.decode("ascii") for match in USER_ID.findall(data))
+    return list(OrderedDict.fromkeys(ids))
+
+
+def export_ids(ids):
+    return "\n".join(sorted(ids, key=int)).encode("ascii")
+
+
+def name_key(user_id):
+    return "name:" + user_id
+
+
+def nick_key(server_id, user_id):
+    return "nick:{}:{}".format(server_id, user_id)
+
+
+def history_path(bot):
+    # Every shard keeps the history of what it sees
+    if coordinator.is_sharded():
+        return "data/mod/name_history-shard{}.log".format(bot.shard_id)
+    return "data/mod/name_history.log"
+
+
+def migrate_name_history(history):
+    """Moves past_names.json and past_nicknames.json into history"""
+    names = "data/mod/past_names.json"
+    nicknames = "data/mod/past_nicknames.json"
+    if os.path.isfile(names):
+        for user_id, past in dataIO.load_json(names).items():
+            for name in past:
+                history.append(name_key(user_id), name, when=0)
+    if os.path.isfile(nicknames):
+        for server_id, users in dataIO.load_json(nicknames).items():
+            for user_id, past in users.items():
+                for nick in past:
+                    history.append(nick_key(server_id, user_id), nick,
+                                   when=0)
+    history.flush()
+    for path in (names, nicknames):
+        if os.path.isfile(path):
+            os.replace(path, path + ".migrated")
 
 def check_folders():
     folders = ("data", "data/mod/")
@@ -721,13 +1390,9 @@ def check_files():
         print("Creating empty filter.json...")
         fileIO("data/mod/filter.json", "save", {})
 
-    if not os.path.isfile("data/mod/past_names.json"):
-        print("Creating empty past_names.json...")
-        fileIO("data/mod/past_names.json", "save", {})
-
-    if not os.path.isfile("data/mod/past_nicknames.json"):
-        print("Creating empty past_nicknames.json...")
-        fileIO("data/mod/past_nicknames.json", "save", {})
+    if not os.path.isfile("data/mod/antispam.json"):
+        print("Creating empty antispam.json...")
+        fileIO("data/mod/antispam.json", "save", {})
 
 
 
@@ -739,12 +1404,18 @@ def setup(bot):
     # Prevents the logger from being loaded again in case of module reload
     if logger.level == 0:
         logger.setLevel(logging.INFO)
-        handler = logging.FileHandler(
-            filename='data/mod/mod.log', encoding='utf-8', mode='a')
-        handler.setFormatter(
-            logging.Formatter('%(asctime)s %(message)s', datefmt="[%d/%m/%Y %H:%M]"))
-        logger.addHandler(handler)
+        handler = logs.file_handler('data/mod/mod.log', logging.Formatter(
+            '%(asctime)s %(message)s', datefmt="[%d/%m/%Y %H:%M]"))
+        logs.add_queued_handlers(logger, handler)
     n = Mod(bot)
+    for name in ("whitelist", "blacklist", "ignorelist", "filter",
+                 "antispam"):
+        coordinator.watch("data/mod/{}.json".format(name), n.reload_data)
+    for name, store in n.id_lists.items():
+        coordinator.watch_ids("data/mod/" + name, store.apply)
     bot.add_listener(n.check_filter, "on_message")
+    bot.add_listener(n.check_spam, "on_message")
     bot.add_listener(n.check_names, "on_member_update")
+    coordinator.register("past_names", n.past_names)
+    bot.scheduler.every(10, n.flush_logs, cog=n)
     bot.add_cog(n)
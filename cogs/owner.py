@@ -1,8 +1,9 @@
 import discord
 from discord.ext import commands
-from cogs.utils import checks
+from cogs.utils import checks, coordinator
 from __main__ import set_cog, send_cmd_help, settings
 from .utils.dataIO import fileIO
+from .utils.chat_formatting import pagify, box
 
 import importlib
 import traceback
@@ -13,7 +14,6 @@ import datetime
 import glob
 import os
 import time
-import aiohttp
 
 log = logging.getLogger("red.owner")
 
@@ -46,10 +46,6 @@ class Owner:
         self.bot = bot
         self.setowner_lock = False
         self.disabled_commands = fileIO("data/red/disabled_commands.json", "load")
-        self.session = aiohttp.ClientSession(loop=self.bot.loop)
-
-    def __unload(self):
-        self.session.close()
 
     @commands.command()
     @checks.is_owner()
@@ -237,7 +233,6 @@ class Owner:
             await send_cmd_help(ctx)
             return
 
-        self.bot.command_prefix = sorted(prefixes, reverse=True)
         settings.prefixes = sorted(prefixes, reverse=True)
         log.debug("Setting prefixes to:\n\t{}".format(settings.prefixes))
 
@@ -246,6 +241,29 @@ class Owner:
         else:
             await self.bot.say("Prefix set")
 
+    @_set.command(name="serverprefix", pass_context=True, no_pm=True)
+    @checks.serverowner_or_permissions(administrator=True)
+    async def serverprefix(self, ctx, *prefixes):
+        """Sets Red's prefixes for this server
+
+        Accepts multiple prefixes separated by a space. Enclose in double
+        quotes if a prefix contains spaces.
+        Without prefixes the server goes back to the global ones.
+        Example: set serverprefix ! $ ? "two words" """
+        server = ctx.message.server
+        settings.set_server_prefixes(server, sorted(prefixes, reverse=True))
+        self.bot.command_prefix.refresh(server.id)
+        log.debug("Setting prefixes of {} to:\n\t{}"
+                  "".format(server.id, prefixes))
+
+        if not prefixes:
+            await self.bot.say("This server now uses the global prefixes: "
+                               "{}".format(" ".join(self.bot.command_prefix)))
+        elif len(prefixes) > 1:
+            await self.bot.say("Server prefixes set")
+        else:
+            await self.bot.say("Server prefix set")
+
     @_set.command(pass_context=True)
     @checks.is_owner()
     async def name(self, ctx, *, name):
@@ -301,8 +319,7 @@ class Owner:
     async def avatar(self, url):
         """Sets Red's avatar"""
         try:
-            async with self.session.get(url) as r:
-                data = await r.read()
+            data = await self.bot.http_service.get_bytes(url)
             await self.bot.edit_profile(settings.password, avatar=data)
             await self.bot.say("Done.")
             log.debug("changed avatar")
@@ -319,17 +336,227 @@ class Owner:
         if len(token) < 50:
             await self.bot.say("Invalid token.")
         else:
-            settings.login_type = "token"
-            settings.email = token
-            settings.password = ""
+            with settings.transaction():
+                settings.login_type = "token"
+                settings.email = token
+                settings.password = ""
             await self.bot.say("Token set. Restart me.")
             log.debug("Token changed.")
 
+    @_set.group(name="ratelimit", pass_context=True)
+    @checks.is_owner()
+    async def _set_ratelimit(self, ctx):
+        """Sets the command rate limits
+
+        Every user, channel and server has a bucket of tokens that
+        refills over time. Commands take tokens from the buckets they
+        fall under and are ignored when there aren't enough of them."""
+        if ctx.invoked_subcommand is None:
+            await send_cmd_help(ctx)
+            limiter = self.bot.rate_limiter
+            msg = "```\nEnabled: {}\n".format(limiter.enabled)
+            for scope, (rate, burst) in sorted(limiter.limits.items()):
+                msg += "{}: {} tokens/s, {} max\n".format(scope.title(),
+                                                          rate, burst)
+            msg += "\nCommand costs:\n"
+            for command, cost in sorted(limiter.costs.items()):
+                msg += "{}: {}\n".format(command, cost)
+            msg += "```"
+            await self.bot.say(msg)
+
+    @_set_ratelimit.command(name="scope")
+    async def _ratelimit_scope(self, scope: str, rate: float, burst: int):
+        """Sets how many tokens per second a scope refills and how many
+        it can hold
+
+        Scope can be user, channel or server. A rate of 0 disables
+        the scope.
+        Example: set ratelimit scope user 0.5 5"""
+        scope = scope.upper()
+        if scope not in self.bot.rate_limiter.SCOPES:
+            await self.bot.say("Scope must be user, channel or server.")
+            return
+        if rate < 0 or burst < 1:
+            await self.bot.say("Invalid values.")
+            return
+        limits = settings.rate_limits.copy()
+        limits[scope] = [rate, burst]
+        settings.rate_limits = limits
+        self.bot.rate_limiter.configure(limits)
+        await self.bot.say("Rate limit updated.")
+
+    @_set_ratelimit.command(name="cost")
+    async def _ratelimit_cost(self, cost: int, *, command: str):
+        """Sets how many tokens a command costs
+
+        Subcommands can be given their own cost.
+        Example: set ratelimit cost 5 leaderboard global"""
+        if cost < 0:
+            await self.bot.say("Cost can't be negative.")
+            return
+        limits = settings.rate_limits.copy()
+        costs = limits.get("COSTS", self.bot.rate_limiter.costs).copy()
+        costs[command.strip().lower()] = cost
+        limits["COSTS"] = costs
+        settings.rate_limits = limits
+        self.bot.rate_limiter.configure(limits)
+        await self.bot.say("Command cost updated.")
+
+    @_set_ratelimit.command(name="toggle")
+    async def _ratelimit_toggle(self):
+        """Turns rate limiting on and off"""
+        limits = settings.rate_limits.copy()
+        limits["ENABLED"] = not self.bot.rate_limiter.enabled
+        settings.rate_limits = limits
+        self.bot.rate_limiter.configure(limits)
+        if limits["ENABLED"]:
+            await self.bot.say("Rate limiting enabled.")
+        else:
+            await self.bot.say("Rate limiting disabled.")
+
+    @commands.group(pass_context=True)
+    @checks.is_owner()
+    async def executor(self, ctx):
+        """Shows the command queue and sets its limits"""
+        if ctx.invoked_subcommand is None:
+            ex = self.bot.executor
+            depths = ex.lane_depths()
+            msg = ("```\nRunning: {}/{} ({} reserved for priority)\n"
+                   "Queued: {} priority, {} normal, "
+                   "{} waiting on a cog\nMax queued: {}/{}\n"
+                   "Completed: {}\nDropped: {}\n".format(
+                       ex.running, ex.concurrency,
+                       ex.concurrency - ex.normal_slots, depths["priority"],
+                       depths["normal"], depths["parked"], ex.max_depth,
+                       ex.max_queue, ex.completed, ex.dropped))
+            if ex.cog_limits:
+                msg += "\nCog limits:\n"
+                for cog, limit in sorted(ex.cog_limits.items()):
+                    msg += "{}: {}\n".format(cog, limit)
+            msg += "```"
+            await self.bot.say(msg)
+
+    @executor.command(name="concurrency")
+    async def _executor_concurrency(self, limit: int):
+        """Sets how many commands can run at once"""
+        if limit < 1:
+            await self.bot.say("It must be at least 1.")
+            return
+        config = settings.executor.copy()
+        config["CONCURRENCY"] = limit
+        settings.executor = config
+        self.bot.executor.configure(config)
+        await self.bot.say("Concurrency set to {}.".format(limit))
+
+    @executor.command(name="reserved")
+    async def _executor_reserved(self, slots: int):
+        """Sets how many slots only owner, admin and mod commands can use"""
+        if slots < 0:
+            await self.bot.say("It can't be negative.")
+            return
+        config = settings.executor.copy()
+        config["RESERVED"] = slots
+        settings.executor = config
+        self.bot.executor.configure(config)
+        await self.bot.say("Reserved slots set to {}.".format(slots))
+
+    @executor.command(name="queue")
+    async def _executor_queue(self, size: int):
+        """Sets how many commands can wait before new ones are dropped"""
+        if size < 1:
+            await self.bot.say("It must be at least 1.")
+            return
+        config = settings.executor.copy()
+        config["MAX_QUEUE"] = size
+        settings.executor = config
+        self.bot.executor.configure(config)
+        await self.bot.say("Queue size set to {}.".format(size))
+
+    @executor.command(name="cog")
+    async def _executor_cog(self, cog: str, limit: int):
+        """Sets how many commands of a cog can run at once
+
+        0 removes the limit. The cog name is case sensitive.
+        Example: executor cog Audio 5"""
+        config = settings.executor.copy()
+        cogs = config.get("COGS", self.bot.executor.cog_limits).copy()
+        if limit < 1:
+            cogs.pop(cog, None)
+        else:
+            cogs[cog] = limit
+        config["COGS"] = cogs
+        settings.executor = config
+        self.bot.executor.configure(config)
+        await self.bot.say("Limit updated.")
+
+    @commands.command()
+    @checks.is_owner()
+    async def jobs(self):
+        """Shows the scheduled background jobs and their run times"""
+        jobs = sorted(self.bot.scheduler.jobs(),
+                      key=lambda j: (j.cog or "", j.name))
+        if not jobs:
+            await self.bot.say("No jobs are scheduled.")
+            return
+        msg = ""
+        for job in jobs:
+            every = "every {}s".format(job.interval) if job.interval \
+                else "once"
+            msg += ("{}.{} ({}): {} runs, {} failed, {} overruns, "
+                    "mean {:.3f}s, max {:.3f}s, max lag {:.3f}s\n".format(
+                        job.cog or "Red", job.name, every, job.runs,
+                        job.failures, job.overruns, job.mean_time,
+                        job.max_time, job.max_lag))
+        for page in pagify(msg, ["\n"]):
+            await self.bot.say(box(page))
+
+    @commands.group(pass_context=True)
+    @checks.is_owner()
+    async def http(self, ctx):
+        """Shows the HTTP requests made by cogs and sets their limits"""
+        if ctx.invoked_subcommand is None:
+            service = self.bot.http_service
+            msg = ("Timeout: {}s, retries: {}, {} per host\n\n".format(
+                service.timeout, service.retries, service.per_host))
+            for host, stats in sorted(service.stats.items()):
+                msg += ("{}: {} requests, {} failed, {} retries, "
+                        "mean {:.3f}s, max {:.3f}s\n".format(
+                            host, stats.requests, stats.errors,
+                            stats.retries, stats.mean_latency,
+                            stats.max_latency))
+            for page in pagify(msg, ["\n"]):
+                await self.bot.say(box(page))
+
+    @http.command(name="timeout")
+    async def _http_timeout(self, seconds: float):
+        """Sets how long a request can take"""
+        if seconds <= 0:
+            await self.bot.say("It must be more than 0.")
+            return
+        self._set_http("TIMEOUT", seconds)
+        await self.bot.say("Timeout set to {}s.".format(seconds))
+
+    @http.command(name="retries")
+    async def _http_retries(self, retries: int):
+        """Sets how many times a failed request is retried"""
+        if retries < 0:
+            await self.bot.say("It can't be negative.")
+            return
+        self._set_http("RETRIES", retries)
+        await self.bot.say("Retries set to {}.".format(retries))
+
+    def _set_http(self, key, value):
+        config = settings.http.copy()
+        config[key] = value
+        settings.http = config
+        self.bot.http_service.configure(config)
+
     @commands.command()
     @checks.is_owner()
     async def shutdown(self):
         """Shuts down Red"""
-        await self.bot.logout()
+        # Not awaited: shutdown waits for the running commands, this one too
+        self.bot.loop.create_task(self.bot.shutdown())
 
     @commands.group(name="command", pass_context=True)
     @checks.is_owner()
@@ -357,6 +584,7 @@ class Owner:
         else:
             comm_obj.enabled = False
             comm_obj.hidden = True
+            self.bot.formatter.clear()
             self.disabled_commands.append(command)
             fileIO("data/red/disabled_commands.json", "save", self.disabled_commands)
             await self.bot.say("Command has been disabled.")
@@ -375,6 +603,7 @@ class Owner:
             comm_obj = await self.get_command(command)
             comm_obj.enabled = True
             comm_obj.hidden = False
+            self.bot.formatter.clear()
         except:  # In case it was in the disabled list but not currently loaded
             pass # No point in even checking what returns
 
@@ -401,6 +630,7 @@ class Owner:
                 cmd_obj.hidden = True
             except:
                 pass
+        self.bot.formatter.clear()
 
     @commands.command()
     @checks.is_owner()
@@ -455,12 +685,14 @@ class Owner:
     async def servers(self, ctx):
         """Lists and allows to leave servers"""
         owner = ctx.message.author
-        servers = list(self.bot.servers)
+        # Servers of every shard
+        servers = [s for shard in await coordinator.gather("servers")
+                   for s in shard]
         server_list = {}
         msg = ""
         for i in range(0, len(servers)):
             server_list[str(i)] = servers[i]
-            msg += "{}: {}\n".format(str(i), servers[i].name)
+            msg += "{}: {}\n".format(str(i), servers[i]["name"])
         msg += "\nTo leave a server just type its number."
         await self.bot.say(msg)
         while msg != None:
@@ -468,7 +700,8 @@ class Owner:
             if msg != None:
                 msg = msg.content.strip()
                 if msg in server_list.keys():
-                    await self.leave_confirmation(server_list[msg], owner, ctx)
+                    await self.leave_confirmation(server_list[msg], owner,
+                                                  ctx)
                 else:
                     break
             else:
@@ -511,19 +744,21 @@ class Owner:
         "**Official server:**\n<https://discord.me/Red-DiscordBot>")
 
     async def leave_confirmation(self, server, owner, ctx):
+        """server is an entry of the servers query, the server might
+        belong to another shard"""
         if not ctx.message.channel.is_private:
-            current_server = ctx.message.server
+            current_server = ctx.message.server.id
         else:
             current_server = None
         answers = ("yes", "y")
         await self.bot.say("Are you sure you want me "
-                    "to leave {}? (yes/no)".format(server.name))
+                    "to leave {}? (yes/no)".format(server["name"]))
         msg = await self.bot.wait_for_message(author=owner, timeout=15)
         if msg is None:
             await self.bot.say("I guess not.")
         elif msg.content.lower().strip() in answers:
-            await self.bot.leave_server(server)
-            if server != current_server:
+            await coordinator.gather("leave_server", server_id=server["id"])
+            if server["id"] != current_server:
                 await self.bot.say("Done.")
         else:
             await self.bot.say("Alright then.")
@@ -553,6 +788,8 @@ class Owner:
             raise CogLoadError(*e.args)
         except:
             raise
+        finally:
+            self.bot.formatter.clear()
 
     def _unload_cog(self, cogname, reloading=False):
         if not reloading and cogname == "cogs.owner":
@@ -562,6 +799,20 @@ class Owner:
             self.bot.unload_extension(cogname)
         except:
             raise CogUnloadError
+        finally:
+            self.bot.formatter.clear()
+
+    def list_servers(self):
+        shard = self.bot.shard_id or 0
+        return [{"id": s.id, "name": s.name, "shard": shard}
+                for s in self.bot.servers]
+
+    async def leave_server(self, server_id):
+        server = self.bot.get_server(server_id)
+        if server is None:
+            return None
+        await self.bot.leave_server(server)
+        return server_id
 
     def _list_cogs(self):
         cogs = glob.glob("cogs/*.py")
@@ -612,4 +863,6 @@ def check_files():
 def setup(bot):
     check_files()
     n = Owner(bot)
+    coordinator.register("servers", n.list_servers)
+    coordinator.register("leave_server", n.leave_server)
     bot.add_cog(n)
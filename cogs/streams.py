@@ -2,15 +2,15 @@ import discord
 from discord.ext import commands
 from .utils.dataIO import fileIO
 from .utils.chat_formatting import *
-from .utils import checks
+from .utils import checks, coordinator
 from __main__ import send_cmd_help
 import os
 import time
-import aiohttp
 import asyncio
-from copy import deepcopy
 import logging
 
+CHECK_DELAY = 60  # Seconds between checks of every stream
+
 
 class Streams:
     """Streams
@@ -274,8 +274,7 @@ class Streams:
     async def hitbox_online(self, stream):
         url = "https://api.hitbox.tv/user/" + stream
         try:
-            async with aiohttp.get(url) as r:
-                data = await r.json()
+            data = await self.bot.http_service.get_json(url)
             if data["is_live"] == "0":
                 return False
             elif data["is_live"] == "1":
@@ -289,8 +288,8 @@ class Streams:
         url = "https://api.twitch.tv/kraken/streams?channel=" + stream
         header = {'Client-ID': self.settings.get("TWITCH_TOKEN", "")}
         try:
-            async with aiohttp.get(url, headers=header) as r:
-                data = await r.json()
+            data = await self.bot.http_service.get_json(url,
+                                                        headers=header)
             if len(data["streams"]) > 0:
                 return True
             else:
@@ -302,8 +301,7 @@ class Streams:
     async def beam_online(self, stream):
         url = "https://beam.pro/api/v1/channels/" + stream
         try:
-            async with aiohttp.get(url) as r:
-                data = await r.json()
+            data = await self.bot.http_service.get_json(url)
             if "online" in data:
                 if data["online"] is True:
                     return True
@@ -318,8 +316,7 @@ class Streams:
     async def twitch_exists(self, stream):
         url = "https://api.twitch.tv/channels/" + stream
         try:
-            async with aiohttp.get(url) as r:
-                data = await r.json()
+            data = await self.bot.http_service.get_json(url)
             if "error" in data:
                 return False
             else:
@@ -328,78 +325,55 @@ class Streams:
             return "error"
 
     async def stream_checker(self):
-        CHECK_DELAY = 60
-
-        while self == self.bot.get_cog("Streams"):
-
-            old = (deepcopy(self.twitch_streams), deepcopy(
-                self.hitbox_streams), deepcopy(self.beam_streams))
-
-            for stream in self.twitch_streams:
-                online = await self.twitch_online(stream["NAME"])
-                if online is True and not stream["ALREADY_ONLINE"]:
-                    stream["ALREADY_ONLINE"] = True
-                    for channel in stream["CHANNELS"]:
-                        channel_obj = self.bot.get_channel(channel)
-                        if channel_obj is None:
-                            continue
-                        can_speak = channel_obj.permissions_for(channel_obj.server.me).send_messages
-                        if channel_obj and can_speak:
-                            await self.bot.send_message(
-                                self.bot.get_channel(channel),
-                                "http://www.twitch.tv/"
-                                "{} is online!".format(stream["NAME"]))
-                else:
-                    if stream["ALREADY_ONLINE"] and not online:
-                        stream["ALREADY_ONLINE"] = False
-                await asyncio.sleep(0.5)
-
-            for stream in self.hitbox_streams:
-                online = await self.hitbox_online(stream["NAME"])
+        """Polls every stream. Runs on one shard only, the alerts are sent
+        by the shards that have the channels"""
+        sites = (("twitch", self.twitch_online, "http://www.twitch.tv/"),
+                 ("hitbox", self.hitbox_online, "http://www.hitbox.tv/"),
+                 ("beam", self.beam_online, "https://beam.pro/"))
+        for site, is_online, url in sites:
+            attribute = site + "_streams"
+            changed = {}
+            for stream in list(getattr(self, attribute)):
+                online = await is_online(stream["NAME"])
                 if online is True and not stream["ALREADY_ONLINE"]:
-                    stream["ALREADY_ONLINE"] = True
-                    for channel in stream["CHANNELS"]:
-                        channel_obj = self.bot.get_channel(channel)
-                        if channel_obj is None:
-                            continue
-                        can_speak = channel_obj.permissions_for(channel_obj.server.me).send_messages
-                        if channel_obj and can_speak:
-                            await self.bot.send_message(
-                                self.bot.get_channel(channel),
-                                "http://www.hitbox.tv/"
-                                "{} is online!".format(stream["NAME"]))
-                else:
-                    if stream["ALREADY_ONLINE"] and not online:
-                        stream["ALREADY_ONLINE"] = False
-                await asyncio.sleep(0.5)
-
-            for stream in self.beam_streams:
-                online = await self.beam_online(stream["NAME"])
-                if online is True and not stream["ALREADY_ONLINE"]:
-                    stream["ALREADY_ONLINE"] = True
-                    for channel in stream["CHANNELS"]:
-                        channel_obj = self.bot.get_channel(channel)
-                        if channel_obj is None:
-                            continue
-                        can_speak = channel_obj.permissions_for(channel_obj.server.me).send_messages
-                        if channel_obj and can_speak:
-                            await self.bot.send_message(
-                                self.bot.get_channel(channel),
-                                "https://beam.pro/"
-                                "{} is online!".format(stream["NAME"]))
-                else:
-                    if stream["ALREADY_ONLINE"] and not online:
-                        stream["ALREADY_ONLINE"] = False
+                    changed[stream["NAME"]] = True
+                    await coordinator.gather(
+                        "stream_alert", channels=stream["CHANNELS"],
+                        text="{}{} is online!".format(url, stream["NAME"]))
+                elif stream["ALREADY_ONLINE"] and not online:
+                    changed[stream["NAME"]] = False
                 await asyncio.sleep(0.5)
+            if not changed:
+                continue
+            # Another shard may have changed the list meanwhile
+            streams = getattr(self, attribute)
+            for stream in streams:
+                if stream["NAME"] in changed:
+                    stream["ALREADY_ONLINE"] = changed[stream["NAME"]]
+            fileIO("data/streams/{}.json".format(site), "save", streams)
+
+    async def send_alert(self, channels, text):
+        """Posts text in the channels this shard has"""
+        for channel_id in channels:
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                continue
+            if channel.permissions_for(channel.server.me).send_messages:
+                try:
+                    await self.bot.send_message(channel, text)
+                except discord.HTTPException:
+                    pass
+
+    def reload(self, path, data):
+        """Another shard changed the streams or the settings"""
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name == "settings":
+            self.settings = data
+        else:
+            setattr(self, name + "_streams", data)
 
-            if old != (self.twitch_streams, self.hitbox_streams,
-                       self.beam_streams):
-                fileIO("data/streams/twitch.json", "save", self.twitch_streams)
-                fileIO("data/streams/hitbox.json", "save", self.hitbox_streams)
-                fileIO("data/streams/beam.json", "save", self.beam_streams)
-
-            await asyncio.sleep(CHECK_DELAY)
-
+    def __unload(self):
+        coordinator.unregister("stream_alert")
 
 def check_folders():
     if not os.path.exists("data/streams"):
@@ -435,6 +409,11 @@ def setup(bot):
     check_folders()
     check_files()
     n = Streams(bot)
-    loop = asyncio.get_event_loop()
-    loop.create_task(n.stream_checker())
+    # A single shard polls the APIs for all of them
+    if not bot.shard_id:
+        bot.scheduler.every(CHECK_DELAY, n.stream_checker, cog=n, jitter=5,
+                            delay=0)
+    coordinator.register("stream_alert", n.send_alert)
+    for name in ("twitch", "hitbox", "beam", "settings"):
+        coordinator.watch("data/streams/{}.json".format(name), n.reload)
     bot.add_cog(n)
@@ -0,0 +1,168 @@
+import time
+from collections import deque, OrderedDict
+
+DEFAULT_CONFIG = {
+    "ENABLED": False,
+    # A user sending MESSAGES messages within SECONDS is flooding
+    "MESSAGES": 6,
+    "SECONDS": 5,
+    # The same message DUPLICATES times within DUPLICATE_SECONDS
+    "DUPLICATES": 3,
+    "DUPLICATE_SECONDS": 30,
+    # A channel getting CHANNEL_MESSAGES within CHANNEL_SECONDS is raided:
+    # for RAID_SECONDS the flood limit of the server's users is halved
+    "CHANNEL_MESSAGES": 40,
+    "CHANNEL_SECONDS": 5,
+    "RAID_SECONDS": 120,
+    "ACTION": "delete"
+}
+ACTIONS = ("delete", "mute", "blacklist")
+MAX_TRACKED = 20000
+
+FLOOD = "flood"
+DUPLICATES = "duplicate messages"
+
+
+class RateWindow:
+    """The times of the last `size` events, enough to tell whether
+    `size` (or fewer) of them happened within some seconds"""
+
+    __slots__ = ("times",)
+
+    def __init__(self, size):
+        self.times = deque(maxlen=size)
+
+    def hit(self, now, count, seconds):
+        """Records an event, returns whether the last count events
+        (count <= size) happened within seconds"""
+        times = self.times
+        times.append(now)
+        return len(times) >= count and now - times[-count] <= seconds
+
+
+class DuplicateWindow:
+    """Hashes of the last `size` contents younger than `seconds`, with
+    how many times each occurs"""
+
+    __slots__ = ("entries", "counts", "size", "seconds")
+
+    def __init__(self, size, seconds):
+        self.entries = deque()
+        self.counts = {}
+        self.size = size
+        self.seconds = seconds
+
+    def hit(self, key, now):
+        """Records key, returns how many times it's in the window"""
+        entries, counts = self.entries, self.counts
+        while entries and (len(entries) >= self.size or
+                           now - entries[0][0] > self.seconds):
+            _, old = entries.popleft()
+            left = counts[old] - 1
+            if left:
+                counts[old] = left
+            else:
+                del counts[old]
+        entries.append((now, key))
+        counts[key] = counts.get(key, 0) + 1
+        return counts[key]
+
+
+class UserState:
+    __slots__ = ("rate", "duplicates", "last", "horizon")
+
+    def __init__(self, config):
+        self.rate = RateWindow(config["MESSAGES"])
+        # Enough room for the duplicates among the other messages
+        self.duplicates = DuplicateWindow(
+            max(config["DUPLICATES"], config["MESSAGES"]) * 2,
+            config["DUPLICATE_SECONDS"])
+        self.last = 0
+        # Quiet for longer than this, nothing in the windows matters
+        self.horizon = max(config["SECONDS"], config["DUPLICATE_SECONDS"])
+
+
+class SpamDetector:
+    """Flood, duplicate and raid detection, O(1) per message
+
+    Users are tracked per server in an LRU capped at max_users, and
+    dropped once they've been quiet for longer than any window, so
+    memory follows the number of active users."""
+
+    def __init__(self, max_users=MAX_TRACKED):
+        self.max_users = max_users
+        self._users = OrderedDict()  # (server id, user id): UserState
+        self._channels = {}  # (server id, channel id): RateWindow
+        self._raids = {}  # server id: raid mode end
+        self.detected = 0
+
+    def reset(self, server_id=None):
+        """Forgets what was tracked in server_id (or everywhere), done when
+        its settings change"""
+        if server_id is None:
+            self._users.clear()
+            self._channels.clear()
+            self._raids.clear()
+            return
+        for key in [k for k in self._users if k[0] == server_id]:
+            del self._users[key]
+        for key in [k for k in self._channels if k[0] == server_id]:
+            del self._channels[key]
+        self._raids.pop(server_id, None)
+
+    def forget(self, server_id, user_id):
+        self._users.pop((server_id, user_id), None)
+
+    def in_raid(self, server_id, now=None):
+        end = self._raids.get(server_id)
+        return end is not None and (now or time.monotonic()) < end
+
+    def _expire(self, now):
+        # Least recently active first. Every user has the horizon of their
+        # server's settings, one with a longer one can hold the others
+        # back a little, the cap still bounds them
+        users = self._users
+        while users:
+            key, state = next(iter(users.items()))
+            if len(users) <= self.max_users and \
+                    now - state.last <= state.horizon:
+                break
+            del users[key]
+
+    def check(self, message, config, now=None):
+        """Records message, returns why it's spam (FLOOD, DUPLICATES) or
+        None"""
+        if now is None:
+            now = time.monotonic()
+        server_id = message.server.id
+        channel_key = (server_id, message.channel.id)
+        channel = self._channels.get(channel_key)
+        if channel is None:
+            channel = self._channels[channel_key] = RateWindow(
+                config["CHANNEL_MESSAGES"])
+        if channel.hit(now, config["CHANNEL_MESSAGES"],
+                       config["CHANNEL_SECONDS"]):
+            self._raids[server_id] = now + config["RAID_SECONDS"]
+
+        key = (server_id, message.author.id)
+        state = self._users.get(key)
+        if state is None:
+            state = self._users[key] = UserState(config)
+        else:
+            self._users.move_to_end(key)
+        state.last = now
+        self._expire(now)
+
+        limit = config["MESSAGES"]
+        if self.in_raid(server_id, now):
+            limit = max(limit // 2, 2)
+        reason = None
+        if state.rate.hit(now, limit, config["SECONDS"]):
+            reason = FLOOD
+        content = message.content.casefold().strip()
+        if content and state.duplicates.hit(hash(content), now) >= \
+                config["DUPLICATES"]:
+            reason = reason or DUPLICATES
+        if reason is not None:
+            self.detected += 1
+        return reason
@@ -0,0 +1,163 @@
+import functools
+import logging
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger("red.auditlog")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS actions (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    action TEXT NOT NULL,
+    moderator TEXT,
+    moderator_name TEXT,
+    target TEXT,
+    target_name TEXT,
+    server TEXT,
+    channel TEXT,
+    count INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS actions_server ON actions (server, timestamp);
+CREATE INDEX IF NOT EXISTS actions_target ON actions (target, timestamp);
+CREATE INDEX IF NOT EXISTS actions_moderator
+    ON actions (moderator, timestamp);
+"""
+COLUMNS = ("id", "timestamp", "action", "moderator", "moderator_name",
+           "target", "target_name", "server", "channel", "count")
+
+
+class Action:
+    """A row of the audit log"""
+
+    __slots__ = COLUMNS
+
+    def __init__(self, row):
+        for name, value in zip(COLUMNS, row):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "<Action {} {} by {} on {}>".format(
+            self.id, self.action, self.moderator, self.target)
+
+
+class AuditLog:
+    """Moderation actions stored in an indexed SQLite database
+
+    record() only buffers the action, flush() writes the buffer in one
+    transaction and is meant to be called on unload, like HistoryLog.
+    flush_in_executor() and query_in_executor() do the database work in
+    another thread, they're the ones to use from the event loop: the
+    database may be busy with another shard for a while. Queries write
+    the buffer first so they see everything.
+
+    The database is in WAL mode so shards can share it, readers don't
+    block the writer and the other way around. The connection is guarded
+    by a lock, only one thread uses it at a time."""
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = []
+        self._failed = []  # Actions a busy database refused, retried first
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self.written = 0
+
+    def record(self, action, moderator=None, target=None, server=None,
+               channel=None, count=1, when=None):
+        """Buffers an action. moderator and target are users or ids,
+        server and channel objects or ids"""
+        if when is None:
+            when = time.time()
+        self._pending.append((
+            when, action, _id(moderator), _name(moderator), _id(target),
+            _name(target), _id(server), _id(channel), count))
+
+    def _take_pending(self):
+        pending, self._pending = self._pending, []
+        return pending
+
+    def _write(self, pending):
+        # Called with the lock held
+        pending = self._failed + pending
+        if not pending:
+            return
+        try:
+            with self._db:
+                self._db.executemany(
+                    "INSERT INTO actions (timestamp, action, moderator, "
+                    "moderator_name, target, target_name, server, channel, "
+                    "count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", pending)
+        except sqlite3.Error:
+            # Kept for the next write, the database may just be busy
+            self._failed = pending
+            log.exception("Couldn't write to the audit log")
+            return
+        self._failed = []
+        self.written += len(pending)
+
+    def _flush_pending(self, pending):
+        with self._lock:
+            self._write(pending)
+
+    def flush(self):
+        self._flush_pending(self._take_pending())
+
+    async def flush_in_executor(self, loop):
+        """flush() with the database written by another thread"""
+        await loop.run_in_executor(None, self._flush_pending,
+                                   self._take_pending())
+
+    def query(self, **kwargs):
+        """The matching actions, newest first. See _query() for the
+        arguments"""
+        return self._query(self._take_pending(), **kwargs)
+
+    async def query_in_executor(self, loop, **kwargs):
+        """query() with the database read by another thread"""
+        return await loop.run_in_executor(None, functools.partial(
+            self._query, self._take_pending(), **kwargs))
+
+    def _query(self, pending, server=None, target=None, moderator=None,
+               action=None, since=None, until=None, limit=20, offset=0):
+        where, args = [], []
+        for column, value in (("server", server), ("target", target),
+                              ("moderator", moderator),
+                              ("action", action)):
+            if value is not None:
+                where.append("{} = ?".format(column))
+                args.append(_id(value))
+        if since is not None:
+            where.append("timestamp >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("timestamp < ?")
+            args.append(until)
+        sql = "SELECT {} FROM actions".format(", ".join(COLUMNS))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?"
+        args += [limit, offset]
+        with self._lock:
+            self._write(pending)
+            return [Action(row) for row in self._db.execute(sql, args)]
+
+    def close(self):
+        with self._lock:
+            self._write(self._take_pending())
+            self._db.close()
+
+
+def _id(value):
+    if value is None or isinstance(value, str):
+        return value
+    return value.id
+
+
+def _name(value):
+    return getattr(value, "name", None)
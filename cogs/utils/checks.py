@@ -2,6 +2,7 @@ from discord.ext import commands
 import discord.utils
 from cogs.utils.settings import Settings
 from cogs.utils.dataIO import fileIO
+from cogs.utils import privileges
 from __main__ import settings
 
 #
@@ -33,7 +34,7 @@ def check_permissions(ctx, perms):
 
     ch = ctx.message.channel
     author = ctx.message.author
-    resolved = ch.permissions_for(author)
+    resolved = ctx.bot.privileges.permissions(ch, author)
     return all(getattr(resolved, name, None) == value for name, value in perms.items())
 
 def role_or_permissions(ctx, check, **perms):
@@ -48,20 +49,24 @@ def role_or_permissions(ctx, check, **perms):
     role = discord.utils.find(check, author.roles)
     return role is not None
 
+def privilege_or_permissions(ctx, level, **perms):
+    if check_permissions(ctx, perms):
+        return True
+
+    if ctx.message.channel.is_private:
+        return False # can't have roles in PMs
+
+    return ctx.bot.privileges.level(ctx.message.author) >= level
+
 def mod_or_permissions(**perms):
     def predicate(ctx):
-        server = ctx.message.server
-        mod_role = settings.get_server_mod(server).lower()
-        admin_role = settings.get_server_admin(server).lower()
-        return role_or_permissions(ctx, lambda r: r.name.lower() in (mod_role,admin_role), **perms)
+        return privilege_or_permissions(ctx, privileges.MOD, **perms)
 
     return commands.check(predicate)
 
 def admin_or_permissions(**perms):
     def predicate(ctx):
-        server = ctx.message.server
-        admin_role = settings.get_server_admin(server)
-        return role_or_permissions(ctx, lambda r: r.name.lower() == admin_role.lower(), **perms)
+        return privilege_or_permissions(ctx, privileges.ADMIN, **perms)
 
     return commands.check(predicate)
 
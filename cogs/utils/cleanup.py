@@ -0,0 +1,137 @@
+import datetime
+import logging
+import time
+
+import discord
+
+log = logging.getLogger("red.cleanup")
+
+PAGE_SIZE = 100  # Messages per history request, the API maximum
+BULK_SIZE = 100  # Messages per bulk delete, the API maximum
+# Bulk deletes refuse messages older than 14 days, with some margin
+BULK_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=10)
+PROGRESS_INTERVAL = 5
+
+
+class Cleanup:
+    """Deletes the messages of a channel matching check, newest first
+
+    History is paged with logs_from and filtered as it streams in.
+    Matches are deleted in bulk batches of 100 as they fill, messages
+    too old for bulk deletion one by one. There are no fixed sleeps:
+    discord.py already waits on the rate limit headers of every request,
+    so deletions go as fast as the API lets them.
+
+    Stops after `limit` matches, `scan_limit` messages looked at, when it
+    reaches `after` (excluded) or the start of the channel, or when
+    cancel() is called. progress(cleanup) is awaited about every
+    PROGRESS_INTERVAL seconds while it runs. Messages in `include` are
+    deleted along with the first batch without counting as matches."""
+
+    def __init__(self, bot, channel, check=None, limit=None, before=None,
+                 after=None, scan_limit=None, include=(), progress=None):
+        self.bot = bot
+        self.channel = channel
+        self.check = check
+        self.limit = limit
+        self.before = before
+        self.after = int(after.id) if after is not None else None
+        self.scan_limit = scan_limit
+        self.progress = progress
+        # Bulk deletion is for bot accounts only
+        self.bulk = bot.user.bot
+        self._batch = list(include)
+        self.scanned = 0
+        self.matched = 0
+        self.deleted = 0
+        self.cancelled = False
+        self.started = None
+        self._reported = None
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started if self.started else 0.0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _done(self):
+        return self.cancelled or (self.limit is not None and
+                                  self.matched >= self.limit) or \
+            (self.scan_limit is not None and
+             self.scanned >= self.scan_limit)
+
+    async def run(self):
+        """Runs the cleanup, returns the number of deleted messages"""
+        self.started = self._reported = time.monotonic()
+        before = self.before
+        try:
+            while not self._done():
+                fetched = 0
+                async for message in self.bot.logs_from(
+                        self.channel, limit=PAGE_SIZE, before=before):
+                    fetched += 1
+                    before = message
+                    if self.after is not None and \
+                            int(message.id) <= self.after:
+                        fetched = 0
+                        break
+                    self.scanned += 1
+                    if self.check is None or self.check(message):
+                        self.matched += 1
+                        await self._queue(message)
+                    if self._done():
+                        break
+                if fetched < PAGE_SIZE:
+                    break
+                await self._report()
+        finally:
+            await self._flush()
+        return self.deleted
+
+    async def _queue(self, message):
+        if not self.bulk or self._too_old(message):
+            await self._delete_one(message)
+            await self._report()
+            return
+        self._batch.append(message)
+        if len(self._batch) >= BULK_SIZE:
+            await self._flush()
+            await self._report()
+
+    def _too_old(self, message):
+        return datetime.datetime.utcnow() - message.timestamp > BULK_MAX_AGE
+
+    async def _flush(self):
+        batch, self._batch = self._batch, []
+        if len(batch) == 1:
+            await self._delete_one(batch[0])
+        elif batch:
+            try:
+                await self.bot.delete_messages(batch)
+            except discord.errors.Forbidden:
+                raise
+            except discord.errors.HTTPException:
+                # Deleted meanwhile or aged past the limit, one at a time
+                for message in batch:
+                    await self._delete_one(message)
+            else:
+                self.deleted += len(batch)
+
+    async def _delete_one(self, message):
+        try:
+            await self.bot.delete_message(message)
+        except discord.errors.NotFound:
+            return
+        self.deleted += 1
+
+    async def _report(self):
+        now = time.monotonic()
+        if self.progress is None or now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        try:
+            await self.progress(self)
+        except discord.errors.HTTPException:
+            log.debug("Couldn't report the progress of a cleanup",
+                      exc_info=True)
@@ -0,0 +1,423 @@
+"""Shared state between the shards started by launcher.py
+
+The launcher runs a Coordinator on a local socket and every red.py
+worker connects to it with a CoordinatorClient. The coordinator is the
+only process writing the shared json files: workers send it their saves
+and it tells the other workers which files changed so they can reload
+them. It also relays queries, so a command can collect results from
+every shard (gather).
+
+Saves of json objects are sent as the top level keys that changed since
+the worker last loaded or saved the file, and the coordinator merges
+them into the current file. Most shared data is keyed by server id and
+each server belongs to one shard, so shards don't overwrite each other's
+changes. Other values are replaced whole, the last write wins.
+
+The id lists (idlist.IdStore) send the ids added or removed instead
+(save_ids). The coordinator journals them with an IdStore of its own and
+passes them on to the other shards, whose watch_ids() callbacks apply
+them, so concurrent changes from several shards all stay.
+
+Without a coordinator (a single red.py) watch() does nothing and
+gather() runs the local handler only, so callers don't need to care.
+
+A shard that loses its connection can't save anything anymore: saves and
+gathers raise ConnectionError from then on, and the on_lost callback
+given to connect() is called so the shard can exit and be restarted by
+the launcher.
+
+Messages are json objects, one per line:
+    worker -> coordinator: hello, save, ids, gather, reply
+    coordinator -> worker: invalidate, ids, query, gathered
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+
+from .dataIO import dataIO
+from .idlist import IdStore
+
+log = logging.getLogger("red.coordinator")
+
+ENV_ADDRESS = "RED_COORDINATOR"
+ENV_TOKEN = "RED_COORDINATOR_TOKEN"
+GATHER_TIMEOUT = 10
+
+_client = None
+_watchers = {}
+_id_watchers = {}
+_handlers = {}
+
+
+def _key(path):
+    return os.path.normpath(path)
+
+
+def _dumps(data):
+    return json.dumps(data, sort_keys=True)
+
+
+def watch(path, callback):
+    """Calls callback(path, data) when another shard changes the json
+    file at path. Registering a callback with the same qualified name
+    again (a reloaded cog) replaces the old one"""
+    _watchers.setdefault(_key(path), {})[callback.__qualname__] = callback
+
+
+def unwatch(path, callback):
+    _watchers.get(_key(path), {}).pop(callback.__qualname__, None)
+
+
+def watch_ids(path, callback):
+    """Calls callback(op, key, ids) when another shard adds (op "+") or
+    removes (op "-") ids of the IdStore at path. Replaced like watch()"""
+    _id_watchers.setdefault(_key(path), {})[callback.__qualname__] = callback
+
+
+def register(name, handler):
+    """Makes handler(**args) answer gather(name, **args). It may be a
+    coroutine function and must return something json serializable"""
+    _handlers[name] = handler
+
+
+def unregister(name):
+    _handlers.pop(name, None)
+
+
+def is_sharded():
+    return _client is not None
+
+
+def is_lost():
+    """Whether this shard lost its connection to the coordinator"""
+    return _client is not None and _client.lost
+
+
+async def flush():
+    """Waits until the saves sent so far have left this process"""
+    if _client is not None:
+        await _client.flush()
+
+
+async def _run_handler(name, args):
+    handler = _handlers.get(name)
+    if handler is None:
+        return None
+    result = handler(**args)
+    if asyncio.iscoroutine(result):
+        result = await result
+    return result
+
+
+async def gather(name, timeout=GATHER_TIMEOUT, **args):
+    """Runs the handler registered as name on every shard and returns
+    their results. Shards without the handler or that didn't answer in
+    time are left out"""
+    if _client is None:
+        result = await _run_handler(name, args)
+        return [] if result is None else [result]
+    return await _client.gather(name, args, timeout)
+
+
+async def connect(address, token, shard_id, loop, on_lost=None):
+    """Connects this process to the coordinator at host:port and routes
+    dataIO saves through it. on_lost() is called if the connection drops"""
+    global _client
+    client = CoordinatorClient(shard_id, loop, on_lost)
+    await client.connect(address, token)
+    _client = client
+    dataIO.remote = client
+    return client
+
+
+class CoordinatorClient:
+    def __init__(self, shard_id, loop, on_lost=None):
+        self.shard_id = shard_id
+        self._loop = loop
+        self._on_lost = on_lost
+        self.lost = False
+        self._reader = None
+        self._writer = None
+        self._snapshots = {}
+        self._pending = {}
+        self._ids = itertools.count()
+        self._read_task = None
+
+    async def connect(self, address, token):
+        host, port = address.rsplit(":", 1)
+        self._reader, self._writer = await asyncio.open_connection(
+            host, int(port))
+        self._send({"op": "hello", "shard": self.shard_id, "token": token})
+        self._read_task = self._loop.create_task(self._read_loop())
+
+    def _send(self, message):
+        if self.lost:
+            raise ConnectionError("Lost the connection to the coordinator")
+        line = (json.dumps(message) + "\n").encode("utf-8")
+        # Saves can come from executor threads
+        self._loop.call_soon_threadsafe(self._writer.write, line)
+
+    def _snapshot(self, data):
+        if isinstance(data, dict):
+            return {k: _dumps(v) for k, v in data.items()}
+        return _dumps(data)
+
+    def loaded(self, path, data):
+        """Remembers what a file looked like when it was loaded, saves
+        are diffed against it"""
+        self._snapshots[_key(path)] = self._snapshot(data)
+
+    def save(self, path, data):
+        key = _key(path)
+        previous = self._snapshots.get(key)
+        current = self._snapshot(data)
+        self._snapshots[key] = current
+        if isinstance(current, dict):
+            # Files saved before they were ever loaded are merged whole
+            if not isinstance(previous, dict):
+                previous = {}
+            changed = {k: data[k] for k, v in current.items()
+                       if previous.get(k) != v}
+            deleted = [k for k in previous if k not in current]
+            if not changed and not deleted:
+                return True
+            self._send({"op": "save", "path": path, "set": changed,
+                        "delete": deleted})
+        else:
+            self._send({"op": "save", "path": path, "data": data})
+        return True
+
+    def save_ids(self, path, keys, op, key, ids):
+        self._send({"op": "ids", "path": path, "keys": keys, "change": op,
+                    "key": key, "ids": list(ids)})
+        return True
+
+    async def gather(self, name, args, timeout):
+        request = next(self._ids)
+        future = self._loop.create_future()
+        self._pending[request] = future
+        self._send({"op": "gather", "id": request, "name": name,
+                    "args": args, "timeout": timeout})
+        try:
+            return await asyncio.wait_for(future, timeout + 1)
+        finally:
+            self._pending.pop(request, None)
+
+    async def _read_loop(self):
+        while True:
+            try:
+                line = await self._reader.readline()
+            except OSError:
+                line = None
+            if not line:
+                self._connection_lost()
+                return
+            try:
+                message = json.loads(line.decode("utf-8"))
+                await self._handle(message)
+            except Exception:
+                log.exception("Error while handling a coordinator message")
+
+    def _connection_lost(self):
+        log.error("Lost the connection to the coordinator, nothing can be "
+                  "saved anymore")
+        self.lost = True
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(
+                    "Lost the connection to the coordinator"))
+        if self._on_lost is not None:
+            self._on_lost()
+
+    async def _handle(self, message):
+        op = message["op"]
+        if op == "invalidate":
+            self._invalidate(message["path"])
+        elif op == "ids":
+            self._apply_ids(message)
+        elif op == "query":
+            self._loop.create_task(self._answer(message))
+        elif op == "gathered":
+            future = self._pending.get(message["id"])
+            if future is not None and not future.done():
+                future.set_result(message["results"])
+
+    def _invalidate(self, path):
+        watchers = _watchers.get(_key(path))
+        if not watchers:
+            return
+        data = dataIO._read_json(path)
+        self._snapshots[_key(path)] = self._snapshot(data)
+        for callback in list(watchers.values()):
+            try:
+                callback(path, data)
+            except Exception:
+                log.exception("Error while reloading {}".format(path))
+
+    def _apply_ids(self, message):
+        watchers = _id_watchers.get(_key(message["path"]), {})
+        for callback in list(watchers.values()):
+            try:
+                callback(message["change"], message["key"], message["ids"])
+            except Exception:
+                log.exception("Error while applying changes to {}".format(
+                    message["path"]))
+
+    async def _answer(self, message):
+        try:
+            result = await _run_handler(message["name"], message["args"])
+        except Exception:
+            log.exception("Error in query '{}'".format(message["name"]))
+            result = None
+        self._send({"op": "reply", "id": message["id"], "result": result})
+
+    async def flush(self):
+        if self.lost:
+            return
+        # Lets the writes scheduled by _send run first
+        await asyncio.sleep(0)
+        await self._writer.drain()
+
+    def close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class Coordinator:
+    """The single writer, run by launcher.py"""
+
+    def __init__(self, token, loop):
+        self.token = token
+        self._loop = loop
+        self._workers = {}
+        self._files = {}
+        self._id_stores = {}
+        self._queries = {}
+        self._ids = itertools.count()
+        self._server = None
+        self.saves = 0
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def _serve(self, reader, writer):
+        shard = None
+        try:
+            line = await reader.readline()
+            hello = json.loads(line.decode("utf-8")) if line else {}
+            if hello.get("op") != "hello" or hello.get("token") != self.token:
+                log.warning("Refused a coordinator connection")
+                return
+            shard = hello["shard"]
+            self._workers[shard] = writer
+            log.info("Shard {} connected".format(shard))
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    self._handle(shard, json.loads(line.decode("utf-8")))
+                except Exception:
+                    log.exception("Error while handling a message from "
+                                  "shard {}".format(shard))
+        finally:
+            if shard is not None and self._workers.get(shard) is writer:
+                del self._workers[shard]
+                log.info("Shard {} disconnected".format(shard))
+            writer.close()
+
+    def _send(self, writer, message):
+        writer.write((json.dumps(message) + "\n").encode("utf-8"))
+
+    def _handle(self, shard, message):
+        op = message["op"]
+        if op == "save":
+            self._save(shard, message)
+        elif op == "ids":
+            self._save_ids(shard, message)
+        elif op == "gather":
+            self._loop.create_task(self._gather(shard, message))
+        elif op == "reply":
+            query = self._queries.get(message["id"])
+            if query is not None:
+                query[0][shard] = message["result"]
+                if len(query[0]) >= query[1]:
+                    query[2].set()
+
+    def _save(self, shard, message):
+        path = message["path"]
+        key = _key(path)
+        if "data" in message:
+            data = message["data"]
+        else:
+            data = self._files.get(key)
+            if data is None:
+                try:
+                    data = dataIO.load_json(path)
+                except (FileNotFoundError, ValueError):
+                    data = {}
+            if not isinstance(data, dict):
+                data = {}
+            data.update(message["set"])
+            for k in message["delete"]:
+                data.pop(k, None)
+        self._files[key] = data
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        dataIO.save_json(path, data)
+        self.saves += 1
+        for other, writer in self._workers.items():
+            if other != shard:
+                self._send(writer, {"op": "invalidate", "path": path})
+
+    def _save_ids(self, shard, message):
+        path = message["path"]
+        key = _key(path)
+        store = self._id_stores.get(key)
+        if store is None:
+            store = self._id_stores[key] = IdStore(path, message["keys"])
+        ids = store[message["key"]]
+        if message["change"] == "+":
+            ids.update(message["ids"])
+        else:
+            ids.difference_update(message["ids"])
+        self.saves += 1
+        for other, writer in self._workers.items():
+            if other != shard:
+                self._send(writer, message)
+
+    async def _gather(self, shard, message):
+        request = next(self._ids)
+        replies = {}
+        done = asyncio.Event()
+        workers = dict(self._workers)
+        self._queries[request] = (replies, len(workers), done)
+        for writer in workers.values():
+            self._send(writer, {"op": "query", "id": request,
+                                "name": message["name"],
+                                "args": message["args"]})
+        try:
+            await asyncio.wait_for(done.wait(), message["timeout"])
+        except asyncio.TimeoutError:
+            log.warning("Query '{}' timed out, {}/{} shards answered".format(
+                message["name"], len(replies), len(workers)))
+        finally:
+            del self._queries[request]
+        results = [replies[s] for s in sorted(replies)
+                   if replies[s] is not None]
+        writer = self._workers.get(shard)
+        if writer is not None:
+            self._send(writer, {"op": "gathered", "id": message["id"],
+                                "results": results})
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        for writer in self._workers.values():
+            writer.close()
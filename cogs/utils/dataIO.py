@@ -9,9 +9,16 @@ class InvalidFileIO(Exception):
 class DataIO():
     def __init__(self):
         self.logger = logging.getLogger("red")
+        # Set by coordinator.connect() on sharded bots, saves are then
+        # made by the coordinator
+        self.remote = None
+        self.writes = 0
 
     def save_json(self, filename, data):
         """Atomically saves json file"""
+        self.writes += 1
+        if self.remote is not None:
+            return self.remote.save(filename, data)
         rnd = randint(1000, 9999)
         path, ext = os.path.splitext(filename)
         tmp_file = "{}-{}.tmp".format(path, rnd)
@@ -29,7 +36,10 @@ class DataIO():
 
     def load_json(self, filename):
         """Loads json file"""
-        return self._read_json(filename)
+        data = self._read_json(filename)
+        if self.remote is not None:
+            self.remote.loaded(filename, data)
+        return data
 
     def is_valid_json(self, filename):
         """Verifies if json file exists / is readable"""
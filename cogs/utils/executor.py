@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from collections import deque, Counter
+
+log = logging.getLogger("red.executor")
+
+DEFAULT_CONFIG = {
+    "CONCURRENCY": 50,
+    "MAX_QUEUE": 2000,
+    # Slots out of CONCURRENCY only the priority lane can use
+    "RESERVED": 5,
+    # Cog name: max commands of that cog running at once
+    "COGS": {"Audio": 10, "Economy": 10, "Mod": 15, "Streams": 5}
+}
+
+PRIORITY = 0
+NORMAL = 1
+
+
+class CommandExecutor:
+    """Runs commands with bounded concurrency
+
+    Commands wait in one of two lanes, the priority lane is always served
+    first. At most CONCURRENCY commands run at once and at most COGS[name]
+    of a single cog. RESERVED of the slots are left to the priority lane,
+    so long running commands (prompts, downloads, trivia...) filling the
+    others don't hold up moderation. A command whose cog is at its cap is parked until
+    one of that cog's commands finishes, so a flooded cog can't hold up
+    the others. When more than MAX_QUEUE commands are waiting new ones
+    are refused."""
+
+    def __init__(self, run, loop, config=None):
+        self._run = run
+        self._loop = loop
+        self._lanes = (deque(), deque())
+        self._parked = {}
+        self._cog_running = Counter()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.running = 0
+        self.closed = False
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.configure(config or {})
+
+    def configure(self, config):
+        merged = dict(DEFAULT_CONFIG)
+        merged.update(config)
+        self.concurrency = merged["CONCURRENCY"]
+        self.max_queue = merged["MAX_QUEUE"]
+        self.reserved = merged["RESERVED"]
+        self.cog_limits = dict(merged["COGS"])
+        self._pump()
+
+    @property
+    def depth(self):
+        return (len(self._lanes[PRIORITY]) + len(self._lanes[NORMAL]) +
+                sum(len(p) for p in self._parked.values()))
+
+    def lane_depths(self):
+        return {"priority": len(self._lanes[PRIORITY]),
+                "normal": len(self._lanes[NORMAL]),
+                "parked": sum(len(p) for p in self._parked.values())}
+
+    def submit(self, message, cog=None, priority=False):
+        """Queues a message for command processing. Returns False if
+        the executor is closed or the queue is full"""
+        if self.closed:
+            return False
+        lane = PRIORITY if priority else NORMAL
+        # Priority commands are refused only when the overload is made
+        # of priority commands themselves
+        if self.depth >= self.max_queue and (not priority or
+                len(self._lanes[PRIORITY]) >= self.max_queue):
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        self._lanes[lane].append((lane, cog, message))
+        self._idle.clear()
+        self.max_depth = max(self.max_depth, self.depth)
+        self._pump()
+        return True
+
+    @property
+    def normal_slots(self):
+        """How many commands of the normal lane can run at once"""
+        return max(self.concurrency - self.reserved, 1)
+
+    def _pump(self):
+        while self.running < self.concurrency:
+            item = self._next()
+            if item is None:
+                break
+            self._start(item)
+        if self.running == 0 and self.depth == 0:
+            self._idle.set()
+
+    def _next(self):
+        for priority, lane in enumerate(self._lanes):
+            if priority == NORMAL and self.running >= self.normal_slots:
+                break
+            while lane:
+                item = lane.popleft()
+                cog = item[1]
+                limit = self.cog_limits.get(cog)
+                if limit is not None and self._cog_running[cog] >= limit:
+                    self._parked.setdefault(cog, deque()).append(item)
+                    continue
+                return item
+        return None
+
+    def _start(self, item):
+        lane, cog, message = item
+        self.running += 1
+        self._cog_running[cog] += 1
+        task = self._loop.create_task(self._run(message))
+        task.add_done_callback(lambda t: self._finish(cog, t))
+
+    def _finish(self, cog, task):
+        self.running -= 1
+        self.completed += 1
+        self._cog_running[cog] -= 1
+        if not self._cog_running[cog]:
+            del self._cog_running[cog]
+        parked = self._parked.get(cog)
+        if parked:
+            item = parked.popleft()
+            self._lanes[item[0]].appendleft(item)
+            if not parked:
+                del self._parked[cog]
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Error while processing a command",
+                      exc_info=task.exception())
+        self._pump()
+
+    def close(self):
+        """Stops accepting new commands"""
+        self.closed = True
+
+    async def drain(self, timeout):
+        """Waits up to timeout seconds for queued and running commands
+        to finish. Returns True if everything completed in time"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
@@ -0,0 +1,366 @@
+import re
+import unicodedata
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher
+
+    The patterns are compiled into a trie with failure links, so a text
+    is scanned once, character by character, however many patterns
+    there are. Matching is case sensitive, callers lowercase both sides."""
+
+    def __init__(self, patterns=()):
+        # Node 0 is the root. For every node: transitions, failure link,
+        # pattern ending there and link to the next node along the
+        # failure chain where a pattern ends (0 if none)
+        self._goto = [{}]
+        self._fail = [0]
+        self._pattern = [None]
+        self._output = [0]
+        self.patterns = []
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern):
+        if not pattern:
+            return
+        node = 0
+        for char in pattern:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto[node][char] = child
+                self._goto.append({})
+                self._fail.append(0)
+                self._pattern.append(None)
+                self._output.append(0)
+            node = child
+        if self._pattern[node] is None:
+            self._pattern[node] = pattern
+            self.patterns.append(pattern)
+
+    def _build(self):
+        goto, fail = self._goto, self._fail
+        queue = list(goto[0].values())
+        for node in queue:
+            for char, child in goto[node].items():
+                queue.append(child)
+                link = fail[node]
+                while link and char not in goto[link]:
+                    link = fail[link]
+                target = goto[link].get(char, 0)
+                fail[child] = target if target != child else 0
+                link = fail[child]
+                self._output[child] = (link if self._pattern[link]
+                                       is not None else self._output[link])
+
+    def finditer(self, text):
+        """Yields (start, end, pattern) for every occurrence of every
+        pattern in text, in order of end position"""
+        goto, fail = self._goto, self._fail
+        pattern, output = self._pattern, self._output
+        node = 0
+        for i, char in enumerate(text):
+            while True:
+                child = goto[node].get(char)
+                if child is not None:
+                    node = child
+                    break
+                if not node:
+                    break
+                node = fail[node]
+            hit = node if pattern[node] is not None else output[node]
+            while hit:
+                found = pattern[hit]
+                yield i + 1 - len(found), i + 1, found
+                hit = output[hit]
+
+    def search(self, text):
+        """The first pattern found in text, or None"""
+        for _, _, found in self.finditer(text):
+            return found
+        return None
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+
+class InvalidRule(ValueError):
+    pass
+
+
+SUBSTRING = "substring"
+WORD = "word"
+PREFIX = "prefix"
+SUFFIX = "suffix"
+REGEX = "regex"
+
+MAX_REGEX_LENGTH = 200
+# Longest message Discord allows, what an unbounded repeat can span
+MAX_MESSAGE_LENGTH = 2000
+# Upper bound of any {n,m} repeat
+MAX_REPEAT = 100
+# Product of the spans of the repeats a match may have to try, a single
+# unbounded repeat uses it all. Keeps a search in the tens of ms on the
+# longest messages
+MAX_REGEX_COST = MAX_MESSAGE_LENGTH
+
+# Look-alike characters, applied after case folding and accent stripping
+LEET = str.maketrans({"0": "o", "1": "i", "!": "i", "|": "l", "3": "e",
+                      "4": "a", "@": "a", "5": "s", "$": "s", "7": "t",
+                      "8": "b", "+": "t"})
+# Zero width characters used to split words without it showing
+INVISIBLE = dict.fromkeys(map(ord, "­​‌‍⁠﻿"))
+
+
+def normalize(text):
+    """Case folds text, strips accents and invisible characters and maps
+    look-alike characters to letters"""
+    text = unicodedata.normalize("NFKD", text.casefold().translate(INVISIBLE))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return text.translate(LEET)
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == "_"
+
+
+def _subpatterns(value):
+    if isinstance(value, sre_parse.SubPattern):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _subpatterns(item)
+
+
+def _vet(pattern, inside_repeat=False):
+    """Returns how much backtracking the parsed regex can do on a
+    position, raises InvalidRule if it could backtrack catastrophically:
+    repeats of repeats or of alternatives, backreferences, huge repeats
+
+    Repeats in a sequence multiply the cost by the number of lengths they
+    can take (MAX_MESSAGE_LENGTH when unbounded), alternatives add up."""
+    cost = 1
+    for op, value in pattern:
+        name = str(op).lower()
+        if name in ("groupref", "groupref_exists"):
+            raise InvalidRule("Backreferences aren't allowed.")
+        if name.endswith("_repeat"):
+            low, high, sub = value
+            if high > 1 and inside_repeat:
+                raise InvalidRule("Repeats inside repeats aren't allowed.")
+            if high == sre_parse.MAXREPEAT:
+                span = MAX_MESSAGE_LENGTH
+            elif high > MAX_REPEAT:
+                raise InvalidRule("Repeats can go up to {} times."
+                                  "".format(MAX_REPEAT))
+            else:
+                span = high - low + 1
+            cost *= span * _vet(sub, inside_repeat or high > 1)
+        elif name == "branch":
+            if inside_repeat:
+                raise InvalidRule("Repeated alternatives aren't allowed.")
+            cost *= sum(_vet(sub, inside_repeat) for sub in value[1])
+        else:
+            for sub in _subpatterns(value):
+                cost *= _vet(sub, inside_repeat)
+        if cost > MAX_REGEX_COST:
+            raise InvalidRule("That regex could take too long to match, use "
+                              "fewer or shorter repeats (*, +, {n,m}).")
+    return cost
+
+
+def compile_regex(source):
+    if len(source) > MAX_REGEX_LENGTH:
+        raise InvalidRule("Regexes can be at most {} characters long."
+                          "".format(MAX_REGEX_LENGTH))
+    try:
+        parsed = sre_parse.parse(source)
+        regex = re.compile(source, re.IGNORECASE)
+        # It has to work as part of the server's alternation too
+        re.compile("(?:{})".format(source))
+    except (re.error, RecursionError, OverflowError) as e:
+        raise InvalidRule("Invalid regex: {}".format(e))
+    if regex.groupindex:
+        # They'd clash with the other rules' in the server's alternation
+        raise InvalidRule("Named groups aren't allowed, use (...) or "
+                          "(?:...).")
+    _vet(parsed)
+    if regex.search(""):
+        raise InvalidRule("That regex matches every message.")
+    return regex
+
+
+class Rule:
+    """A parsed filter rule
+
+        word        the text anywhere, even inside words (the default)
+        w:word      the whole word only
+        word*       words starting with it
+        *word       words ending with it
+        n:...       same as above, matched after normalize(): accents,
+                    invisible characters and look-alikes (1 for i, @ for
+                    a...) don't get around it
+        re:regex    a regex, vetted against catastrophic backtracking
+
+    source is the rule as stored, in canonical form. A literal rule is
+    the text anywhere, whatever it looks like, the way every rule was
+    matched before the syntax above."""
+
+    __slots__ = ("source", "kind", "pattern", "normalized")
+
+    def __init__(self, text, literal=False):
+        self.normalized = False
+        if literal:
+            self.kind = SUBSTRING
+            self.pattern = text.lower()
+            self.source = text
+            if not self.pattern:
+                raise InvalidRule("There's nothing to filter in that rule.")
+            return
+        text = text.strip()
+        if text[:3].lower() == "re:":
+            self.kind = REGEX
+            self.pattern = text[3:]
+            compile_regex(self.pattern)
+            self.source = "re:" + self.pattern
+            return
+        prefix = suffix = ""
+        if text[:2].lower() == "n:":
+            self.normalized = True
+            prefix, text = "n:", text[2:]
+        if text[:2].lower() == "w:":
+            self.kind = WORD
+            prefix, text = prefix + "w:", text[2:]
+        else:
+            starts, ends = text.startswith("*"), text.endswith("*")
+            text = text.strip("*")
+            if starts and not ends:
+                self.kind = SUFFIX
+            elif ends and not starts:
+                self.kind = PREFIX
+            else:
+                self.kind = SUBSTRING
+            prefix += "*" if starts else ""
+            suffix = "*" if ends else ""
+        if self.normalized:
+            self.pattern = normalize(text)
+        else:
+            self.pattern = text.casefold()
+        if not self.pattern:
+            raise InvalidRule("There's nothing to filter in that rule.")
+        self.source = prefix + text.casefold() + suffix
+
+    def __repr__(self):
+        return "<Rule {!r}>".format(self.source)
+
+
+def canonical_rule(text):
+    """The stored form of a rule, raises InvalidRule"""
+    return Rule(text).source
+
+
+class FilterMatcher:
+    """Every rule of a server compiled into one matcher
+
+    Literal rules go into two Aho-Corasick automata, one scanning the
+    case folded message and one scanning its normalized form (only built
+    when n: rules exist). Word boundaries are checked on the hits. The
+    regexes are joined into a single alternation. A message is scanned
+    once by each of them at most.
+
+    Invalid rules (stored by an older version or edited by hand) are
+    listed in invalid and matched as literal rules, like they used to."""
+
+    def __init__(self, rules):
+        self.rules = []
+        self.invalid = []
+        literal, normalized = {}, {}
+        regexes = []
+        for text in rules:
+            try:
+                rule = Rule(text)
+            except InvalidRule:
+                self.invalid.append(text)
+                try:
+                    rule = Rule(text, literal=True)
+                except InvalidRule:
+                    continue
+            self.rules.append(rule)
+            if rule.kind == REGEX:
+                regexes.append(rule)
+            else:
+                table = normalized if rule.normalized else literal
+                table.setdefault(rule.pattern, []).append(rule)
+        self._literal = literal
+        self._normalized = normalized
+        self._literal_matcher = AhoCorasick(literal) if literal else None
+        self._normalized_matcher = (AhoCorasick(normalized) if normalized
+                                    else None)
+        self._regex_rules = regexes
+        self._regex = None
+        self._regexes = []
+        if regexes:
+            try:
+                self._regex = re.compile("|".join(
+                    "(?P<r{}>{})".format(i, r.pattern)
+                    for i, r in enumerate(regexes)), re.IGNORECASE)
+            except re.error:
+                # Rules that each compile can still clash together, they
+                # are then searched one by one
+                self._regexes = [(re.compile(r.pattern, re.IGNORECASE), r)
+                                 for r in regexes]
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _scan(self, matcher, rules, text):
+        for start, end, pattern in matcher.finditer(text):
+            for rule in rules[pattern]:
+                if rule.kind == SUBSTRING:
+                    return rule
+                bounded_start = start == 0 or not _is_word_char(
+                    text[start - 1])
+                bounded_end = end == len(text) or not _is_word_char(
+                    text[end])
+                if rule.kind == WORD:
+                    if bounded_start and bounded_end:
+                        return rule
+                elif rule.kind == PREFIX:
+                    if bounded_start:
+                        return rule
+                elif bounded_end:
+                    return rule
+        return None
+
+    def search(self, content):
+        """The first rule content breaks, or None"""
+        folded = content.casefold()
+        if self._literal_matcher is not None:
+            rule = self._scan(self._literal_matcher, self._literal, folded)
+            if rule is not None:
+                return rule
+        if self._normalized_matcher is not None:
+            rule = self._scan(self._normalized_matcher, self._normalized,
+                              normalize(content))
+            if rule is not None:
+                return rule
+        if self._regex is not None:
+            match = self._regex.search(folded)
+            if match is not None:
+                for i, rule in enumerate(self._regex_rules):
+                    if match.group("r{}".format(i)) is not None:
+                        return rule
+        for regex, rule in self._regexes:
+            if regex.search(folded):
+                return rule
+        return None
@@ -0,0 +1,56 @@
+from collections import OrderedDict
+
+from discord.ext import commands
+
+
+class CachedHelpFormatter(commands.HelpFormatter):
+    """HelpFormatter that keeps the pages it renders
+
+    What a help page shows depends on the checks the reader passes, so
+    pages are stored per target and per reader class: privilege level,
+    server ownership, resolved channel permissions and whether it's a
+    DM, along with the prefix and name the help was invoked with. Those
+    are all the checks in this repo look at, so a cached page is the one
+    format_help_for would produce.
+
+    clear() has to be called when commands change: cogs loaded or
+    unloaded, commands disabled or enabled."""
+
+    def __init__(self, *args, maxsize=1000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pages = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, context, target):
+        message = context.message
+        author = message.author
+        channel = message.channel
+        is_private = channel.is_private
+        # The owner may not be cached on large servers, then it's not them
+        is_server_owner = not is_private and author == message.server.owner
+        level = context.bot.privileges.level(author, message.server)
+        perms = context.bot.privileges.permissions(channel, author)
+        return (target, context.prefix, context.invoked_with, level,
+                is_server_owner, perms.value, is_private)
+
+    def format_help_for(self, context, command_or_bot):
+        key = self._key(context, command_or_bot)
+        pages = self._pages.get(key)
+        if pages is not None:
+            self.hits += 1
+            self._pages.move_to_end(key)
+            return list(pages)
+        self.misses += 1
+        pages = super().format_help_for(context, command_or_bot)
+        self._pages[key] = tuple(pages)
+        if len(self._pages) > self.maxsize:
+            self._pages.popitem(last=False)
+        return pages
+
+    def clear(self):
+        self._pages.clear()
+
+    def __len__(self):
+        return len(self._pages)
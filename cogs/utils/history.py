@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger("red.history")
+
+COMPACT_MIN_ENTRIES = 10000
+
+
+class HistoryLog:
+    """Append-only history of values by key, the last `cap` of each kept
+
+    Entries are json lines [time, key, value] appended to a file. Memory
+    only holds the offsets of the last `cap` entries of each key and a
+    hash of their value, values are read back from the file when asked
+    for. contains() answers from the hashes without touching the file.
+    Appends are buffered and written together by flush(), to be called
+    periodically and on unload; flush_in_executor() does the writing in
+    another thread. Once the file holds more than twice the live entries
+    it's rewritten without the dropped ones.
+
+    The index and the file are guarded by a lock, so the writing thread
+    and the event loop can both use the log."""
+
+    def __init__(self, path, cap=20, flush_size=200):
+        self.path = path
+        self.cap = cap
+        self.flush_size = flush_size
+        self._lock = threading.Lock()
+        self._index = {}  # key: deque of (offset, length, value hash)
+        self._pending = {}  # key: [(time, value)]
+        self._pending_count = 0
+        self._entries = 0
+        self._size = 0
+        self._compacting = False
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            open(self.path, "ab").close()
+            return
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                length = len(line)
+                try:
+                    _, key, value = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    # A line cut short by a crash
+                    log.warning("Skipped a corrupted entry in {}".format(
+                        self.path))
+                else:
+                    self._track(key, offset, length, hash(value))
+                offset += length
+        self._size = offset
+        self.compact()
+
+    def _track(self, key, offset, length, digest):
+        entries = self._index.get(key)
+        if entries is None:
+            entries = self._index[key] = deque(maxlen=self.cap)
+        entries.append((offset, length, digest))
+        self._entries += 1
+
+    @property
+    def live(self):
+        return sum(len(e) for e in self._index.values())
+
+    def get(self, key):
+        """The last (time, value) entries of key, oldest first"""
+        entries = []
+        with self._lock:
+            offsets = self._index.get(key)
+            if offsets:
+                with open(self.path, "rb") as f:
+                    for offset, length, _ in offsets:
+                        f.seek(offset)
+                        when, _, value = json.loads(
+                            f.read(length).decode("utf-8"))
+                        entries.append((when, value))
+        entries.extend(self._pending.get(key, ()))
+        return entries[-self.cap:]
+
+    def values(self, key):
+        return [value for _, value in self.get(key)]
+
+    def contains(self, key, value):
+        """Whether value is among the last entries of key"""
+        if any(v == value for _, v in self._pending.get(key, ())):
+            return True
+        digest = hash(value)
+        with self._lock:
+            return any(e[2] == digest for e in self._index.get(key, ()))
+
+    def append(self, key, value, when=None):
+        if when is None:
+            when = time.time()
+        self._pending.setdefault(key, []).append((when, value))
+        self._pending_count += 1
+        if self._pending_count >= self.flush_size:
+            self._write(self._take_pending())
+
+    def _take_pending(self):
+        pending, self._pending = self._pending, {}
+        self._pending_count = 0
+        lines = []
+        for key, entries in pending.items():
+            for when, value in entries[-self.cap:]:
+                line = (json.dumps([when, key, value]) + "\n").encode("utf-8")
+                lines.append((key, hash(value), line))
+        return lines
+
+    def _write(self, lines):
+        if not lines:
+            return
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(b"".join(line for _, _, line in lines))
+            for key, digest, line in lines:
+                self._track(key, self._size, len(line), digest)
+                self._size += len(line)
+
+    def flush(self):
+        """Writes the buffered entries"""
+        self._write(self._take_pending())
+        self.compact()
+
+    async def flush_in_executor(self, loop):
+        """flush() with the file work done in another thread"""
+        lines = self._take_pending()
+        await loop.run_in_executor(None, self._flush_lines, lines)
+
+    def _flush_lines(self, lines):
+        self._write(lines)
+        self.compact()
+
+    def compact(self, force=False):
+        """Rewrites the file with the live entries only, if enough of it is
+        dead weight (or force)
+
+        The live entries are copied without holding the lock, the ones
+        appended meanwhile are copied at the end under it, right before
+        the file is replaced."""
+        with self._lock:
+            live = self.live
+            if self._compacting or (not force and (
+                    self._entries < COMPACT_MIN_ENTRIES or
+                    self._entries <= 2 * live)):
+                return
+            self._compacting = True
+            # Keeps the file order, so entries stay oldest first
+            entries = sorted((o, l) for e in self._index.values()
+                             for o, l, _ in e)
+            copied_size = self._size
+        try:
+            tmp = "{}.tmp".format(self.path)
+            moved = {}  # old offset: new offset
+            size = 0
+            with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+                for offset, length in entries:
+                    src.seek(offset)
+                    dst.write(src.read(length))
+                    moved[offset] = size
+                    size += length
+            with self._lock:
+                with open(self.path, "rb") as src, open(tmp, "ab") as dst:
+                    src.seek(copied_size)
+                    dst.write(src.read(self._size - copied_size))
+                index = {}
+                for key, old in self._index.items():
+                    new = index[key] = deque(maxlen=self.cap)
+                    for offset, length, digest in old:
+                        if offset >= copied_size:
+                            offset = size + offset - copied_size
+                        else:
+                            offset = moved[offset]
+                        new.append((offset, length, digest))
+                os.replace(tmp, self.path)
+                log.debug("Compacted {}: {} entries to {}".format(
+                    self.path, self._entries, self.live))
+                self._index = index
+                self._entries = self.live
+                self._size = size + self._size - copied_size
+        finally:
+            self._compacting = False
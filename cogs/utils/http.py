@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+log = logging.getLogger("red.http")
+
+DEFAULT_CONFIG = {
+    "TIMEOUT": 10,  # Seconds for a whole request, body included
+    "RETRIES": 2,
+    "BACKOFF": 0.5,  # Seconds before the first retry, doubled every retry
+    "LIMIT": 100,  # Open connections in total
+    "PER_HOST": 10,  # Requests running at once to a single host
+    "KEEPALIVE": 30  # Seconds an idle connection is kept open
+}
+
+# Worth another try, along with connection errors and timeouts
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+MAX_RETRY_AFTER = 10
+
+
+class HTTPError(Exception):
+    """A request failed after its retries. The last error is __cause__"""
+
+    def __init__(self, method, url, attempts):
+        super().__init__("{} {} failed after {} attempts".format(
+            method, url, attempts))
+        self.method = method
+        self.url = url
+        self.attempts = attempts
+
+
+class Response:
+    """A response with its body already read, the connection is back in
+    the pool by the time the caller gets it"""
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def text(self, encoding="utf-8"):
+        return self.body.decode(encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.text())
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.running = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def mean_latency(self):
+        done = self.requests - self.errors
+        return self.total_latency / done if done > 0 else 0.0
+
+
+class HTTPService:
+    """The HTTP client cogs share, as bot.http_service
+
+    Every request goes through one pooled session, so connections (and
+    their TLS handshakes) and DNS lookups are reused across cogs instead
+    of paid for on every call. Requests get a timeout covering the whole
+    exchange, idempotent ones are retried with exponential backoff on
+    connection errors, timeouts and RETRY_STATUSES, and at most PER_HOST
+    of them run at once against a single host so one slow API can't take
+    the whole pool. Counters and latencies are kept per host in stats."""
+
+    def __init__(self, loop, config=None):
+        self._loop = loop
+        self._session = None
+        self._limits = {}
+        self.stats = {}
+        self.closed = False
+        self.configure(config or {})
+
+    def configure(self, config):
+        merged = dict(DEFAULT_CONFIG)
+        merged.update(config)
+        connector_changed = self._session is not None and (
+            merged["LIMIT"] != self.limit or
+            merged["KEEPALIVE"] != self.keepalive)
+        self.timeout = merged["TIMEOUT"]
+        self.retries = merged["RETRIES"]
+        self.backoff = merged["BACKOFF"]
+        self.limit = merged["LIMIT"]
+        self.per_host = merged["PER_HOST"]
+        self.keepalive = merged["KEEPALIVE"]
+        # Requests already waiting keep the old limit
+        self._limits.clear()
+        if connector_changed:
+            # Requests still using the old pool get to finish
+            old, self._session = self._session, None
+            self._loop.call_later(self.timeout, self._close_session, old)
+
+    @property
+    def session(self):
+        if self._session is None:
+            if self.closed:
+                raise RuntimeError("The HTTP service is closed")
+            connector = aiohttp.TCPConnector(
+                use_dns_cache=True, limit=self.limit,
+                keepalive_timeout=self.keepalive, loop=self._loop)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  loop=self._loop)
+        return self._session
+
+    def _limit(self, host):
+        limit = self._limits.get(host)
+        if limit is None:
+            limit = self._limits[host] = asyncio.Semaphore(self.per_host)
+        return limit
+
+    async def _send(self, method, url, kwargs):
+        async with self.session.request(method, url, **kwargs) as r:
+            body = await r.read()
+            return Response(r.status, r.headers, body)
+
+    def _delay(self, attempt, response):
+        if response is not None and response.status == 429:
+            try:
+                retry_after = float(response.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                pass
+            else:
+                return min(retry_after, MAX_RETRY_AFTER)
+        # Jittered, so requests that failed together don't retry together
+        return self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+    async def request(self, method, url, timeout=None, retries=None,
+                      **kwargs):
+        """Sends a request and returns its Response. Raises HTTPError if
+        every attempt failed to get one, error statuses are returned"""
+        method = method.upper()
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries
+        attempts = 1 + (retries if method in IDEMPOTENT else 0)
+        host = urlparse(url).hostname
+        stats = self.stats.get(host)
+        if stats is None:
+            stats = self.stats[host] = HostStats()
+        response = error = None
+        for attempt in range(attempts):
+            if attempt:
+                stats.retries += 1
+                await asyncio.sleep(self._delay(attempt, response))
+            stats.requests += 1
+            async with self._limit(host):
+                stats.running += 1
+                start = time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(
+                        self._send(method, url, kwargs), timeout)
+                except (aiohttp.ClientError, asyncio.TimeoutError,
+                        OSError) as e:
+                    stats.errors += 1
+                    error, response = e, None
+                    log.debug("{} {} failed: {!r}".format(method, url, e))
+                    continue
+                finally:
+                    stats.running -= 1
+            latency = time.perf_counter() - start
+            stats.total_latency += latency
+            stats.max_latency = max(stats.max_latency, latency)
+            if response.status not in RETRY_STATUSES:
+                return response
+        if response is not None:
+            return response
+        raise HTTPError(method, url, attempts) from error
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def get_json(self, url, **kwargs):
+        """GETs url and decodes its body as json"""
+        response = await self.request("GET", url, **kwargs)
+        return response.json()
+
+    async def get_bytes(self, url, **kwargs):
+        response = await self.request("GET", url, **kwargs)
+        return response.body
+
+    def _close_session(self, session):
+        result = session.close()
+        # A coroutine in later aiohttp versions
+        if asyncio.iscoroutine(result):
+            return self._loop.create_task(result)
+
+    async def close(self):
+        self.closed = True
+        if self._session is not None:
+            closing = self._close_session(self._session)
+            self._session = None
+            if closing is not None:
+                await closing
@@ -0,0 +1,214 @@
+import json
+import logging
+import os
+
+from .dataIO import dataIO
+
+log = logging.getLogger("red.idlist")
+
+# The journal is folded into the json file once it has more entries than
+# this or than the file has ids
+COMPACT_MIN = 1000
+
+
+class IdSet:
+    """A set of ids whose changes are reported to its store"""
+
+    __slots__ = ("_ids", "_store", "_key")
+
+    def __init__(self, store, key, ids=()):
+        self._ids = set(ids)
+        self._store = store
+        self._key = key
+
+    def __contains__(self, item):
+        return item in self._ids
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __bool__(self):
+        return bool(self._ids)
+
+    def __repr__(self):
+        return "<IdSet {} ids>".format(len(self._ids))
+
+    def add(self, item):
+        """Adds item, False if it was already in"""
+        if item in self._ids:
+            return False
+        self._ids.add(item)
+        self._store._record("+", self._key, (item,))
+        return True
+
+    def remove(self, item):
+        """Removes item, False if it wasn't in"""
+        if item not in self._ids:
+            return False
+        self._ids.remove(item)
+        self._store._record("-", self._key, (item,))
+        return True
+
+    def update(self, items):
+        """Adds items, returns how many weren't in yet"""
+        added = [i for i in set(items) if i not in self._ids]
+        self._ids.update(added)
+        self._store._record("+", self._key, added)
+        return len(added)
+
+    def difference_update(self, items):
+        """Removes items, returns how many were in"""
+        removed = [i for i in set(items) if i in self._ids]
+        self._ids.difference_update(removed)
+        self._store._record("-", self._key, removed)
+        return len(removed)
+
+    def _replace(self, items):
+        self._ids.clear()
+        self._ids.update(items)
+
+
+class IdStore:
+    """Sets of ids kept in a json file with a journal of changes
+
+    The file holds a list of ids, or an object of lists when keys are
+    given (ignorelist.json), the format it always had. Changes are
+    appended to a .journal file next to it instead of rewriting the whole
+    file, and folded into it once the journal grows past the file's size,
+    so adding or removing an id costs O(1) amortized. The journal is
+    replayed on load.
+
+    On sharded bots the coordinator owns the file and the journal: changes
+    are sent to it as they are (coordinator.save_ids), it journals them
+    with its own IdStore and passes them on to the other shards, which
+    apply() them. Shards then only read the files, on load."""
+
+    def __init__(self, path, keys=None):
+        self.path = path
+        self.journal_path = os.path.splitext(path)[0] + ".journal"
+        self.keys = keys
+        self._sets = {}
+        self._journaled = 0
+        self._journal_size = 0
+        self._truncations = 0
+        self.reload(dataIO.load_json(path))
+        self._replay()
+
+    @property
+    def ids(self):
+        """The set of a list file"""
+        return self._sets[None]
+
+    def __getitem__(self, key):
+        return self._sets[key]
+
+    def __len__(self):
+        return sum(len(s) for s in self._sets.values())
+
+    def reload(self, data):
+        """Replaces the ids with the ones of the file's data, the sets
+        stay the same objects"""
+        if self.keys is None:
+            data = {None: data}
+        for key in self.keys or (None,):
+            ids = data.get(key, ())
+            if key in self._sets:
+                self._sets[key]._replace(ids)
+            else:
+                self._sets[key] = IdSet(self, key, ids)
+
+    def snapshot(self):
+        """The file's data, to be saved"""
+        if self.keys is None:
+            return sorted(self.ids)
+        return {k: sorted(s) for k, s in self._sets.items()}
+
+    def _replay(self):
+        if not os.path.isfile(self.journal_path):
+            return
+        replayed = 0
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op, key, item = json.loads(line)
+                    ids = self._sets[key]._ids
+                except (ValueError, KeyError):
+                    # A line cut short by a crash
+                    log.warning("Skipped a corrupted entry in {}".format(
+                        self.journal_path))
+                    continue
+                if op == "+":
+                    ids.add(item)
+                else:
+                    ids.discard(item)
+                replayed += 1
+        self._journal_size = os.path.getsize(self.journal_path)
+        if dataIO.remote is not None:
+            return
+        if replayed:
+            self.compact()
+        else:
+            self._truncate(self._journal_size)
+
+    def _record(self, op, key, ids):
+        if not ids:
+            return
+        if dataIO.remote is not None:
+            dataIO.remote.save_ids(self.path, self.keys, op, key, ids)
+            return
+        lines = "".join(json.dumps([op, key, i]) + "\n" for i in ids)
+        with open(self.journal_path, "ab") as f:
+            self._journal_size += f.write(lines.encode("utf-8"))
+        self._journaled += len(ids)
+        if self._journaled > max(COMPACT_MIN, len(self)):
+            self.compact()
+
+    def apply(self, op, key, ids):
+        """Applies a change made by another shard"""
+        if op == "+":
+            self._sets[key]._ids.update(ids)
+        else:
+            self._sets[key]._ids.difference_update(ids)
+
+    def compact(self):
+        """Saves the file and empties the journal"""
+        if dataIO.remote is not None:
+            return
+        if dataIO.save_json(self.path, self.snapshot()):
+            self._truncate(self._journal_size)
+
+    async def compact_in_executor(self, loop):
+        """compact() with the file written by another thread. Changes
+        made meanwhile stay in the journal"""
+        if dataIO.remote is not None:
+            return
+        snapshot = self.snapshot()
+        offset = self._journal_size
+        truncations = self._truncations
+        saved = await loop.run_in_executor(None, dataIO.save_json,
+                                           self.path, snapshot)
+        # Unless the journal was compacted meanwhile, offset is stale then
+        if saved and truncations == self._truncations:
+            self._truncate(offset)
+
+    def _truncate(self, offset):
+        """Drops the journal entries before offset, now in the file"""
+        if not os.path.isfile(self.journal_path):
+            return
+        self._truncations += 1
+        if offset >= self._journal_size:
+            os.remove(self.journal_path)
+            self._journaled = self._journal_size = 0
+            return
+        with open(self.journal_path, "rb") as f:
+            f.seek(offset)
+            tail = f.read()
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(tail)
+        os.replace(tmp, self.journal_path)
+        self._journaled = tail.count(b"\n")
+        self._journal_size = len(tail)
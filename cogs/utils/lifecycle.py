@@ -0,0 +1,126 @@
+import asyncio
+import logging
+
+from discord.ext import commands
+
+from . import logs
+from .scheduler import Scheduler
+
+log = logging.getLogger("red.lifecycle")
+
+DRAIN_TIMEOUT = 10
+HOOK_TIMEOUT = 5
+
+
+async def _run_hook(cog, name, hook):
+    try:
+        await asyncio.wait_for(hook(), HOOK_TIMEOUT)
+    except asyncio.TimeoutError:
+        log.warning("{}.{} timed out".format(cog, name))
+    except Exception:
+        log.exception("Error in {}.{}".format(cog, name))
+
+
+class Bot(commands.Bot):
+    """commands.Bot with a lifecycle for cogs and their tasks
+
+    Cogs start their background tasks with create_task(coro, cog), or
+    register periodic jobs with scheduler.every(..., cog=cog), and may
+    define two coroutine hooks:
+        on_unload(): run when the cog is removed (unload or reload)
+        on_shutdown(): awaited while the bot shuts down
+    A cog's tasks and jobs are cancelled when it's removed, no need for
+    loops polling get_cog to find out they should stop.
+
+    shutdown() stops taking commands, waits a bounded time for the
+    running ones, runs the on_shutdown hooks, cancels every task, runs
+    the flush hooks (pending writes) and logs out."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Cog name (None for the bot's own): set of tasks
+        self._tasks = {}
+        self._flush_hooks = []
+        self.scheduler = Scheduler(self.loop)
+        self.shutting_down = False
+
+    def create_task(self, coro, cog=None):
+        """Runs coro in the background on behalf of cog (an instance or a
+        name). The task is cancelled when the cog is removed and when the
+        bot shuts down"""
+        if cog is not None and not isinstance(cog, str):
+            cog = type(cog).__name__
+        task = self.loop.create_task(coro)
+        tasks = self._tasks.setdefault(cog, set())
+        tasks.add(task)
+        task.add_done_callback(lambda t: self._task_done(cog, t))
+        return task
+
+    def _task_done(self, cog, task):
+        tasks = self._tasks.get(cog)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._tasks[cog]
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Error in a background task of {}".format(
+                cog or "the bot"), exc_info=task.exception())
+
+    def tasks(self, cog=None):
+        """Running tasks of cog, or of everything if cog is None"""
+        if cog is None:
+            return [t for tasks in self._tasks.values() for t in tasks]
+        if not isinstance(cog, str):
+            cog = type(cog).__name__
+        return list(self._tasks.get(cog, ()))
+
+    def cancel_tasks(self, cog):
+        """Cancels the tasks of cog, or every task if cog is None"""
+        tasks = self.tasks(cog)
+        for task in tasks:
+            task.cancel()
+        return tasks
+
+    def add_flush_hook(self, hook):
+        """hook() is awaited at shutdown, after every task has stopped, to
+        write what's still pending"""
+        self._flush_hooks.append(hook)
+
+    def remove_cog(self, name):
+        cog = self.cogs.get(name)
+        if cog is not None:
+            self.cancel_tasks(name)
+            self.scheduler.cancel_jobs(name)
+            hook = getattr(cog, "on_unload", None)
+            if hook is not None:
+                self.loop.create_task(_run_hook(name, "on_unload", hook))
+        super().remove_cog(name)
+
+    async def shutdown(self, timeout=DRAIN_TIMEOUT):
+        """Stops the bot cleanly. Only the first call does anything"""
+        if self.shutting_down:
+            return
+        self.shutting_down = True
+        log.info("Shutting down")
+
+        executor = getattr(self, "executor", None)
+        if executor is not None:
+            executor.close()
+            if not await executor.drain(timeout):
+                log.warning("{} commands were still running at shutdown"
+                            "".format(executor.running + executor.depth))
+
+        for name, cog in list(self.cogs.items()):
+            hook = getattr(cog, "on_shutdown", None)
+            if hook is not None:
+                await _run_hook(name, "on_shutdown", hook)
+
+        tasks = self.cancel_tasks(None) + self.scheduler.close()
+        if tasks:
+            await asyncio.wait(tasks, timeout=HOOK_TIMEOUT)
+
+        for hook in self._flush_hooks:
+            await _run_hook("Bot", "flush hook", hook)
+
+        await self.logout()
+        logs.stop_listeners()
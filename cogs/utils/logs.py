@@ -0,0 +1,113 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+DEFAULT_QUEUE_SIZE = 10000
+
+_structured = False
+_listeners = []
+_queue_handlers = []
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler over a bounded queue
+
+    When the writer thread can't keep up, records are dropped and counted
+    instead of blocking the event loop."""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # The queue might be full at shutdown, wait for room instead of
+        # losing the sentinel
+        self.queue.put(self._sentinel)
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one json object per line"""
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno,
+            "message": record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+def set_structured(value):
+    """Makes file handlers created from now on write json lines"""
+    global _structured
+    _structured = value
+
+
+def file_handler(filename, formatter, max_bytes=0, backup_count=0):
+    """Returns a (rotating if max_bytes is set) file handler
+
+    In structured mode the records are written as json lines to a
+    .jsonl file next to the plain one."""
+    if _structured:
+        filename = os.path.splitext(filename)[0] + ".jsonl"
+        formatter = JSONFormatter(datefmt="%Y-%m-%dT%H:%M:%S")
+    if max_bytes:
+        handler = logging.handlers.RotatingFileHandler(
+            filename=filename, encoding='utf-8', mode='a',
+            maxBytes=max_bytes, backupCount=backup_count)
+    else:
+        handler = logging.FileHandler(
+            filename=filename, encoding='utf-8', mode='a')
+    handler.setFormatter(formatter)
+    return handler
+
+
+def add_queued_handlers(logger, *handlers, maxsize=DEFAULT_QUEUE_SIZE):
+    """Attaches handlers to logger through a bounded queue
+
+    Formatting, writing and rotating happen on a background thread, the
+    logging call itself only enqueues the record."""
+    q = queue.Queue(maxsize)
+    queue_handler = DroppingQueueHandler(q)
+    listener = _Listener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    logger.addHandler(queue_handler)
+    _listeners.append(listener)
+    _queue_handlers.append(queue_handler)
+    return listener
+
+
+def dropped_records():
+    return sum(h.dropped for h in _queue_handlers)
+
+
+def pending_records():
+    return sum(h.queue.qsize() for h in _queue_handlers)
+
+
+@atexit.register
+def stop_listeners():
+    """Flushes every queue and stops the writer threads"""
+    while _listeners:
+        listener = _listeners.pop()
+        if listener._thread is not None:
+            listener.stop()
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+
+import discord
+
+log = logging.getLogger("red.massaction")
+
+CONCURRENCY = 5
+LOG_BATCH = 25
+PROGRESS_INTERVAL = 5
+
+
+class MassAction:
+    """Runs action(target) for many targets, a few at a time
+
+    Requests are pipelined CONCURRENCY at a time; discord.py queues them
+    on their rate limit bucket and waits on its headers, so the queue
+    goes as fast as the API allows without tripping it. Failures don't
+    stop the others and are kept with their reason.
+
+    on_batch(targets) is called with every LOG_BATCH succeeded targets
+    (and the rest at the end) so they can be logged together,
+    progress(action) is awaited about every PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, action, targets, concurrency=CONCURRENCY,
+                 progress=None, on_batch=None, batch_size=LOG_BATCH):
+        self.action = action
+        self.targets = list(targets)
+        self.concurrency = concurrency
+        self.progress = progress
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self.succeeded = []
+        self.failed = []  # (target, reason)
+        self.cancelled = False
+        self.started = None
+        self._batch = []
+        self._reported = None
+
+    @property
+    def done(self):
+        return len(self.succeeded) + len(self.failed)
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started if self.started else 0.0
+
+    def cancel(self):
+        self.cancelled = True
+
+    async def run(self):
+        self.started = self._reported = time.monotonic()
+        targets = iter(self.targets)
+        workers = min(self.concurrency, len(self.targets))
+        try:
+            await asyncio.gather(*(self._worker(targets)
+                                   for _ in range(workers)))
+        finally:
+            self._log_batch()
+        return self.succeeded, self.failed
+
+    async def _worker(self, targets):
+        for target in targets:
+            if self.cancelled:
+                return
+            try:
+                await self.action(target)
+            except discord.errors.Forbidden:
+                self.failed.append((target, "not allowed"))
+            except discord.errors.NotFound:
+                self.failed.append((target, "not found"))
+            except discord.errors.HTTPException as e:
+                self.failed.append((target, str(e)))
+            else:
+                self.succeeded.append(target)
+                self._batch.append(target)
+                if len(self._batch) >= self.batch_size:
+                    self._log_batch()
+            await self._report()
+
+    def _log_batch(self):
+        batch, self._batch = self._batch, []
+        if batch and self.on_batch is not None:
+            try:
+                self.on_batch(batch)
+            except Exception:
+                log.exception("Error while logging a batch")
+
+    async def _report(self):
+        now = time.monotonic()
+        if self.progress is None or now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        try:
+            await self.progress(self)
+        except discord.errors.HTTPException:
+            log.debug("Couldn't report the progress of a mass action",
+                      exc_info=True)
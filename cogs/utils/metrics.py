@@ -0,0 +1,315 @@
+"""Runtime metrics, served in the Prometheus text format
+
+The core and cogs publish into `registry`. Counters and gauges that
+change often are plain attribute updates; most numbers already exist
+somewhere (executor, caches, scheduler, HTTP service...) and are read by
+collectors only when the endpoint is scraped, so keeping this enabled
+costs next to nothing when nobody is looking.
+
+The endpoint is off unless red.py is started with --metrics-port. It
+listens on localhost only."""
+import logging
+import os
+import sys
+
+from aiohttp import web
+
+from . import logs
+from .dataIO import dataIO
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+log = logging.getLogger("red.metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LAG_INTERVAL = 1
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, _escape(v))
+                          for k, v in sorted(labels.items())) + "}"
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Family:
+    """A metric with its children, one per set of label values"""
+
+    def __init__(self, name, kind, help, labelnames, child):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._child = child
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = child()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError("{} takes the labels {}".format(
+                    self.name, ", ".join(self.labelnames)))
+            child = self._children[values] = self._child()
+        return child
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def set(self, value):
+        self._children[()].set(value)
+
+    def collect(self):
+        samples = [(dict(zip(self.labelnames, values)), child.value)
+                   for values, child in self._children.items()]
+        yield self.name, self.kind, self.help, samples
+
+
+class Registry:
+    """Metrics and collectors, by name
+
+    A collector is a function returning (name, kind, help, samples)
+    tuples, samples being (labels dict, value) pairs. Registering a name
+    again replaces it, so reloaded cogs don't need to clean up first."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def counter(self, name, help, labelnames=()):
+        return self._family(name, "counter", help, labelnames, Counter)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._family(name, "gauge", help, labelnames, Gauge)
+
+    def _family(self, name, kind, help, labelnames, child):
+        family = self._metrics.get(name)
+        if not isinstance(family, Family) or family.kind != kind or \
+                family.labelnames != tuple(labelnames):
+            family = Family(name, kind, help, labelnames, child)
+            self._metrics[name] = family
+        return family
+
+    def add_collector(self, name, collector):
+        self._metrics[name] = collector
+
+    def unregister(self, name):
+        self._metrics.pop(name, None)
+
+    def collect(self):
+        for name, metric in list(self._metrics.items()):
+            try:
+                if isinstance(metric, Family):
+                    yield from metric.collect()
+                else:
+                    yield from metric()
+            except Exception:
+                log.exception("Error while collecting {}".format(name))
+
+    def render(self):
+        lines = []
+        for name, kind, help, samples in self.collect():
+            lines.append("# HELP {} {}".format(name, help))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for labels, value in samples:
+                lines.append("{}{} {}".format(name, _format_labels(labels),
+                                              float(value)))
+        lines.append("")
+        return "\n".join(lines)
+
+
+registry = Registry()
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a callback scheduled every
+    interval seconds"""
+
+    def __init__(self, loop, interval=LAG_INTERVAL):
+        self._loop = loop
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+        self._expected = None
+        self._handle = None
+
+    def start(self):
+        self._expected = self._loop.time() + self.interval
+        self._handle = self._loop.call_at(self._expected, self._tick)
+
+    def _tick(self):
+        now = self._loop.time()
+        self.last = max(now - self._expected, 0.0)
+        self.max = max(self.max, self.last)
+        self._expected = now + self.interval
+        self._handle = self._loop.call_at(self._expected, self._tick)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def collect(self):
+        peak, self.max = self.max, self.last
+        yield ("red_event_loop_lag_seconds", "gauge",
+               "How late the last timer callback ran", [({}, self.last)])
+        yield ("red_event_loop_lag_max_seconds", "gauge",
+               "Worst lag since the previous scrape", [({}, peak)])
+
+
+def _rss():
+    """Resident memory in bytes, and the peak"""
+    peak = 0
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        if sys.platform != "darwin":
+            peak *= 1024
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        current = peak
+    return current, peak
+
+
+def _collect_process():
+    current, peak = _rss()
+    yield ("red_memory_rss_bytes", "gauge", "Resident memory",
+           [({}, current)])
+    yield ("red_memory_max_rss_bytes", "gauge", "Peak resident memory",
+           [({}, peak)])
+
+
+def _collect_bot(bot):
+    stats = bot.stats
+    yield ("red_servers", "gauge", "Servers the bot is in",
+           [({}, stats.servers)])
+    yield ("red_users", "gauge", "Unique users", [({}, stats.users)])
+
+    ex = bot.executor
+    depths = ex.lane_depths()
+    yield ("red_commands_submitted_total", "counter",
+           "Commands queued for execution", [({}, ex.submitted)])
+    yield ("red_commands_completed_total", "counter", "Commands run",
+           [({}, ex.completed)])
+    yield ("red_commands_dropped_total", "counter",
+           "Commands refused because the queue was full",
+           [({}, ex.dropped)])
+    yield ("red_commands_running", "gauge", "Commands running",
+           [({}, ex.running)])
+    yield ("red_commands_queued", "gauge", "Commands waiting",
+           [({"lane": lane}, depth) for lane, depth in depths.items()])
+    yield ("red_rate_limited_total", "counter",
+           "Commands refused by the rate limiter",
+           [({}, bot.rate_limiter.limited)])
+
+    caches = (("help", bot.formatter), ("privileges", bot.privileges))
+    yield ("red_cache_hits_total", "counter", "Cache hits",
+           [({"cache": name}, c.hits) for name, c in caches])
+    yield ("red_cache_misses_total", "counter", "Cache misses",
+           [({"cache": name}, c.misses) for name, c in caches])
+
+    jobs = [({"cog": j.cog or "Red", "job": j.name}, j)
+            for j in bot.scheduler.jobs()]
+    yield ("red_job_runs_total", "counter", "Background job runs",
+           [(labels, j.runs) for labels, j in jobs])
+    yield ("red_job_failures_total", "counter", "Background job errors",
+           [(labels, j.failures) for labels, j in jobs])
+    yield ("red_job_overruns_total", "counter",
+           "Runs skipped because the previous one was still going",
+           [(labels, j.overruns) for labels, j in jobs])
+    yield ("red_job_seconds_total", "counter",
+           "Time spent running background jobs",
+           [(labels, j.total_time) for labels, j in jobs])
+    yield ("red_job_last_seconds", "gauge",
+           "Duration of the last run of background jobs",
+           [(labels, j.last_time) for labels, j in jobs])
+    yield ("red_tasks", "gauge", "Background tasks running",
+           [({}, len(bot.tasks()))])
+
+    hosts = sorted(bot.http_service.stats.items())
+    yield ("red_http_requests_total", "counter", "HTTP requests made by cogs",
+           [({"host": h}, s.requests) for h, s in hosts])
+    yield ("red_http_errors_total", "counter",
+           "HTTP requests that got no response",
+           [({"host": h}, s.errors) for h, s in hosts])
+    yield ("red_http_retries_total", "counter", "HTTP requests retried",
+           [({"host": h}, s.retries) for h, s in hosts])
+    yield ("red_http_seconds_total", "counter",
+           "Time spent on HTTP requests that got a response",
+           [({"host": h}, s.total_latency) for h, s in hosts])
+
+    yield ("red_data_writes_total", "counter", "json files saved",
+           [({}, dataIO.writes)])
+    yield ("red_log_records_dropped_total", "counter",
+           "Log records dropped because the log queue was full",
+           [({}, logs.dropped_records())])
+    yield ("red_log_records_pending", "gauge",
+           "Log records waiting to be written", [({}, logs.pending_records())])
+
+
+def register_bot(bot, registry=registry):
+    """Registers the collectors of the core components of bot"""
+    bot.loop_lag = LoopLagMonitor(bot.loop)
+    bot.loop_lag.start()
+    registry.add_collector("bot", lambda: _collect_bot(bot))
+    registry.add_collector("loop_lag", bot.loop_lag.collect)
+    registry.add_collector("process", _collect_process)
+
+
+class MetricsServer:
+    """Serves registry at http://host:port/metrics"""
+
+    def __init__(self, loop, registry=registry):
+        self._loop = loop
+        self.registry = registry
+        self._handler = None
+        self._server = None
+
+    async def _metrics(self, request):
+        body = self.registry.render().encode("utf-8")
+        return web.Response(body=body, headers={"Content-Type": CONTENT_TYPE})
+
+    async def start(self, port, host="127.0.0.1"):
+        app = web.Application(loop=self._loop)
+        app.router.add_route("GET", "/metrics", self._metrics)
+        self._handler = app.make_handler()
+        self._server = await self._loop.create_server(self._handler, host,
+                                                      port)
+        log.info("Serving metrics on http://{}:{}/metrics".format(host, port))
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            await self._handler.finish_connections(1)
+            self._server = None
@@ -0,0 +1,112 @@
+_END = None  # Never a character, marks where a prefix ends
+_MISSING = object()
+
+
+class PrefixTrie:
+    """Character trie of prefixes
+
+    match() walks the text once and stops at the first character no
+    prefix continues with, so it costs at most the length of the longest
+    prefix no matter how many there are."""
+
+    def __init__(self, prefixes=()):
+        self._root = {}
+        self.prefixes = []
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        if _END not in node:
+            self.prefixes.append(prefix)
+        node[_END] = prefix
+
+    def match(self, text):
+        """Returns the longest prefix text starts with, or None"""
+        node = self._root
+        found = node.get(_END)
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            if _END in node:
+                found = node[_END]
+        return found
+
+    def __len__(self):
+        return len(self.prefixes)
+
+
+class PrefixManager:
+    """Resolves the command prefix of messages, global or per server
+
+    Meant to be set as bot.command_prefix: discord.py calls it with every
+    message and gets back the single prefix the message starts with, so
+    it doesn't try the prefixes one by one. Servers without prefixes of
+    their own use the global ones, or `default` if none are set.
+
+    It also behaves like the list of global prefixes (iteration, len,
+    indexing) for code that still treats bot.command_prefix as one."""
+
+    def __init__(self, settings, default=("!",)):
+        self._settings = settings
+        self._default = list(default)
+        self._source = None
+        self._global = None
+        # server id: PrefixTrie, or None if the server uses the global one
+        self._servers = {}
+
+    @property
+    def prefixes(self):
+        """The global prefixes"""
+        return self._settings.prefixes or self._default
+
+    def _global_trie(self):
+        # Settings.prefixes is replaced, not mutated, when it changes
+        if self._source is not self._settings.prefixes:
+            self._source = self._settings.prefixes
+            self._global = PrefixTrie(self.prefixes)
+        return self._global
+
+    def trie(self, server_id=None):
+        if server_id is None:
+            return self._global_trie()
+        trie = self._servers.get(server_id, _MISSING)
+        if trie is _MISSING:
+            server = self._settings.servers.get(server_id, {})
+            prefixes = server.get("PREFIXES")
+            trie = PrefixTrie(prefixes) if prefixes else None
+            self._servers[server_id] = trie
+        return trie if trie is not None else self._global_trie()
+
+    def refresh(self, server_id=None):
+        """Drops the compiled prefixes of server_id, or of every server"""
+        if server_id is None:
+            self._servers.clear()
+            self._source = None
+        else:
+            self._servers.pop(server_id, None)
+
+    def match(self, content, server_id=None):
+        """Returns the prefix content starts with, or None"""
+        return self.trie(server_id).match(content)
+
+    def for_server(self, server_id=None):
+        """The prefixes in use in server_id"""
+        return list(self.trie(server_id).prefixes)
+
+    def __call__(self, bot, message):
+        server_id = message.server.id if message.server else None
+        prefix = self.match(message.content, server_id)
+        return (prefix,) if prefix is not None else ()
+
+    def __iter__(self):
+        return iter(self.prefixes)
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def __getitem__(self, index):
+        return self.prefixes[index]
@@ -0,0 +1,137 @@
+NONE = 0
+MOD = 1
+ADMIN = 2
+OWNER = 3
+
+
+class PrivilegeCache:
+    """Caches members' privilege level and resolved channel permissions
+
+    The level (owner, admin, mod or none) of a member is worked out from
+    the server's admin and mod role names, compared case insensitively.
+    The role names it was computed with are stored along with it, so
+    changing them in the settings makes the entry stale on its own.
+    Channel permissions are what channel.permissions_for returns.
+
+    Entries are dropped by the listeners when roles, members, channels
+    or the server change."""
+
+    def __init__(self, settings):
+        self._settings = settings
+        # server id: {member id: (admin role, mod role, level)}
+        self._levels = {}
+        # server id: {member id: {channel id: Permissions}}
+        self._permissions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def level(self, member, server=None):
+        if member.id == self._settings.owner:
+            return OWNER
+        if server is None:
+            server = getattr(member, "server", None)
+        if server is None:
+            return NONE
+        admin_role = self._settings.get_server_admin(server).lower()
+        mod_role = self._settings.get_server_mod(server).lower()
+        levels = self._levels.setdefault(server.id, {})
+        cached = levels.get(member.id)
+        if cached is not None and cached[:2] == (admin_role, mod_role):
+            self.hits += 1
+            return cached[2]
+        self.misses += 1
+        level = NONE
+        # Users that left the server have no roles
+        for role in getattr(member, "roles", ()):
+            name = role.name.lower()
+            if admin_role and name == admin_role:
+                level = ADMIN
+                break
+            if mod_role and name == mod_role:
+                level = MOD
+        levels[member.id] = (admin_role, mod_role, level)
+        return level
+
+    def is_admin(self, member, server=None):
+        return self.level(member, server) >= ADMIN
+
+    def is_mod(self, member, server=None):
+        """Mod, admin or owner"""
+        return self.level(member, server) >= MOD
+
+    def permissions(self, channel, member):
+        """channel.permissions_for(member), cached. The returned object
+        is shared and must not be modified"""
+        if channel.is_private:
+            return channel.permissions_for(member)
+        channels = self._permissions.setdefault(
+            channel.server.id, {}).setdefault(member.id, {})
+        resolved = channels.get(channel.id)
+        if resolved is not None:
+            self.hits += 1
+            return resolved
+        self.misses += 1
+        resolved = channel.permissions_for(member)
+        channels[channel.id] = resolved
+        return resolved
+
+    def invalidate_server(self, server):
+        self._levels.pop(server.id, None)
+        self._permissions.pop(server.id, None)
+
+    def invalidate_member(self, member):
+        self._levels.get(member.server.id, {}).pop(member.id, None)
+        self._permissions.get(member.server.id, {}).pop(member.id, None)
+
+    def invalidate_channel(self, channel):
+        if channel.is_private:
+            return
+        for channels in self._permissions.get(channel.server.id, {}).values():
+            channels.pop(channel.id, None)
+
+    def clear(self):
+        self._levels.clear()
+        self._permissions.clear()
+
+    def __len__(self):
+        return (sum(len(m) for m in self._levels.values()) +
+                sum(len(c) for m in self._permissions.values()
+                    for c in m.values()))
+
+    def listeners(self):
+        """(event, coroutine) pairs to register with bot.add_listener"""
+        return (("on_server_update", self.on_server_update),
+                ("on_server_remove", self.on_server_remove),
+                ("on_server_unavailable", self.on_server_remove),
+                ("on_server_role_delete", self.on_role_delete),
+                ("on_server_role_update", self.on_role_update),
+                ("on_member_update", self.on_member_update),
+                ("on_member_remove", self.on_member_remove),
+                ("on_channel_update", self.on_channel_update),
+                ("on_channel_delete", self.on_channel_delete))
+
+    async def on_server_update(self, before, after):
+        # The owner has every permission
+        self.invalidate_server(after)
+
+    async def on_server_remove(self, server):
+        self.invalidate_server(server)
+
+    async def on_role_delete(self, role):
+        self.invalidate_server(role.server)
+
+    async def on_role_update(self, before, after):
+        self.invalidate_server(after.server)
+
+    async def on_member_update(self, before, after):
+        if before.roles != after.roles:
+            self.invalidate_member(after)
+
+    async def on_member_remove(self, member):
+        self.invalidate_member(member)
+
+    async def on_channel_update(self, before, after):
+        self.invalidate_channel(after)
+
+    async def on_channel_delete(self, channel):
+        self.invalidate_channel(channel)
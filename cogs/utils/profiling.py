@@ -0,0 +1,190 @@
+import importlib.abc
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class _TimedLoader:
+    """Wraps a module loader and records how long exec_module takes"""
+
+    def __init__(self, loader, timer):
+        self._loader = loader
+        self._timer = timer
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._timer.enter(module.__name__)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer.exit(module.__name__)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    """Meta path finder that times every module imported while installed
+
+    Both the inclusive time and the self time (inclusive minus the modules
+    it imported) are recorded, like python -X importtime does on 3.7+"""
+
+    def __init__(self):
+        self.inclusive = {}
+        self.self_time = {}
+        self._stack = []
+
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self:
+                continue
+            find_spec = getattr(finder, "find_spec", None)
+            if find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        if loader is not None and hasattr(loader, "exec_module"):
+            spec.loader = _TimedLoader(loader, self)
+        return spec
+
+    def enter(self, name):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self, name):
+        name, started, children = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        self.inclusive[name] = elapsed
+        self.self_time[name] = elapsed - children
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+
+class StartupProfiler:
+    """Records where boot time goes when Red is started with
+    --profile-startup
+
+    Phases are timed with the phase() context manager, or with mark() for
+    phases that end somewhere else (like connecting -> on_ready).
+    When disabled every method is a no-op."""
+
+    def __init__(self, enabled=False, top=15):
+        self.enabled = enabled
+        self.top = top
+        self.phases = []
+        self.finished = False
+        self._started = None
+        self._marks = {}
+        self._imports = None
+        self._finish_callbacks = []
+
+    def start(self):
+        if not self.enabled or self._started is not None:
+            return
+        self._started = time.perf_counter()
+        self._imports = _ImportTimer()
+        sys.meta_path.insert(0, self._imports)
+        if tracemalloc is not None:
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def mark(self, name):
+        """Starts a phase that will be closed by end(name)"""
+        if self.enabled:
+            self._marks[name] = time.perf_counter()
+
+    def end(self, name):
+        if self.enabled and name in self._marks:
+            started = self._marks.pop(name)
+            self.phases.append((name, time.perf_counter() - started))
+
+    def add_finish_callback(self, callback):
+        self._finish_callbacks.append(callback)
+
+    def finish(self, path=None):
+        """Stops profiling, prints the report and optionally dumps it
+        as json. Only the first call does anything."""
+        if not self.enabled or self.finished:
+            return None
+        self.finished = True
+        report = self.report()
+        if self._imports in sys.meta_path:
+            sys.meta_path.remove(self._imports)
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        print(self.format_report(report))
+        if path is not None:
+            with open(path, encoding="utf-8", mode="w") as f:
+                json.dump(report, f, indent=4)
+        for callback in self._finish_callbacks:
+            callback()
+        return report
+
+    def report(self):
+        total = time.perf_counter() - self._started
+        imports = sorted(self._imports.self_time.items(),
+                         key=lambda x: x[1], reverse=True)
+        report = {
+            "total": total,
+            "phases": [{"name": n, "seconds": s} for n, s in self.phases],
+            "imports": [{"module": m, "self": s,
+                         "inclusive": self._imports.inclusive[m]}
+                        for m, s in imports[:self.top]],
+            "import_total": sum(self._imports.self_time.values()),
+            "allocations": []
+        }
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            report["memory_current"] = current
+            report["memory_peak"] = peak
+            for stat in snapshot.statistics("lineno")[:self.top]:
+                frame = stat.traceback[0]
+                report["allocations"].append({
+                    "location": "{}:{}".format(frame.filename, frame.lineno),
+                    "size": stat.size,
+                    "count": stat.count})
+        return report
+
+    def format_report(self, report):
+        msg = "------\nStartup profile ({:.3f}s total)\n".format(
+            report["total"])
+        msg += "\nPhases:\n"
+        for phase in report["phases"]:
+            msg += "  {:<20} {:>8.3f}s\n".format(phase["name"],
+                                                 phase["seconds"])
+        msg += "\nImports ({:.3f}s, top {} by self time):\n".format(
+            report["import_total"], len(report["imports"]))
+        for imp in report["imports"]:
+            msg += "  {:<40} {:>8.3f}s {:>8.3f}s\n".format(
+                imp["module"], imp["self"], imp["inclusive"])
+        if report["allocations"]:
+            msg += "\nTop allocations (peak {:.1f} MiB):\n".format(
+                report["memory_peak"] / 2**20)
+            for alloc in report["allocations"]:
+                msg += "  {:<60} {:>10.1f} KiB {:>8} blocks\n".format(
+                    alloc["location"][-60:], alloc["size"] / 1024,
+                    alloc["count"])
+        msg += "------"
+        return msg
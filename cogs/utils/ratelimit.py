@@ -0,0 +1,162 @@
+import time
+
+DEFAULT_LIMITS = {
+    "ENABLED": True,
+    # Scope: [tokens refilled per second, bucket size]
+    "USER": [0.5, 5],
+    "CHANNEL": [2, 15],
+    "SERVER": [5, 40],
+    # Commands not listed here cost 1 token
+    "COSTS": {"leaderboard global": 5, "leaderboard": 3, "queue": 3,
+              "urban": 2, "gif": 2, "gifr": 2, "imgur": 2, "help": 2}
+}
+
+
+class TimingWheel:
+    """Hashed timing wheel used to expire keys in O(1)
+
+    Keys are put in the slot of the tick they expire at. Advancing the
+    wheel hands back the keys of every slot it went past. Deadlines
+    further away than the wheel's span are put in the last slot and are
+    expected to be rescheduled by the owner when they come back early."""
+
+    def __init__(self, slots=64, resolution=1.0):
+        self._slots = [set() for _ in range(slots)]
+        self._resolution = resolution
+        self._current = None
+
+    def _tick(self, when):
+        return int(when / self._resolution)
+
+    def add(self, key, when):
+        """Schedules key to expire at when. Returns the tick to pass to
+        remove() if the key has to be rescheduled"""
+        n = len(self._slots)
+        tick = self._tick(when)
+        tick = max(tick, self._current + 1)
+        tick = min(tick, self._current + n - 1)
+        self._slots[tick % n].add(key)
+        return tick
+
+    def remove(self, key, tick):
+        self._slots[tick % len(self._slots)].discard(key)
+
+    def advance(self, now):
+        target = self._tick(now)
+        if self._current is None:
+            self._current = target
+            return []
+        expired = []
+        n = len(self._slots)
+        # Past a full turn every slot has expired, no need to spin more
+        start = max(self._current, target - n)
+        for tick in range(start + 1, target + 1):
+            slot = self._slots[tick % n]
+            if slot:
+                expired.extend(slot)
+                slot.clear()
+        self._current = max(self._current, target)
+        return expired
+
+    def __len__(self):
+        return sum(len(s) for s in self._slots)
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated", "expires", "tick")
+
+    def __init__(self, capacity, now):
+        self.tokens = capacity
+        self.updated = now
+        self.expires = now
+        self.tick = None
+
+    def refill(self, rate, capacity, now):
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+
+class RateLimiter:
+    """Token bucket limiter keyed by user, channel and server
+
+    A command is allowed only if every bucket it falls under has enough
+    tokens for its cost, in which case the cost is taken from all of them.
+    Buckets are dropped from memory by a timing wheel once they would be
+    full again, so idle users cost nothing."""
+
+    SCOPES = ("USER", "CHANNEL", "SERVER")
+
+    def __init__(self, config=None, clock=time.monotonic):
+        self._clock = clock
+        self._buckets = {}
+        self._wheel = TimingWheel()
+        self.limited = 0
+        self.configure(config or {})
+
+    def configure(self, config):
+        merged = dict(DEFAULT_LIMITS)
+        merged.update(config)
+        self.enabled = merged["ENABLED"]
+        self.limits = {scope: tuple(merged[scope]) for scope in self.SCOPES}
+        self.costs = dict(merged["COSTS"])
+        self._buckets.clear()
+        self._wheel = TimingWheel()
+
+    def cost(self, command_name, subcommand=None):
+        if subcommand is not None:
+            key = "{} {}".format(command_name, subcommand)
+            if key in self.costs:
+                return self.costs[key]
+        return self.costs.get(command_name, 1)
+
+    def keys(self, message):
+        yield "USER", message.author.id
+        yield "CHANNEL", message.channel.id
+        if not message.channel.is_private:
+            yield "SERVER", message.server.id
+
+    def allow(self, message, cost=1):
+        if not self.enabled or cost <= 0:
+            return True
+        now = self._clock()
+        self._expire(now)
+        buckets = []
+        for scope, key in self.keys(message):
+            rate, capacity = self.limits[scope]
+            if rate <= 0:
+                continue
+            bucket = self._buckets.get((scope, key))
+            if bucket is None:
+                bucket = TokenBucket(capacity, now)
+                self._buckets[(scope, key)] = bucket
+                self._reschedule((scope, key), bucket, now)
+            else:
+                bucket.refill(rate, capacity, now)
+            if bucket.tokens < cost:
+                self.limited += 1
+                return False
+            buckets.append((scope, key, bucket, rate, capacity))
+        for scope, key, bucket, rate, capacity in buckets:
+            bucket.tokens -= cost
+            self._reschedule((scope, key), bucket,
+                             now + (capacity - bucket.tokens) / rate)
+        return True
+
+    def _reschedule(self, key, bucket, expires):
+        if bucket.tick is not None:
+            self._wheel.remove(key, bucket.tick)
+        bucket.expires = expires
+        bucket.tick = self._wheel.add(key, expires)
+
+    def _expire(self, now):
+        for key in self._wheel.advance(now):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+            if bucket.expires > now:
+                bucket.tick = self._wheel.add(key, bucket.expires)
+            else:
+                del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
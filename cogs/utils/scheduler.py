@@ -0,0 +1,307 @@
+"""Periodic and one-shot jobs for cogs, on a hierarchical timer wheel
+
+A cog registers a coroutine function with bot.scheduler.every() or
+once() instead of running its own sleep loop. Jobs are kept in a timer
+wheel: adding and cancelling are O(1) and the loop is only woken up when
+a job is due, so idle timers cost nothing however many there are.
+
+Jobs registered with a cog are cancelled when the cog is removed (see
+cogs/utils/lifecycle.py)."""
+import asyncio
+import logging
+import random
+import time
+
+log = logging.getLogger("red.scheduler")
+
+RESOLUTION = 0.1  # Seconds per tick
+SLOT_BITS = 6  # 64 slots per level
+LEVELS = 4  # 64 ** 4 ticks, about 19 days
+
+
+class TimerWheel:
+    """Hashed hierarchical timer wheel
+
+    Level 0 has a slot per tick, level 1 a slot per 64 ticks and so on.
+    A timer goes in the lowest level whose slots it's less than a full
+    turn away from and moves down a level each time its slot comes up
+    (cascading), until it expires from level 0. Timers only need a
+    `deadline` (absolute tick) and a `_slot` attribute."""
+
+    def __init__(self, slot_bits=SLOT_BITS, levels=LEVELS):
+        self._bits = slot_bits
+        self._slots = 1 << slot_bits
+        self._mask = self._slots - 1
+        self._levels = [[set() for _ in range(self._slots)]
+                        for _ in range(levels)]
+        # Next tick to be processed
+        self.tick = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, timer):
+        deadline = max(timer.deadline, self.tick)
+        for level in range(len(self._levels)):
+            shift = level * self._bits
+            if (deadline >> shift) - (self.tick >> shift) < self._slots:
+                break
+        else:
+            # Further than the wheel reaches, parked in the last slot of
+            # the top level and placed again when it cascades
+            deadline = (((self.tick >> shift) + self._mask) << shift)
+        slot = self._levels[level][(deadline >> shift) & self._mask]
+        slot.add(timer)
+        timer._slot = slot
+        self._count += 1
+
+    def remove(self, timer):
+        if timer._slot is not None:
+            timer._slot.discard(timer)
+            timer._slot = None
+            self._count -= 1
+
+    def advance(self, tick):
+        """Processes the ticks up to and including tick, returns the
+        timers that expired"""
+        expired = []
+        while True:
+            # Jumps over the ticks where nothing happens
+            current = self.next_tick()
+            if current is None or current > tick:
+                self.tick = max(self.tick, tick + 1)
+                return expired
+            self.tick = current
+            for level in range(len(self._levels) - 1, 0, -1):
+                shift = level * self._bits
+                if current & ((1 << shift) - 1) == 0:
+                    slot = self._levels[level][(current >> shift) &
+                                               self._mask]
+                    if slot:
+                        timers = list(slot)
+                        slot.clear()
+                        self._count -= len(timers)
+                        for timer in timers:
+                            timer._slot = None
+                            self.add(timer)
+            slot = self._levels[0][current & self._mask]
+            if slot:
+                for timer in slot:
+                    timer._slot = None
+                self._count -= len(slot)
+                expired.extend(slot)
+                slot.clear()
+            self.tick = current + 1
+
+    def next_tick(self):
+        """The next tick at which a timer expires or cascades, None if
+        the wheel is empty"""
+        if not self._count:
+            return None
+        best = None
+        for level, slots in enumerate(self._levels):
+            shift = level * self._bits
+            start = self.tick >> shift
+            for offset in range(self._slots):
+                bucket = start + offset
+                when = bucket << shift
+                if when < self.tick:
+                    continue
+                if best is not None and when >= best:
+                    break
+                if slots[bucket & self._mask]:
+                    best = when
+                    break
+        return best
+
+
+class Job:
+    """A registered job, along with its runtime metrics"""
+
+    def __init__(self, scheduler, callback, interval, jitter, cog, name):
+        self._scheduler = scheduler
+        self.callback = callback
+        self.interval = interval  # None for one-shot jobs
+        self.jitter = jitter
+        self.cog = cog
+        self.name = name
+        self.due = 0.0  # Loop time
+        self.deadline = 0  # Tick
+        self._slot = None
+        self._task = None
+        self.cancelled = False
+        self.runs = 0
+        self.failures = 0
+        self.overruns = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+        self.max_lag = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    @property
+    def mean_time(self):
+        return self.total_time / self.runs if self.runs else 0.0
+
+    def cancel(self):
+        self._scheduler.cancel(self)
+
+    def __repr__(self):
+        return "<Job {} of {}>".format(self.name, self.cog or "the bot")
+
+
+class Scheduler:
+    """Runs jobs when they're due
+
+    Periodic jobs run at a fixed rate. If a run is still going when the
+    next one is due that run is skipped and counted as an overrun, runs
+    of a job never overlap. jitter spreads each run randomly over up to
+    that many seconds later, so jobs registered together don't all hit
+    the same API at once."""
+
+    def __init__(self, loop, resolution=RESOLUTION):
+        self.loop = loop
+        self.resolution = resolution
+        self._wheel = TimerWheel()
+        self._origin = loop.time()
+        self._handle = None
+        self._armed = None
+        # Cog name (None for the bot's own): set of jobs
+        self._jobs = {}
+        self.closed = False
+
+    def _tick_at(self, when):
+        return int((when - self._origin) / self.resolution)
+
+    def _time_of(self, tick):
+        return self._origin + tick * self.resolution
+
+    def every(self, interval, callback, cog=None, name=None, jitter=0,
+              delay=None):
+        """Runs callback() every interval seconds, first after delay
+        (defaults to interval) seconds"""
+        if interval < self.resolution:
+            raise ValueError("The interval can't be shorter than "
+                             "{}s".format(self.resolution))
+        return self._add(callback, interval, jitter, cog, name,
+                         interval if delay is None else delay)
+
+    def once(self, delay, callback, cog=None, name=None):
+        """Runs callback() once, delay seconds from now"""
+        return self._add(callback, None, 0, cog, name, delay)
+
+    def _add(self, callback, interval, jitter, cog, name, delay):
+        if self.closed:
+            raise RuntimeError("The scheduler is closed")
+        if cog is not None and not isinstance(cog, str):
+            cog = type(cog).__name__
+        if name is None:
+            name = getattr(callback, "__name__", repr(callback))
+        job = Job(self, callback, interval, jitter, cog, name)
+        self._jobs.setdefault(cog, set()).add(job)
+        self._schedule(job, self.loop.time() + delay)
+        return job
+
+    def _schedule(self, job, when):
+        if job.jitter:
+            when += random.uniform(0, job.jitter)
+        job.due = when
+        job.deadline = max(self._tick_at(when), self._wheel.tick)
+        self._wheel.add(job)
+        self._arm()
+
+    def _arm(self):
+        tick = self._wheel.next_tick()
+        if tick is None:
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = self._armed = None
+            return
+        if self._armed is not None and self._armed <= tick:
+            return
+        if self._handle is not None:
+            self._handle.cancel()
+        self._armed = tick
+        self._handle = self.loop.call_at(self._time_of(tick), self._fire)
+
+    def _fire(self):
+        tick = max(self._tick_at(self.loop.time()), self._armed)
+        self._handle = self._armed = None
+        now = self.loop.time()
+        for job in self._wheel.advance(tick):
+            job.max_lag = max(job.max_lag, now - job.due)
+            if job.interval is not None:
+                # Fixed rate, unless it fell behind by more than a run
+                when = job.due + job.interval
+                self._schedule(job, when if when > now else
+                               now + job.interval)
+            else:
+                self._remove(job)
+            if job.running:
+                job.overruns += 1
+                level = logging.WARNING if job.overruns == 1 else \
+                    logging.DEBUG
+                log.log(level, "{!r} is still running, skipped a run"
+                               "".format(job))
+                continue
+            job._task = self.loop.create_task(self._run(job))
+        self._arm()
+
+    async def _run(self, job):
+        start = time.perf_counter()
+        try:
+            await job.callback()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            job.failures += 1
+            log.exception("Error in {!r}".format(job))
+        finally:
+            elapsed = time.perf_counter() - start
+            job.runs += 1
+            job.total_time += elapsed
+            job.last_time = elapsed
+            job.max_time = max(job.max_time, elapsed)
+
+    def _remove(self, job):
+        jobs = self._jobs.get(job.cog)
+        if jobs is not None:
+            jobs.discard(job)
+            if not jobs:
+                del self._jobs[job.cog]
+
+    def cancel(self, job):
+        """Unschedules job and cancels its run if one is going"""
+        job.cancelled = True
+        self._wheel.remove(job)
+        self._remove(job)
+        if job.running:
+            job._task.cancel()
+
+    def jobs(self, cog=None):
+        """Jobs of cog, or every job if cog is None"""
+        if cog is None:
+            return [j for jobs in self._jobs.values() for j in jobs]
+        if not isinstance(cog, str):
+            cog = type(cog).__name__
+        return list(self._jobs.get(cog, ()))
+
+    def cancel_jobs(self, cog):
+        """Cancels the jobs of cog, or every job if cog is None. Returns
+        the runs that were going"""
+        running = []
+        for job in self.jobs(cog):
+            if job.running:
+                running.append(job._task)
+            self.cancel(job)
+        self._arm()
+        return running
+
+    def close(self):
+        """Cancels every job, returns the runs that were going"""
+        self.closed = True
+        return self.cancel_jobs(None)
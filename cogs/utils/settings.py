@@ -1,4 +1,7 @@
 from .dataIO import fileIO
+from contextlib import contextmanager
+from copy import deepcopy
+from types import MappingProxyType
 import discord
 import os
 
@@ -7,20 +10,24 @@ default_path = "data/red/settings.json"
 class Settings:
     def __init__(self,path=default_path):
         self.path = path
+        self.dirty = False
+        self._transactions = 0
+        self._servers = {}
         self.check_folders()
-        self.default_settings = {"EMAIL" : "EmailHere", "PASSWORD" : "", "OWNER" : "id_here", "PREFIXES" : [], "default":{"ADMIN_ROLE" : "Transistor", "MOD_ROLE" : "Process"}, "LOGIN_TYPE" : "email"}
+        self.default_settings = {"EMAIL" : "EmailHere", "PASSWORD" : "", "OWNER" : "id_here", "PREFIXES" : [], "default":{"ADMIN_ROLE" : "Transistor", "MOD_ROLE" : "Process"}, "LOGIN_TYPE" : "email", "RATE_LIMITS" : {}, "EXECUTOR" : {}, "HTTP" : {}}
         if not fileIO(self.path,"check"):
             self.bot_settings = self.default_settings
             self.save_settings()
         else:
-            current = fileIO(self.path, "load")
-            if current.keys() != self.default_settings.keys():
-                for key in self.default_settings.keys():
-                    if key not in current.keys():
-                        current[key] = self.default_settings[key]
-                        print("Adding " + str(key) + " field to red settings.json")
-                fileIO(self.path, "save", current)
-            self.bot_settings = fileIO(self.path,"load")
+            self.bot_settings = fileIO(self.path, "load")
+            for key in self.default_settings.keys():
+                if key not in self.bot_settings.keys():
+                    self.bot_settings[key] = self.default_settings[key]
+                    print("Adding " + str(key) + " field to red settings.json")
+                    self.dirty = True
+            if self.dirty:
+                self.save_settings()
+        self._index_servers()
         if "default" not in self.bot_settings:
             self.update_old_settings()
 
@@ -31,8 +38,49 @@ class Settings:
                 print("Creating " + folder + " folder...")
                 os.makedirs(folder)
 
+    def _index_servers(self):
+        self._servers = {k: v for k, v in self.bot_settings.items()
+                         if str(k).isdigit()}
+
+    def reload(self, data):
+        """Replaces the settings with data, already saved elsewhere"""
+        self.bot_settings = data
+        self._index_servers()
+
     def save_settings(self):
+        """Writes the settings, or only marks them as changed while a
+        transaction is open"""
+        if self._transactions:
+            self.dirty = True
+            return
         fileIO(self.path,"save",self.bot_settings)
+        self.dirty = False
+
+    @contextmanager
+    def transaction(self):
+        """Groups changes into a single write, made when the outermost
+        transaction exits. If it exits with an exception every change
+        made inside it is rolled back and nothing is written.
+
+        with settings.transaction():
+            settings.owner = ...
+            settings.prefixes = ..."""
+        if not self._transactions:
+            snapshot = deepcopy(self.bot_settings)
+        self._transactions += 1
+        try:
+            yield self
+        except:
+            self._transactions -= 1
+            if not self._transactions:
+                self.bot_settings = snapshot
+                self._index_servers()
+                self.dirty = False
+            raise
+        else:
+            self._transactions -= 1
+            if not self._transactions and self.dirty:
+                self.save_settings()
 
     def update_old_settings(self):
         mod = self.bot_settings["MOD_ROLE"]
@@ -105,13 +153,40 @@ class Settings:
         self.bot_settings["default"]["MOD_ROLE"] = value
         self.save_settings()
 
+    @property
+    def rate_limits(self):
+        return self.bot_settings["RATE_LIMITS"]
+
+    @rate_limits.setter
+    def rate_limits(self,value):
+        assert isinstance(value,dict)
+        self.bot_settings["RATE_LIMITS"] = value
+        self.save_settings()
+
+    @property
+    def executor(self):
+        return self.bot_settings["EXECUTOR"]
+
+    @executor.setter
+    def executor(self,value):
+        assert isinstance(value,dict)
+        self.bot_settings["EXECUTOR"] = value
+        self.save_settings()
+
+    @property
+    def http(self):
+        return self.bot_settings["HTTP"]
+
+    @http.setter
+    def http(self,value):
+        assert isinstance(value,dict)
+        self.bot_settings["HTTP"] = value
+        self.save_settings()
+
     @property
     def servers(self):
-        ret = {}
-        server_ids = list(filter(lambda x: str(x).isdigit(),self.bot_settings))
-        for server in server_ids:
-            ret.update({server:self.bot_settings[server]})
-        return ret
+        """Read only view of the per server settings by server id"""
+        return MappingProxyType(self._servers)
 
     @property
     def login_type(self):
@@ -126,42 +201,67 @@ class Settings:
         if server is None:
             return self.bot_settings["default"].copy()
         assert isinstance(server,discord.Server)
-        return self.bot_settings.get(server.id,self.bot_settings["default"]).copy()
+        return self._servers.get(server.id,self.bot_settings["default"]).copy()
 
     def get_server_admin(self,server):
         if server is None:
             return self.default_admin
         assert isinstance(server,discord.Server)
-        if server.id not in self.bot_settings:
+        if server.id not in self._servers:
             return self.default_admin
-        return self.bot_settings[server.id].get("ADMIN_ROLE","")
+        return self._servers[server.id].get("ADMIN_ROLE","")
 
     def set_server_admin(self,server,value):
         if server is None:
             return
         assert isinstance(server,discord.Server)
-        if server.id not in self.bot_settings:
-            self.add_server(server.id)
-        self.bot_settings[server.id]["ADMIN_ROLE"] = value
-        self.save_settings()
+        with self.transaction():
+            if server.id not in self._servers:
+                self.add_server(server.id)
+            self._servers[server.id]["ADMIN_ROLE"] = value
+            self.save_settings()
 
     def get_server_mod(self,server):
         if server is None:
             return self.default_mod
         assert isinstance(server,discord.Server)
-        if server.id not in self.bot_settings:
+        if server.id not in self._servers:
             return self.default_mod
-        return self.bot_settings[server.id].get("MOD_ROLE","")
+        return self._servers[server.id].get("MOD_ROLE","")
 
     def set_server_mod(self,server,value):
         if server is None:
             return
         assert isinstance(server,discord.Server)
-        if server.id not in self.bot_settings:
-            self.add_server(server.id)
-        self.bot_settings[server.id]["MOD_ROLE"] = value
-        self.save_settings()
+        with self.transaction():
+            if server.id not in self._servers:
+                self.add_server(server.id)
+            self._servers[server.id]["MOD_ROLE"] = value
+            self.save_settings()
+
+    def get_server_prefixes(self,server):
+        """Prefixes of the server, empty if it uses the global ones"""
+        if server is None:
+            return []
+        assert isinstance(server,discord.Server)
+        return list(self._servers.get(server.id,{}).get("PREFIXES",[]))
+
+    def set_server_prefixes(self,server,prefixes):
+        """Empty prefixes make the server go back to the global ones"""
+        if server is None:
+            return
+        assert isinstance(server,discord.Server)
+        assert isinstance(prefixes,list)
+        with self.transaction():
+            if server.id not in self._servers:
+                self.add_server(server.id)
+            if prefixes:
+                self._servers[server.id]["PREFIXES"] = prefixes
+            else:
+                self._servers[server.id].pop("PREFIXES", None)
+            self.save_settings()
 
     def add_server(self,sid):
         self.bot_settings[sid] = self.bot_settings["default"].copy()
+        self._servers[sid] = self.bot_settings[sid]
         self.save_settings()
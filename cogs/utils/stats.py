@@ -0,0 +1,159 @@
+from collections import Counter
+
+ONLINE_STATUSES = ("online", "idle")
+
+
+def is_online(member):
+    return str(member.status) in ONLINE_STATUSES
+
+
+class ServerStats:
+    __slots__ = ("members", "online", "channels")
+
+    def __init__(self):
+        self.members = 0
+        self.online = 0
+        self.channels = Counter()
+
+    @property
+    def text_channels(self):
+        return self.channels["text"]
+
+    @property
+    def voice_channels(self):
+        return self.channels["voice"]
+
+
+class BotStats:
+    """Bot-wide counters kept up to date from gateway events
+
+    Counts unique users, channels by type and members / online members
+    per server so that the ready banner and the info commands don't have
+    to walk every member and channel each time they are used."""
+
+    def __init__(self):
+        self._servers = {}
+        self._user_refs = {}
+        self.channels = Counter()
+
+    @property
+    def users(self):
+        return len(self._user_refs)
+
+    @property
+    def servers(self):
+        return len(self._servers)
+
+    @property
+    def total_channels(self):
+        return sum(self.channels.values())
+
+    def server(self, server):
+        """Returns the counters of a server, tracking it if it wasn't"""
+        stats = self._servers.get(server.id)
+        if stats is None:
+            stats = self.add_server(server)
+        return stats
+
+    def sync(self, servers):
+        """Rebuilds the counters unless servers are the tracked ones.
+        on_ready fires again on every reconnect, the servers seen before
+        are kept up to date by the events"""
+        servers = list(servers)
+        if {s.id for s in servers} != self._servers.keys():
+            self.rebuild(servers)
+
+    def rebuild(self, servers):
+        self._servers = {}
+        self._user_refs = {}
+        self.channels = Counter()
+        for server in servers:
+            self.add_server(server)
+
+    def add_server(self, server):
+        if server.id in self._servers:
+            self.remove_server(server)
+        stats = ServerStats()
+        self._servers[server.id] = stats
+        for member in server.members:
+            self._add_member(stats, member)
+        for channel in server.channels:
+            stats.channels[str(channel.type)] += 1
+        self.channels.update(stats.channels)
+        return stats
+
+    def remove_server(self, server):
+        stats = self._servers.pop(server.id, None)
+        if stats is None:
+            return
+        for member in server.members:
+            self._release_user(member.id)
+        self.channels.subtract(stats.channels)
+
+    def _add_member(self, stats, member):
+        stats.members += 1
+        if is_online(member):
+            stats.online += 1
+        self._user_refs[member.id] = self._user_refs.get(member.id, 0) + 1
+
+    def _release_user(self, user_id):
+        refs = self._user_refs.get(user_id, 0) - 1
+        if refs > 0:
+            self._user_refs[user_id] = refs
+        else:
+            self._user_refs.pop(user_id, None)
+
+    def listeners(self):
+        """(event, coroutine) pairs to register with bot.add_listener"""
+        return (("on_server_join", self.on_server_join),
+                ("on_server_available", self.on_server_join),
+                ("on_server_remove", self.on_server_remove),
+                ("on_server_unavailable", self.on_server_remove),
+                ("on_member_join", self.on_member_join),
+                ("on_member_remove", self.on_member_remove),
+                ("on_member_update", self.on_member_update),
+                ("on_channel_create", self.on_channel_create),
+                ("on_channel_delete", self.on_channel_delete))
+
+    async def on_server_join(self, server):
+        self.add_server(server)
+
+    async def on_server_remove(self, server):
+        self.remove_server(server)
+
+    async def on_member_join(self, member):
+        stats = self._servers.get(member.server.id)
+        if stats is not None:
+            self._add_member(stats, member)
+
+    async def on_member_remove(self, member):
+        stats = self._servers.get(member.server.id)
+        if stats is None:
+            return
+        stats.members -= 1
+        if is_online(member):
+            stats.online -= 1
+        self._release_user(member.id)
+
+    async def on_member_update(self, before, after):
+        if before.status == after.status:
+            return
+        stats = self._servers.get(after.server.id)
+        if stats is not None:
+            stats.online += is_online(after) - is_online(before)
+
+    async def on_channel_create(self, channel):
+        if channel.is_private:
+            return
+        stats = self._servers.get(channel.server.id)
+        if stats is not None:
+            stats.channels[str(channel.type)] += 1
+            self.channels[str(channel.type)] += 1
+
+    async def on_channel_delete(self, channel):
+        if channel.is_private:
+            return
+        stats = self._servers.get(channel.server.id)
+        if stats is not None:
+            stats.channels[str(channel.type)] -= 1
+            self.channels[str(channel.type)] -= 1
@@ -0,0 +1,127 @@
+"""Runs Red as several shards, one red.py process each
+
+Every shard owns a share of the servers (Discord assigns them by id) and
+runs on its own core. The launcher supervises them: a shard that crashes
+is restarted, a shard that exits cleanly (the shutdown command) stops
+them all. It also hosts the coordinator (cogs/utils/coordinator.py) the
+shards go through to write shared data and to answer commands like
+servers and leaderboard global across every shard.
+
+Red has to be configured first by starting red.py once.
+
+Usage:
+    python launcher.py --shards 4 [red.py options]
+"""
+import argparse
+import asyncio
+import binascii
+import logging
+import os
+import signal
+import sys
+import time
+
+from cogs.utils import coordinator
+
+RED = os.path.join(os.path.dirname(os.path.abspath(__file__)), "red.py")
+
+log = logging.getLogger("red.launcher")
+
+
+class Shard:
+    def __init__(self, shard_id, shard_count, extra_args):
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.extra_args = extra_args
+        self.process = None
+        self.restarts = 0
+
+    async def run(self, env, stopping, delay=0):
+        """Runs the shard until it exits cleanly or the launcher stops.
+        Crashes are restarted with an increasing delay"""
+        try:
+            await asyncio.wait_for(stopping.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        while not stopping.is_set():
+            started = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, RED, "--no-prompt",
+                "--shard-id", str(self.shard_id),
+                "--shard-count", str(self.shard_count),
+                *self.extra_args, env=env)
+            code = await self.process.wait()
+            if code == 0 or stopping.is_set():
+                return code
+            # A shard that stayed up for a while starts over
+            if time.monotonic() - started > 300:
+                self.restarts = 0
+            self.restarts += 1
+            delay = min(2 ** self.restarts, 60)
+            log.error("Shard {} exited with code {}, restarting in {}s"
+                      "".format(self.shard_id, code, delay))
+            try:
+                await asyncio.wait_for(stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        return 0
+
+    def terminate(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+
+
+async def launch(args, extra_args, loop):
+    token = binascii.hexlify(os.urandom(16)).decode()
+    hub = coordinator.Coordinator(token, loop)
+    host, port = await hub.start()
+    env = dict(os.environ)
+    env[coordinator.ENV_ADDRESS] = "{}:{}".format(host, port)
+    env[coordinator.ENV_TOKEN] = token
+
+    stopping = asyncio.Event()
+    shards = [Shard(i, args.shards, extra_args) for i in range(args.shards)]
+    if hasattr(signal, "SIGTERM") and os.name != "nt":
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopping.set)
+
+    print("Starting {} shards".format(args.shards))
+    # Discord allows one login every 5 seconds
+    tasks = [loop.create_task(s.run(env, stopping, delay=5 * s.shard_id))
+             for s in shards]
+    done, pending = await asyncio.wait(tasks,
+                                       return_when=asyncio.FIRST_COMPLETED)
+    stopping.set()
+    for shard in shards:
+        shard.terminate()
+    if pending:
+        await asyncio.wait(pending)
+    hub.close()
+    print("All shards stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 1,
+                        help="number of shards, defaults to the number of "
+                             "cores")
+    args, extra_args = parser.parse_known_args()
+    if not os.path.isfile("data/red/settings.json"):
+        sys.exit("Red isn't configured yet. Start red.py once first.")
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s",
+                        datefmt="[%d/%m/%Y %H:%M]")
+    if os.name == "nt":
+        # Subprocesses need the proactor loop on Windows
+        asyncio.set_event_loop(asyncio.ProactorEventLoop())
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(launch(args, extra_args, loop))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,29 @@
+import sys
+from cogs.utils.profiling import StartupProfiler
+
+# Started before anything else so that the import times of discord.py
+# and friends are part of the profile
+startup_profiler = StartupProfiler(enabled="--profile-startup" in sys.argv)
+startup_profiler.start()
+
 from discord.ext import commands
 import discord
 from cogs.utils.settings import Settings
+from cogs.utils.stats import BotStats
+from cogs.utils.privileges import PrivilegeCache
+from cogs.utils.help import CachedHelpFormatter
+from cogs.utils.prefixes import PrefixManager
+from cogs.utils.ratelimit import RateLimiter
+from cogs.utils.executor import CommandExecutor
+from cogs.utils.http import HTTPService
+from cogs.utils.lifecycle import Bot
 from cogs.utils.dataIO import dataIO
 from cogs.utils.chat_formatting import inline
+from cogs.utils import logs, coordinator, metrics
 import asyncio
 import os
 import time
-import sys
 import logging
-import logging.handlers
 import shutil
 import traceback
 
@@ -23,21 +38,57 @@ import traceback
 
 description = "Red - A multifunction Discord bot by Twentysix"
 
-formatter = commands.HelpFormatter(show_check_failure=False)
+formatter = CachedHelpFormatter(show_check_failure=False)
+
+def get_option(name, default=None):
+    """Value following name in the command line arguments"""
+    try:
+        return sys.argv[sys.argv.index(name) + 1]
+    except (ValueError, IndexError):
+        return default
 
-bot = commands.Bot(command_prefix=["_"], formatter=formatter,
-                   description=description, pm_help=None)
+
+# Set by launcher.py when running as one of several shards
+shard_id = int(get_option("--shard-id", 0))
+shard_count = int(get_option("--shard-count", 1))
+sharded = shard_count > 1
+
+bot = Bot(command_prefix=["_"], formatter=formatter,
+          description=description, pm_help=None,
+          shard_id=shard_id if sharded else None,
+          shard_count=shard_count if sharded else None)
 
 settings = Settings()
+bot.command_prefix = PrefixManager(settings)
+
+bot.rate_limiter = RateLimiter(settings.rate_limits)
+bot.executor = CommandExecutor(bot.process_commands, bot.loop,
+                               settings.executor)
+bot.http_service = HTTPService(bot.loop, settings.http)
+bot.add_flush_hook(bot.http_service.close)
+
+bot.stats = BotStats()
+bot.privileges = PrivilegeCache(settings)
+for component in (bot.stats, bot.privileges):
+    for event, listener in component.listeners():
+        bot.add_listener(listener, event)
+
+bot.metrics = metrics.registry
+messages_received = bot.metrics.counter("red_messages_total",
+                                        "Messages received")
+metrics.register_bot(bot)
 
 
 @bot.event
 async def on_ready():
+    startup_profiler.end("connect")
+    startup_profiler.mark("on_ready")
     owner_cog = bot.get_cog('Owner')
     total_cogs = len(owner_cog._list_cogs())
-    users = len(set(bot.get_all_members()))
-    servers = len(bot.servers)
-    channels = len([c for c in bot.get_all_channels()])
+    bot.stats.sync(bot.servers)
+    users = bot.stats.users
+    servers = bot.stats.servers
+    channels = bot.stats.total_channels
     if not hasattr(bot, "uptime"):
         bot.uptime = int(time.perf_counter())
     if settings.login_type == "token" and settings.owner == "id_here":
@@ -61,6 +112,8 @@ async def on_ready():
         print(url)
         print("------")
     await bot.get_cog('Owner').disable_commands()
+    startup_profiler.end("on_ready")
+    startup_profiler.finish("data/red/startup_profile.json")
 
 
 @bot.event
@@ -70,8 +123,20 @@ async def on_command(command, ctx):
 
 @bot.event
 async def on_message(message):
-    if user_allowed(message):
-        await bot.process_commands(message)
+    messages_received.inc()
+    if not user_allowed(message):
+        return
+    command, subcommand = find_command(message)
+    if command is None:
+        return
+    if not within_rate_limit(message, command, subcommand):
+        return
+    queued = bot.executor.submit(message, cog=command.cog_name,
+                                 priority=is_privileged(message))
+    if not queued:
+        logger.debug("Command queue is full, dropped '{}' from {}({})"
+                     "".format(command.name, message.author,
+                               message.author.id))
 
 
 @bot.event
@@ -115,17 +180,8 @@ def user_allowed(message):
     mod = bot.get_cog('Mod')
 
     if mod is not None:
-        if settings.owner == author.id:
+        if is_privileged(message):
             return True
-        if not message.channel.is_private:
-            server = message.server
-            names = (settings.get_server_admin(
-                server), settings.get_server_mod(server))
-            results = map(
-                lambda name: discord.utils.get(author.roles, name=name), names)
-            for r in results:
-                if r is not None:
-                    return True
 
         if author.id in mod.blacklist_list:
             return False
@@ -145,6 +201,35 @@ def user_allowed(message):
         return True
 
 
+def is_privileged(message):
+    """Owner, admins and mods"""
+    return bot.privileges.is_mod(message.author, message.server)
+
+
+def find_command(message):
+    """Returns the command a message invokes and the word following it
+    without doing the full parsing. (None, None) if it isn't a command"""
+    content = message.content
+    server_id = message.server.id if message.server else None
+    prefix = bot.command_prefix.match(content, server_id)
+    if prefix is None:
+        return None, None
+    args = content[len(prefix):].split(None, 2)
+    if not args or args[0] not in bot.commands:
+        return None, None
+    subcommand = args[1] if len(args) > 1 else None
+    return bot.commands[args[0]], subcommand
+
+
+def within_rate_limit(message, command, subcommand):
+    """Sheds commands coming from users, channels or servers that are over
+    their budget"""
+    if message.author.id == settings.owner:
+        return True
+    cost = bot.rate_limiter.cost(command.name, subcommand)
+    return bot.rate_limiter.allow(message, cost)
+
+
 async def get_oauth_url():
     try:
         data = await bot.application_info()
@@ -179,62 +264,64 @@ def check_configs():
         print("and obtain your bot's token like described.")
         print("\nInsert your bot's token:")
 
-        choice = input("> ")
-
-        if "@" not in choice and len(choice) >= 50:  # Assuming token
-            settings.login_type = "token"
-            settings.email = choice
-        elif "@" in choice:
-            settings.login_type = "email"
-            settings.email = choice
-            settings.password = input("\nPassword> ")
-        else:
-            os.remove('data/red/settings.json')
-            input("Invalid input. Restart Red and repeat the configuration "
-                  "process.")
-            exit(1)
-
-        print("\nChoose a prefix. A prefix is what you type before a command.\n"
-              "A typical prefix would be the exclamation mark.\n"
-              "Can be multiple characters. You will be able to change it "
-              "later and add more of them.\nChoose your prefix:")
-        confirmation = False
-        while confirmation is False:
-            new_prefix = ensure_reply("\nPrefix> ").strip()
-            print("\nAre you sure you want {0} as your prefix?\nYou "
-                  "will be able to issue commands like this: {0}help"
-                  "\nType yes to confirm or no to change it".format(new_prefix))
-            confirmation = get_answer()
-
-        settings.prefixes = [new_prefix]
-        if settings.login_type == "email":
-            print("\nOnce you're done with the configuration, you will have to type "
-                  "'{}set owner' *in Discord's chat*\nto set yourself as owner.\n"
-                  "Press enter to continue".format(new_prefix))
-            settings.owner = input("") # Shh, they will never know it's here
-            if settings.owner == "":
-                settings.owner = "id_here"
-            if not settings.owner.isdigit() or len(settings.owner) < 17:
-                if settings.owner != "id_here":
-                    print("\nERROR: What you entered is not a valid ID. Set "
-                          "yourself as owner later with {}set owner".format(new_prefix))
+        # Written once at the end, an interrupted setup saves nothing
+        with settings.transaction():
+            choice = input("> ")
+
+            if "@" not in choice and len(choice) >= 50:  # Assuming token
+                settings.login_type = "token"
+                settings.email = choice
+            elif "@" in choice:
+                settings.login_type = "email"
+                settings.email = choice
+                settings.password = input("\nPassword> ")
+            else:
+                os.remove('data/red/settings.json')
+                input("Invalid input. Restart Red and repeat the configuration "
+                      "process.")
+                exit(1)
+
+            print("\nChoose a prefix. A prefix is what you type before a command.\n"
+                  "A typical prefix would be the exclamation mark.\n"
+                  "Can be multiple characters. You will be able to change it "
+                  "later and add more of them.\nChoose your prefix:")
+            confirmation = False
+            while confirmation is False:
+                new_prefix = ensure_reply("\nPrefix> ").strip()
+                print("\nAre you sure you want {0} as your prefix?\nYou "
+                      "will be able to issue commands like this: {0}help"
+                      "\nType yes to confirm or no to change it".format(new_prefix))
+                confirmation = get_answer()
+
+            settings.prefixes = [new_prefix]
+            if settings.login_type == "email":
+                print("\nOnce you're done with the configuration, you will have to type "
+                      "'{}set owner' *in Discord's chat*\nto set yourself as owner.\n"
+                      "Press enter to continue".format(new_prefix))
+                settings.owner = input("") # Shh, they will never know it's here
+                if settings.owner == "":
+                    settings.owner = "id_here"
+                if not settings.owner.isdigit() or len(settings.owner) < 17:
+                    if settings.owner != "id_here":
+                        print("\nERROR: What you entered is not a valid ID. Set "
+                              "yourself as owner later with {}set owner".format(new_prefix))
+                    settings.owner = "id_here"
+            else:
                 settings.owner = "id_here"
-        else:
-            settings.owner = "id_here"
-
-        print("\nInput the admin role's name. Anyone with this role in Discord will be "
-              "able to use the bot's admin commands")
-        print("Leave blank for default name (Transistor)")
-        settings.default_admin = input("\nAdmin role> ")
-        if settings.default_admin == "":
-            settings.default_admin = "Transistor"
-
-        print("\nInput the moderator role's name. Anyone with this role in Discord will "
-              "be able to use the bot's mod commands")
-        print("Leave blank for default name (Process)")
-        settings.default_mod = input("\nModerator role> ")
-        if settings.default_mod == "":
-            settings.default_mod = "Process"
+
+            print("\nInput the admin role's name. Anyone with this role in Discord will be "
+                  "able to use the bot's admin commands")
+            print("Leave blank for default name (Transistor)")
+            settings.default_admin = input("\nAdmin role> ")
+            if settings.default_admin == "":
+                settings.default_admin = "Transistor"
+
+            print("\nInput the moderator role's name. Anyone with this role in Discord will "
+                  "be able to use the bot's mod commands")
+            print("Leave blank for default name (Process)")
+            settings.default_mod = input("\nModerator role> ")
+            if settings.default_mod == "":
+                settings.default_mod = "Process"
 
         print("\nThe configuration is done. Leave this window always open to keep "
               "Red online.\nAll commands will have to be issued through Discord's "
@@ -247,15 +334,15 @@ def check_configs():
 
 def set_logger():
     global logger
+    logs.set_structured("--json-logs" in sys.argv)
+
     logger = logging.getLogger("discord")
     logger.setLevel(logging.WARNING)
-    handler = logging.FileHandler(
-        filename='data/red/discord.log', encoding='utf-8', mode='a')
-    handler.setFormatter(logging.Formatter(
+    handler = logs.file_handler('data/red/discord.log', logging.Formatter(
         '%(asctime)s %(levelname)s %(module)s %(funcName)s %(lineno)d: '
         '%(message)s',
         datefmt="[%d/%m/%Y %H:%M]"))
-    logger.addHandler(handler)
+    logs.add_queued_handlers(logger, handler)
 
     logger = logging.getLogger("red")
     logger.setLevel(logging.INFO)
@@ -269,13 +356,12 @@ def set_logger():
     stdout_handler.setFormatter(red_format)
     stdout_handler.setLevel(logging.INFO)
 
-    fhandler = logging.handlers.RotatingFileHandler(
-        filename='data/red/red.log', encoding='utf-8', mode='a',
-        maxBytes=10**7, backupCount=5)
-    fhandler.setFormatter(red_format)
+    # Shards can't share a rotating log file
+    log_name = "red-shard{}.log".format(shard_id) if sharded else "red.log"
+    fhandler = logs.file_handler('data/red/' + log_name, red_format,
+                                 max_bytes=10**7, backup_count=5)
 
-    logger.addHandler(fhandler)
-    logger.addHandler(stdout_handler)
+    logs.add_queued_handlers(logger, fhandler, stdout_handler)
 
 def ensure_reply(msg):
     choice = ""
@@ -293,19 +379,54 @@ def get_answer():
     else:
         return False
 
+def on_coordinator_lost():
+    """Saves can't be made anymore, the launcher restarts this shard once
+    it has stopped"""
+    bot.loop.create_task(bot.shutdown())
+
+
+def on_settings_changed(path, data):
+    """Another shard changed settings.json"""
+    settings.reload(data)
+    bot.command_prefix.refresh()
+
+
+@asyncio.coroutine
+def connect_coordinator():
+    address = os.environ.get(coordinator.ENV_ADDRESS)
+    if not sharded or address is None:
+        return
+    token = os.environ.get(coordinator.ENV_TOKEN, "")
+    yield from coordinator.connect(address, token, shard_id, bot.loop,
+                                   on_lost=on_coordinator_lost)
+    coordinator.watch(settings.path, on_settings_changed)
+    bot.add_flush_hook(coordinator.flush)
+    print("Running as shard {}/{}".format(shard_id + 1, shard_count))
+
+
+@asyncio.coroutine
+def start_metrics_server():
+    port = get_option("--metrics-port")
+    if port is None:
+        return
+    # Shards of the same bot get consecutive ports
+    port = int(port) + (shard_id if sharded else 0)
+    server = metrics.MetricsServer(bot.loop)
+    try:
+        yield from server.start(port)
+    except OSError as e:
+        logger.error("Couldn't serve metrics on port {}: {}".format(port, e))
+        return
+    bot.add_flush_hook(server.close)
+
+
 def set_cog(cog, value):
     data = dataIO.load_json("data/red/cogs.json")
     data[cog] = value
     dataIO.save_json("data/red/cogs.json", data)
 
 def load_cogs():
-    try:
-        if sys.argv[1] == "--no-prompt":
-            no_prompt = True
-        else:
-            no_prompt = False
-    except:
-        no_prompt = False
+    no_prompt = "--no-prompt" in sys.argv
 
     try:
         registry = dataIO.load_json("data/red/cogs.json")
@@ -365,14 +486,16 @@ def main():
     global settings
 
     check_folders()
-    check_configs()
-    set_logger()
-    owner_cog = load_cogs()
-    if settings.prefixes != []:
-        bot.command_prefix = settings.prefixes
-    else:
+    with startup_profiler.phase("check_configs"):
+        check_configs()
+    with startup_profiler.phase("set_logger"):
+        set_logger()
+    yield from connect_coordinator()
+    yield from start_metrics_server()
+    with startup_profiler.phase("load_cogs"):
+        owner_cog = load_cogs()
+    if settings.prefixes == []:
         print("No prefix set. Defaulting to !")
-        bot.command_prefix = ["!"]
         if settings.owner != "id_here":
             print("Use !set prefix to set it.")
         else:
@@ -391,6 +514,7 @@ def main():
         print("and: pip3 install -U git+https://github.com/Rapptz/"
               "discord.py@master#egg=discord.py[voice]")
     print("Official server: https://discord.me/Red-DiscordBot")
+    startup_profiler.mark("login")
     if settings.login_type == "token":
         try:
             yield from bot.login(settings.email)
@@ -403,6 +527,8 @@ def main():
             sys.exit(msg)
     else:
         yield from bot.login(settings.email, settings.password)
+    startup_profiler.end("login")
+    startup_profiler.mark("connect")
     yield from bot.connect()
 
 if __name__ == '__main__':
@@ -411,18 +537,23 @@ if __name__ == '__main__':
         loop.run_until_complete(main())
     except discord.LoginFailure:
         logger.error(traceback.format_exc())
-        choice = input("Invalid login credentials. "
-            "If they worked before Discord might be having temporary "
-            "technical issues.\nIn this case, press enter and "
-            "try again later.\nOtherwise you can type 'reset' to "
-            "delete the current configuration and redo the setup process "
-            "again the next start.\n> ")
-        if choice.strip() == "reset":
-            shutil.copy('data/red/settings.json',
-                        'data/red/settings-{}.bak'.format(int(time.time())))
-            os.remove('data/red/settings.json')
+        if not sharded:
+            choice = input("Invalid login credentials. "
+                "If they worked before Discord might be having temporary "
+                "technical issues.\nIn this case, press enter and "
+                "try again later.\nOtherwise you can type 'reset' to "
+                "delete the current configuration and redo the setup process "
+                "again the next start.\n> ")
+            if choice.strip() == "reset":
+                shutil.copy('data/red/settings.json',
+                            'data/red/settings-{}.bak'.format(int(time.time())))
+                os.remove('data/red/settings.json')
     except:
         logger.error(traceback.format_exc())
-        loop.run_until_complete(bot.logout())
+        loop.run_until_complete(bot.shutdown())
+        if sharded:
+            sys.exit(1)  # Has the launcher restart this shard
     finally:
         loop.close()
+    if coordinator.is_lost():
+        sys.exit(1)